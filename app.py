@@ -5,16 +5,25 @@ import socket
 import time
 import signal
 import os
+import secrets
 import psutil
 
-PORT = 6210
+PORT = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--port=")), 6210) # --port=N for a second server
+MEDIA_PORT = PORT + 1
+HTTP_PORT = PORT + 2
 URL = f"http://127.0.0.1:{PORT}"
 BACKEND_MODULE = "backend.server:api"
+HTTP_MODULE = "backend.rest:api"
+WORKER_MODULE = "backend.worker"
+WORKERS = 2 # media worker processes, --workers=N
+RESTART_DELAY = 2 # seconds before a media worker that exited is started again
 
 class VocalLinkRunner:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, workers=WORKERS, http_workers=0):
         self.debug = debug
         self.processes = []
+        self.workers = [None] * workers
+        self.http_workers = http_workers
         self.is_shutting_down = False
 
     def nuke_orphans(self):
@@ -24,19 +33,27 @@ class VocalLinkRunner:
         try:
             connections = psutil.net_connections(kind='inet')
             for conn in connections:
-                if conn.laddr.port == PORT and conn.pid:
+                if conn.laddr.port in (PORT, HTTP_PORT) and conn.pid:
                     self._kill_process_tree(conn.pid)
                     found_orphan = True
         except (RuntimeError, PermissionError):
             for proc in psutil.process_iter(['pid', 'name']):
                 try:
                     for conn in proc.net_connections(kind='inet'):
-                        if conn.laddr.port == PORT:
+                        if conn.laddr.port in (PORT, HTTP_PORT):
                             self._kill_process_tree(proc.pid)
                             found_orphan = True
                 except (psutil.NoSuchProcess, psutil.AccessDenied):
                     continue
         
+        # media workers of a runner that died connect out, they hold no port.
+        # Those of a server on another port belong to another runner
+        for proc in psutil.process_iter(['pid', 'cmdline']):
+            cmdline = proc.info['cmdline'] or []
+            if WORKER_MODULE in cmdline and str(MEDIA_PORT) in cmdline and proc.pid != os.getpid():
+                self._kill_process_tree(proc.pid)
+                found_orphan = True
+
         if not found_orphan:
             print("[*] No orphans found. Clean start.")
         else:
@@ -81,13 +98,43 @@ class VocalLinkRunner:
         self.processes.append(proc)
         return proc
 
+    def start_http_workers(self):
+        # uvicorn's own supervisor forks them on one socket and replaces those that die
+        print(f"[*] Starting {self.http_workers} HTTP worker(s) on port {HTTP_PORT}...")
+        cmd = [sys.executable, "-m", "uvicorn", HTTP_MODULE, "--host", "0.0.0.0", "--port", str(HTTP_PORT),
+               "--workers", str(self.http_workers)]
+        proc = subprocess.Popen(cmd, env=dict(os.environ, VOCALINK_LOG_FILE="http.log"))
+        self.processes.append(proc)
+        return proc
+
+    def start_worker(self, i):
+        env = dict(os.environ, VOCALINK_LOG_FILE=f"media-{i}.log")
+        proc = subprocess.Popen([sys.executable, "-m", WORKER_MODULE, "--port", str(MEDIA_PORT)], env=env)
+        self.workers[i] = proc
+        return proc
+
+    def start_workers(self):
+        print(f"[*] Starting {len(self.workers)} media worker(s)...")
+        for i in range(len(self.workers)):
+            self.start_worker(i)
+
+    def watch_workers(self):
+        for i, proc in enumerate(self.workers):
+            if proc is None or proc.poll() is None:
+                continue
+            print(f"[!] Media worker {proc.pid} exited ({proc.returncode}), restarting in {RESTART_DELAY}s...")
+            self.workers[i] = None
+            time.sleep(RESTART_DELAY)
+            if not self.is_shutting_down:
+                self.start_worker(i)
+
     def cleanup(self):
         if self.is_shutting_down:
             return
         self.is_shutting_down = True
         print("\n[*] Shutting down...")
         
-        for proc in self.processes:
+        for proc in self.processes + [w for w in self.workers if w]:
             try:
                 p = psutil.Process(proc.pid)
                 for child in p.children(recursive=True):
@@ -109,8 +156,17 @@ class VocalLinkRunner:
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
 
+        # lets the server tell its media workers from anything else on localhost
+        os.environ["VOCALINK_MEDIA_KEY"] = secrets.token_hex(16)
+        # the server, its workers and HTTP workers take their ports from it
+        os.environ["VOCALINK_PORT"] = str(PORT)
+        if self.http_workers:
+            # the server then shares its state with them
+            os.environ["VOCALINK_HTTP_WORKERS"] = str(self.http_workers)
+
         try:
             self.start_backend()
+            self.start_workers()
             
             if self.debug:
                 self.start_tsc()
@@ -121,11 +177,15 @@ class VocalLinkRunner:
                 print("[!] Backend failed to start.")
                 return
 
+            if self.http_workers:
+                self.start_http_workers()
+
             print("[*] Launching Browser...")
             webbrowser.open(URL)
 
             while not self.is_shutting_down:
                 time.sleep(1)
+                self.watch_workers()
                 
         except Exception as e:
             print(f"[!] Error: {e}")
@@ -134,4 +194,6 @@ class VocalLinkRunner:
 
 if __name__ == "__main__":
     is_debug = "--debug" in sys.argv
-    VocalLinkRunner(debug=is_debug).run()
+    workers = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--workers=")), WORKERS)
+    http_workers = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--http-workers=")), 0)
+    VocalLinkRunner(debug=is_debug, workers=workers, http_workers=http_workers).run()
@@ -0,0 +1,150 @@
+from typing import Dict, Optional, Set, Tuple
+import glob
+import hashlib
+import os
+import shutil
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+
+
+# originals are stored once per content, named by the sha256 of their bytes,
+# which is taken while they are written. original/{rid}{ext} stays where
+# everything looks for a recording's audio, as a hardlink to its blob (a copy
+# where the filesystem has none). What is derived from the audio alone sits next
+# to the blob and serves every recording of it, per-rid paths link to it too:
+# blobs/{hh}/{hash}                             the audio
+# blobs/{hh}/{hash}.regions.json                speech regions
+# blobs/{hh}/{hash}.transcript.json             transcript
+# blobs/{hh}/{hash}.enhanced-{props}-{key}{ext} enhanced render, per enhance props, key
+#                                               hashes the enhance settings and noise profile
+# blobs/{hh}/{hash}.ogg                         the audio transcoded once it went cold
+# Loudness stats and merges are remembered in memory, as are the references:
+# storage/ is wiped on start. A recording whose blob was transcoded (see
+# backend/handlers/StorageHandler.py) has its original at original/{rid}.ogg,
+# the blob goes once no recording reads it untranscoded.
+HASH_BYTES = 1024 * 1024
+COMPACT = ".ogg"
+
+
+def new_digest():
+    return hashlib.sha256()
+
+
+def digest_file(path: str) -> str:
+    """sha256 of a file written by someone else, e.g. a merge."""
+    digest = new_digest()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link(src: str, dst: str):
+    """Makes dst the same file as src, replacing whatever dst was."""
+    temp = f"{dst}.link"
+    try:
+        os.link(src, temp)
+    except OSError:
+        shutil.copyfile(src, temp)
+    os.replace(temp, dst)
+
+
+class BlobStore:
+    """Content addressed originals and what is derived from them. Not locked,
+    RecordingsHandler calls it with its lock held."""
+
+    def __init__(self, root: str = "storage"):
+        self.dir: str = os.path.join(root, "blobs")
+        os.makedirs(self.dir, exist_ok=True)
+        self._refs: Dict[str, Set[str]] = {} # hash, rids
+        self._blobs: Dict[str, str] = {} # rid, hash
+        self.compact: Set[str] = set() # rids whose original is the COMPACT form of their blob
+        self.stats: Dict[str, P.RecStats] = {} # hash, loudness stats
+        self.merges: Dict[Tuple[str, ...], Tuple[str, float]] = {} # input hashes, (hash, duration)
+
+
+    def path(self, hash: str, suffix: str = "") -> str:
+        return os.path.join(self.dir, hash[:2], hash + suffix)
+
+
+    def of(self, rid: str) -> Optional[str]:
+        return self._blobs.get(rid)
+
+
+    def refs(self, hash: str) -> Set[str]:
+        return set(self._refs.get(hash, ()))
+
+
+    def derived(self, rid: str, suffix: str) -> Optional[str]:
+        """Where the artifact of rid's audio named by suffix goes, None while
+        rid has no blob."""
+        hash = self._blobs.get(rid)
+        return self.path(hash, suffix) if hash else None
+
+
+    def store(self, rid: str, hash: str, temp_path: str, original: str) -> bool:
+        """Takes temp_path in as the blob of hash, or drops it when the blob is
+        there already, and links original to it. Returns whether the content
+        was new."""
+        blob = self.path(hash)
+        new = not os.path.exists(blob)
+        if new:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(temp_path, blob)
+        else:
+            os.remove(temp_path)
+        link(blob, original)
+
+        if self._blobs.get(rid) not in (None, hash):
+            self.release(rid)
+        self._blobs[rid] = hash
+        self._refs.setdefault(hash, set()).add(rid)
+        self.compact.discard(rid)
+        return new
+
+
+    def link_blob(self, rid: str, hash: str, original: str):
+        """Gives rid an existing blob, e.g. a merge done before."""
+        link(self.path(hash), original)
+        self._blobs[rid] = hash
+        self._refs.setdefault(hash, set()).add(rid)
+
+
+    def compacted(self, hash: str, rids: Set[str]):
+        """rids now read the COMPACT form of hash, which is in place. The blob
+        goes unless another recording still reads it."""
+        self.compact.update(rids)
+        self._drop_unread(hash)
+
+
+    def _drop_unread(self, hash: str):
+        if all(rid in self.compact for rid in self._refs.get(hash, ())):
+            try:
+                os.remove(self.path(hash))
+            except FileNotFoundError:
+                pass
+
+
+    def release(self, rid: str):
+        """Drops rid's reference, the blob and its artifacts go with the last."""
+        hash = self._blobs.pop(rid, None)
+        self.compact.discard(rid)
+        if not hash:
+            return
+        refs = self._refs.get(hash)
+        if refs:
+            refs.discard(rid)
+            if refs:
+                self._drop_unread(hash)
+                return
+        self._refs.pop(hash, None)
+        self.stats.pop(hash, None)
+        for key in [k for k, (merged, _) in self.merges.items() if merged == hash or hash in k]:
+            del self.merges[key]
+        for path in glob.glob(glob.escape(self.path(hash)) + "*"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.error(f"Failed to delete blob file {path}: {e}")
+
@@ -0,0 +1,80 @@
+from typing import AsyncIterator
+import asyncio
+import os
+
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydub import AudioSegment
+
+import backend.core.primitives as P
+from backend.core.Transcodes import CONTAINER_ARGS, media_type
+from backend.utils.logging import log
+
+
+# GET /recordings/{rid}/clip?start=&end=[&enhanced=true] cuts start..end
+# seconds out of a recording without decoding it. ffmpeg seeks in the
+# container (-ss before -i: the mp4 index, ogg bisection, mp3/wav bitrate)
+# and copies the packets from there to end into a container of the same
+# format, written to its stdout and streamed on as it comes. The work done
+# follows the clip's length, not the recording's. Audio packets decode on
+# their own, so nothing is re-encoded and the cut lands within a packet
+# (20-26 ms) of start and end. mp4 (.m4a, .mp4) goes out fragmented, a pipe
+# can't be seeked back to write its index.
+START_QUERY = Query(..., ge=0, description="seconds from the start of the recording")
+END_QUERY = Query(..., gt=0, description="seconds from the start of the recording")
+READ_BYTES = 64 * 1024
+
+
+async def clip_response(src: str, name: str, start: float, end: float) -> StreamingResponse:
+    """start..end seconds of src, streamed. name is the recording's, the
+    download is named after it and the range."""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    ext = os.path.splitext(src)[1].lower()
+    if ext not in P.SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Can't clip {ext}")
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-ss", f"{start:.3f}", "-i", src, "-t", f"{end - start:.3f}",
+            "-map", "0:a:0", "-c", "copy", *CONTAINER_ARGS.get(ext, []),
+            "-f", P.SUPPORTED_FORMATS[ext]["format"], "pipe:1",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except OSError as e:
+        log.error(f"Clipping {src} failed, ffmpeg didn't start: {e}")
+        raise HTTPException(status_code=503, detail="Clipping is unavailable")
+    try:
+        first = await proc.stdout.read(READ_BYTES)
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    if not first:
+        _, err = await proc.communicate()
+        if proc.returncode != 0:
+            log.error(f"Clipping {src} failed: {err.decode(errors='replace').strip()}")
+            raise HTTPException(status_code=500, detail="Clipping failed")
+        raise HTTPException(status_code=416, detail="Nothing to clip between start and end")
+
+    return StreamingResponse(
+        _stream(proc, first, src),
+        media_type=media_type(src),
+        headers={"Content-Disposition": f'attachment; filename="{name}_{start:g}-{end:g}{ext}"'}
+    )
+
+
+async def _stream(proc: asyncio.subprocess.Process, first: bytes, src: str) -> AsyncIterator[bytes]:
+    try:
+        yield first
+        while chunk := await proc.stdout.read(READ_BYTES):
+            yield chunk
+        _, err = await proc.communicate()
+        if proc.returncode != 0:
+            log.error(f"Clipping {src} failed while it was served: {err.decode(errors='replace').strip()}")
+    finally:
+        # the download was dropped, the rest isn't wanted
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
@@ -0,0 +1,220 @@
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+from bisect import bisect_left
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+from backend.utils.utils import now_ms
+
+
+WINDOW = 16 # samples kept per session
+DELAY_PERCENTILE = 0.9
+MAX_SYNC_AGE = 10_000 # ms, older estimates are ignored
+
+SAFETY_MS = 100
+FANOUT_MS = 1 # per session, broadcast is serialised on the event loop
+MIN_DELAY = 200
+DEFAULT_DELAY = 600
+DRIFT_SMOOTHING = 0.3
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))
+    return ordered[idx]
+
+
+class ClockFilter:
+    """Ring buffer of the latest (rtt, theta) samples reported by one session."""
+    __slots__ = ('_rtt', '_theta', '_head', '_count', 'theta', 'bound', 'updatedAt', 'drift')
+
+    def __init__(self, size: int = WINDOW):
+        self._rtt: List[float] = [0.0] * size
+        self._theta: List[float] = [0.0] * size
+        self._head: int = 0
+        self._count: int = 0
+        self.theta: Optional[float] = None # offset of the min-rtt sample
+        self.bound: Optional[float] = None # percentile rtt, upper bound on delivery
+        self.updatedAt: Optional[int] = None
+        self.drift: float = 0.0 # ms of offset change per second, smoothed
+
+
+    def add(self, rtt: float, theta: float, at: int):
+        prev_theta, prev_at = self.theta, self.updatedAt
+
+        size = len(self._rtt)
+        self._rtt[self._head] = rtt
+        self._theta[self._head] = theta
+        self._head = (self._head + 1) % size
+        self._count = min(self._count + 1, size)
+
+        rtts = self._rtt[:self._count]
+        # NTP style: the fastest round trip saw the least queueing, so it
+        # carries the least asymmetry and the most trustworthy offset
+        best = min(range(self._count), key=rtts.__getitem__)
+        self.theta = self._theta[best]
+        self.bound = percentile(rtts, DELAY_PERCENTILE)
+        self.updatedAt = at
+
+        if prev_theta is not None and prev_at is not None and at - prev_at >= 1000:
+            rate = abs(self.theta - prev_theta) * 1000 / (at - prev_at)
+            self.drift = DRIFT_SMOOTHING * rate + (1 - DRIFT_SMOOTHING) * self.drift
+
+
+    @property
+    def jitter(self) -> float:
+        if not self._count or self.bound is None:
+            return 0.0
+        return self.bound - min(self._rtt[:self._count])
+
+
+    def samples(self) -> List[Tuple[float, float]]:
+        return list(zip(self._rtt[:self._count], self._theta[:self._count]))
+
+
+class DelayAggregate:
+    """Keeps the worst delivery bound across sessions without rescanning on every action."""
+
+    def __init__(self):
+        self._bounds: Dict[str, Tuple[float, int]] = {} # sessionId, (bound, updatedAt)
+        self._max_id: Optional[str] = None
+        self._dirty: bool = False
+
+
+    def update(self, id: str, bound: float, at: int):
+        old = self._bounds.get(id)
+        self._bounds[id] = (bound, at)
+        if self._dirty:
+            return
+        if id == self._max_id and old is not None and bound < old[0]:
+            self._dirty = True # the max shrank, someone else may be larger now
+        elif self._max_id is None or bound >= self._bounds[self._max_id][0]:
+            self._max_id = id
+
+
+    def remove(self, id: str):
+        if self._bounds.pop(id, None) is not None and self._max_id == id:
+            self._dirty = True
+
+
+    def _recompute(self, now: int):
+        self._max_id = None
+        best = -1.0
+        for id, (bound, at) in self._bounds.items():
+            if now - at > MAX_SYNC_AGE:
+                continue
+            if bound > best:
+                best = bound
+                self._max_id = id
+        self._dirty = False
+
+
+    def max_bound(self, now: int) -> Optional[float]:
+        if self._max_id is not None and not self._dirty:
+            bound, at = self._bounds[self._max_id]
+            if now - at <= MAX_SYNC_AGE:
+                return bound
+        self._recompute(now)
+        return self._bounds[self._max_id][0] if self._max_id else None
+
+
+    def delay(self, sessions: int, now: Optional[int] = None) -> int:
+        bound = self.max_bound(now if now is not None else now_ms())
+        if bound is None:
+            return DEFAULT_DELAY
+        return max(MIN_DELAY, int(bound + FANOUT_MS * sessions) + SAFETY_MS)
+
+
+SKEW_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500) # ms, upper bounds
+ROUND_TIMEOUT = 5_000 # ms after the trigger time
+RECENT_ROUNDS = 20
+
+
+class SkewRound:
+    __slots__ = ('event', 'triggerTime', 'pending', 'starts')
+
+    def __init__(self, event: P.WSEvents, triggerTime: int, ids: List[str]):
+        self.event: P.WSEvents = event
+        self.triggerTime: int = triggerTime
+        self.pending: Set[str] = set(ids)
+        self.starts: Dict[str, int] = {} # sessionId, start time in server clock
+
+
+    def result(self) -> P.SkewSample:
+        starts = list(self.starts.values())
+        return P.SkewSample(
+            event=self.event,
+            triggerTime=self.triggerTime,
+            sessions=len(starts),
+            missing=len(self.pending),
+            skew=max(starts) - min(starts),
+            maxError=max(abs(s - self.triggerTime) for s in starts),
+        )
+
+
+class SkewTracker:
+    """Collects the start times sessions report for a synchronised action and
+    keeps a histogram of the achieved spread across the group."""
+
+    def __init__(self):
+        self._rounds: Dict[P.WSEvents, SkewRound] = {}
+        self._counts: List[int] = [0] * (len(SKEW_BUCKETS) + 1)
+        self._sum: int = 0
+        self._recent: Deque[P.SkewSample] = deque(maxlen=RECENT_ROUNDS)
+
+
+    def open(self, event: P.WSEvents, triggerTime: int, ids: List[str]):
+        self.expire(now_ms())
+        previous = self._rounds.pop(event, None)
+        if previous:
+            self._close(previous)
+        if ids:
+            self._rounds[event] = SkewRound(event, triggerTime, ids)
+
+
+    # at is in the session clock, theta = server - session
+    def record(self, event: P.WSEvents, id: str, at: int, theta: Optional[float]):
+        r = self._rounds.get(event)
+        if not r or id not in r.pending:
+            return
+        r.pending.discard(id)
+        r.starts[id] = int(at + (theta or 0))
+        if not r.pending:
+            del self._rounds[event]
+            self._close(r)
+
+
+    def expire(self, now: int):
+        for event, r in list(self._rounds.items()):
+            if now - r.triggerTime > ROUND_TIMEOUT:
+                del self._rounds[event]
+                self._close(r)
+
+
+    def _close(self, r: SkewRound):
+        if len(r.starts) < 2:
+            return
+        sample = r.result()
+        self._counts[bisect_left(SKEW_BUCKETS, sample.skew)] += 1
+        self._sum += sample.skew
+        self._recent.append(sample)
+        log.info(
+            "[SYNC] %s skew %sms across %s sessions (%s missing)",
+            sample.event.value, sample.skew, sample.sessions, sample.missing
+        )
+
+
+    def report(self) -> P.SkewReport:
+        self.expire(now_ms())
+        buckets = {str(le): 0 for le in SKEW_BUCKETS}
+        buckets["+Inf"] = 0
+        total = 0
+        for le, count in zip(buckets, self._counts):
+            total += count
+            buckets[le] = total # cumulative, prometheus style
+        return P.SkewReport(
+            count=total,
+            sum=self._sum,
+            buckets=buckets,
+            recent=list(self._recent),
+        )
@@ -0,0 +1,392 @@
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+
+
+# GET /export?sessionId= and POST /export {"rids": [...]} stream a ZIP of
+# recordings, put together while it is sent, on the server and on the HTTP
+# workers alike:
+# manifest.json                       every RecMetadata and its files here
+# {recName}_{rid[:8]}/original{ext}   stored, as kept in storage/
+# {recName}_{rid[:8]}/enhanced{ext}   stored
+# {recName}_{rid[:8]}/transcript.json deflated
+# {recName}_{rid[:8]}/transcript.srt  deflated, made from the json
+# The layout is worked out before the first byte: audio goes in as is, its
+# size is known, and the text files are small enough to compress once to
+# learn theirs. So the archive has a Content-Length and an ETag, and a Range
+# request (with If-Range) resumes it anywhere. Audio entries carry their
+# CRC in a data descriptor after the data, taken while it is sent; a resume
+# that skipped the data reads the file again for it, unless this process
+# already knows it. Memory stays at one chunk plus one transcript, nothing
+# touches the disk. Zip64 records go in where sizes or offsets need them.
+READ_BYTES = 1024 * 1024
+DEFLATE_LEVEL = 6
+CRC_CACHE = 4096 # files whose CRC this process remembers
+ZIP64_LIMIT = 0xFFFFFFFF
+UTF8_NAMES = 0x0800
+DATA_DESCRIPTOR = 0x0008
+STORED = 0
+DEFLATED = 8
+
+_crcs: "OrderedDict[Tuple[int, int, int, int], int]" = OrderedDict() # (dev, ino, mtime, size) -> crc32
+_crcs_lock = threading.Lock() # used from the loop and from to_thread alike
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02}:{ms // 60000 % 60:02}:{ms // 1000 % 60:02},{ms % 1000:03}"
+
+
+def srt(transcript: P.TranscriptResult) -> str:
+    return "".join(
+        f"{i}\n{_srt_time(segment.start)} --> {_srt_time(segment.end)}\n{segment.text.strip()}\n\n"
+        for i, segment in enumerate(transcript.segments, 1)
+    )
+
+
+def _folder(meta: P.RecMetadata) -> str:
+    name = re.sub(r"[^\w.\- ]", "_", os.path.splitext(meta.recName)[0]).strip() or "recording"
+    return f"{name}_{meta.rid[:8]}"
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800)) # the format starts in 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _known_crc(key: Tuple[int, int, int, int]) -> Optional[int]:
+    with _crcs_lock:
+        if key not in _crcs:
+            return None
+        _crcs.move_to_end(key)
+        return _crcs[key]
+
+
+def _file_crc(path: str, key: Tuple[int, int, int, int]) -> int:
+    crc = _known_crc(key)
+    if crc is not None:
+        return crc
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_BYTES):
+            crc = zlib.crc32(chunk, crc)
+    _remember(key, crc)
+    return crc
+
+
+def _remember(key: Tuple[int, int, int, int], crc: int):
+    with _crcs_lock:
+        _crcs[key] = crc
+        _crcs.move_to_end(key)
+        while len(_crcs) > CRC_CACHE:
+            _crcs.popitem(last=False)
+
+
+def _disposition(filename: str) -> str:
+    # an ASCII name for every client, the real one for those that read filename*
+    fallback = re.sub(r"[^\w.\- ]", "_", filename, flags=re.ASCII)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class Entry:
+    __slots__ = ('name', 'path', 'text', 'key', 'mtime', 'size', 'compressed', 'crc', 'offset')
+
+    def __init__(self, name: str, path: Optional[str] = None, text: Optional[Callable[[], bytes]] = None):
+        self.name: bytes = name.encode()
+        self.path: Optional[str] = path # stored from this file
+        self.text: Optional[Callable[[], bytes]] = text # or deflated from what this returns
+        self.key: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        self.mtime: float = 0.0 # text takes the export's, so a resume gets the same bytes
+        self.size: int = 0
+        self.compressed: int = 0
+        self.crc: Optional[int] = None
+        self.offset: int = 0 # of its local header
+
+    def measure(self):
+        """Sizes, and CRC for text, read from disk, called in a thread."""
+        if self.path:
+            st = os.stat(self.path)
+            self.key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+            self.mtime = st.st_mtime
+            self.size = self.compressed = st.st_size
+            self.crc = _known_crc(self.key)
+        else:
+            data = self.text()
+            self.size = len(data)
+            self.compressed = len(_deflate(data))
+            self.crc = zlib.crc32(data)
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT or self.offset >= ZIP64_LIMIT
+
+    @property
+    def flags(self) -> int:
+        return UTF8_NAMES | (DATA_DESCRIPTOR if self.path else 0)
+
+    def local_header(self) -> bytes:
+        time_, date = _dos_time(self.mtime)
+        if self.path:
+            # CRC and sizes follow the data
+            crc, compressed, size, extra = 0, 0, 0, b""
+            if self.zip64:
+                compressed = size = ZIP64_LIMIT
+                extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+        else:
+            crc, compressed, size, extra = self.crc, self.compressed, self.size, b""
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 45 if self.zip64 else 20, self.flags, STORED if self.path else DEFLATED,
+            time_, date, crc, compressed, size, len(self.name), len(extra)
+        ) + self.name + extra
+
+    def descriptor_size(self) -> int:
+        return (24 if self.zip64 else 16) if self.path else 0
+
+    def descriptor(self) -> bytes:
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074b50, self.crc, self.compressed, self.size)
+        return struct.pack("<IIII", 0x08074b50, self.crc, self.compressed, self.size)
+
+    def central_size(self) -> int:
+        return 46 + len(self.name) + (28 if self.zip64 else 0)
+
+    def central(self) -> bytes:
+        time_, date = _dos_time(self.mtime)
+        version = 45 if self.zip64 else 20
+        if self.zip64:
+            compressed = size = offset = ZIP64_LIMIT
+            extra = struct.pack("<HHQQQ", 1, 24, self.size, self.compressed, self.offset)
+        else:
+            compressed, size, offset, extra = self.compressed, self.size, self.offset, b""
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, self.flags,
+            STORED if self.path else DEFLATED, time_, date, self.crc, compressed, size,
+            len(self.name), len(extra), 0, 0, 0, 0o100644 << 16, offset
+        ) + self.name + extra
+
+
+class Export:
+    """One archive, laid out by plan() and sent by response(), see above."""
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.entries: List[Entry] = []
+        self.manifest: List[Dict] = []
+        # (offset, length, producer of length bytes starting skip bytes in)
+        self.parts: List[Tuple[int, int, Callable[[int, int], AsyncIterator[bytes]]]] = []
+        self.mtime: float = 0.0 # of the newest recording
+        self.total: int = 0
+        self.etag: str = ""
+
+
+    def add(self, meta: P.RecMetadata, paths: Dict[str, Optional[str]]):
+        """Adds the files of meta that are OK, paths as SharedState keeps them."""
+        folder = _folder(meta)
+        self.mtime = max(self.mtime, meta.createdAt / 1000)
+        files: Dict[str, str] = {}
+        for kind in ("original", "enhanced"):
+            path = paths.get(kind)
+            if path and getattr(meta, kind) == P.RecStates.OK:
+                files[kind] = f"{folder}/{kind}{os.path.splitext(path)[1]}"
+                self.entries.append(Entry(files[kind], path=path))
+        path = paths.get("transcript")
+        if path and meta.transcript == P.RecStates.OK:
+            files["transcript"] = f"{folder}/transcript.json"
+            files["subtitles"] = f"{folder}/transcript.srt"
+            self.entries.append(Entry(files["transcript"], text=lambda path=path: _read(path)))
+            self.entries.append(Entry(files["subtitles"], text=lambda path=path: _srt_of(path)))
+        self.manifest.append({**meta.model_dump(mode="json"), "files": files})
+
+
+    async def plan(self):
+        manifest = json.dumps({"recordings": self.manifest}, indent=2).encode()
+        self.entries.insert(0, Entry("manifest.json", text=lambda: manifest))
+        for entry in self.entries:
+            entry.mtime = self.mtime
+        try:
+            await asyncio.to_thread(lambda: [entry.measure() for entry in self.entries])
+        except (OSError, ValueError) as e:
+            # evicted or deleted since it was listed
+            log.error(f"Export {self.name} failed to read its files: {e}")
+            raise HTTPException(status_code=409, detail="Recordings changed, try again")
+
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            offset = self._part(offset, len(header), _static(header))
+            offset = self._part(offset, entry.compressed, self._data(entry))
+            if entry.path:
+                offset = self._part(offset, entry.descriptor_size(), self._descriptor(entry))
+        directory = offset
+        size = sum(entry.central_size() for entry in self.entries)
+        offset = self._part(offset, size, self._directory())
+        end = self._end(directory, size)
+        self.total = self._part(offset, len(end), _static(end))
+
+        digest = hashlib.sha256(manifest)
+        for entry in self.entries:
+            digest.update(repr((entry.name, entry.key, entry.crc if entry.text else None)).encode())
+        self.etag = f'"{digest.hexdigest()[:32]}"'
+
+
+    def _part(self, offset: int, length: int, producer) -> int:
+        if length:
+            self.parts.append((offset, length, producer))
+        return offset + length
+
+
+    def _data(self, entry: Entry):
+        async def produce(skip: int, length: int) -> AsyncIterator[bytes]:
+            if entry.text:
+                data = await asyncio.to_thread(lambda: _deflate(entry.text()))
+                yield data[skip:skip + length]
+                return
+            whole = skip == 0 and length == entry.size
+            crc = 0
+            f = await asyncio.to_thread(open, entry.path, "rb")
+            try:
+                await asyncio.to_thread(f.seek, skip)
+                left = length
+                while left > 0:
+                    chunk = await asyncio.to_thread(f.read, min(READ_BYTES, left))
+                    if not chunk:
+                        raise OSError(f"{entry.path} got shorter while it was exported")
+                    if whole:
+                        crc = zlib.crc32(chunk, crc)
+                    left -= len(chunk)
+                    yield chunk
+            finally:
+                f.close()
+            if whole:
+                entry.crc = crc
+                _remember(entry.key, crc)
+        return produce
+
+
+    def _descriptor(self, entry: Entry):
+        async def produce(skip: int, length: int) -> AsyncIterator[bytes]:
+            await self._crc(entry)
+            yield entry.descriptor()[skip:skip + length]
+        return produce
+
+
+    async def _crc(self, entry: Entry):
+        if entry.crc is None:
+            entry.crc = await asyncio.to_thread(_file_crc, entry.path, entry.key)
+
+
+    def _directory(self):
+        async def produce(skip: int, length: int) -> AsyncIterator[bytes]:
+            for entry in self.entries:
+                if entry.path:
+                    await self._crc(entry)
+            yield b"".join(entry.central() for entry in self.entries)[skip:skip + length]
+        return produce
+
+
+    def _end(self, offset: int, size: int) -> bytes:
+        count = len(self.entries)
+        end = b""
+        if count >= 0xFFFF or offset >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            end += struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, size, offset)
+            end += struct.pack("<IIQI", 0x07064b50, 0, offset + size, 1)
+            count, size, offset = min(count, 0xFFFF), min(size, ZIP64_LIMIT), min(offset, ZIP64_LIMIT)
+        return end + struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, offset, 0)
+
+
+    async def _send(self, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end (exclusive) of the archive."""
+        try:
+            for offset, length, produce in self.parts:
+                if offset + length <= start:
+                    continue
+                if offset >= end:
+                    break
+                skip = max(start - offset, 0)
+                async for chunk in produce(skip, min(length, end - offset) - skip):
+                    yield chunk
+        except OSError as e:
+            # the length was promised, cutting the connection lets the client resume
+            log.error(f"Export {self.name} broke off: {e}")
+            raise
+
+
+    def response(self, range_header: Optional[str], if_range: Optional[str]) -> StreamingResponse:
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": self.etag,
+            "Content-Disposition": _disposition(f"{self.name}.zip"),
+        }
+        start, end = 0, self.total
+        requested = _parse_range(range_header, self.total) if range_header and (not if_range or if_range == self.etag) else None
+        if requested == "unsatisfiable":
+            raise HTTPException(
+                status_code=416,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{self.total}"}
+            )
+        if requested:
+            start, end = requested
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{self.total}"
+        headers["Content-Length"] = str(end - start)
+        return StreamingResponse(
+            self._send(start, end),
+            status_code=206 if requested else 200,
+            media_type="application/zip",
+            headers=headers
+        )
+
+
+def _static(data: bytes):
+    async def produce(skip: int, length: int) -> AsyncIterator[bytes]:
+        yield data[skip:skip + length]
+    return produce
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _srt_of(path: str) -> bytes:
+    return srt(P.TranscriptResult.model_validate_json(_read(path))).encode()
+
+
+def _parse_range(header: str, total: int):
+    """(start, end) of a single bytes range, "unsatisfiable", or None to
+    send everything (several ranges, or one that can't be parsed)."""
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(total - int(last), 0), total
+    else:
+        start = int(first)
+        end = min(int(last) + 1, total) if last else total
+        if last and int(last) < start:
+            return None
+    if start >= total or start >= end:
+        return "unsatisfiable"
+    return start, end
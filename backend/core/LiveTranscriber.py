@@ -0,0 +1,314 @@
+from typing import BinaryIO, Dict, List, Optional
+import asyncio
+import os
+from pydub import AudioSegment
+
+import backend.core.primitives as P
+from backend.core.Services import Services
+from backend.handlers.MediaHandler import MediaHandler
+from backend.handlers.RecordingsHandler import RecordingsHandler
+from backend.utils.logging import log
+from backend.utils.metrics import LIVE_LAG
+import backend.utils.tracing as tracing
+
+
+STEP_SECONDS = 3.0 # new audio a stream collects before its next pass
+MAX_WINDOW_SECONDS = 28.0 # one batch element, Whisper hears 30s at most
+MARGIN_SECONDS = 2.0 # segments ending this close to the received audio may still change
+COVERAGE_SLACK = 1.0 # seconds the decoded audio may fall short of the recording
+MAX_BATCH = 8 # windows per model call
+MAX_LIVE = 8 # streams transcribed live, later ones are transcribed on request like uploads
+MAX_RETRIES = 2 # failed passes over the same window before a stream falls back to a full transcription
+READ_BYTES = 64 * 1024
+WHISPER_RATE = 16000 # the decoder resamples to what the model takes
+
+STEP = int(STEP_SECONDS * WHISPER_RATE) # in samples
+MAX_WINDOW = int(MAX_WINDOW_SECONDS * WHISPER_RATE)
+MARGIN = int(MARGIN_SECONDS * WHISPER_RATE)
+
+
+def _append(f: BinaryIO, data: bytes):
+    f.write(data)
+    f.flush()
+
+
+def _remove(f: BinaryIO):
+    f.close()
+    try:
+        os.remove(f.name)
+    except FileNotFoundError:
+        pass
+
+
+class Live:
+    __slots__ = ('rid', 'decoder', 'reader', 'pcm', 'size', 'committed', 'last', 'language', 'segments', 'queued', 'final', 'failed', 'retries', 'alone', 'finished')
+
+    def __init__(self, rid: str, decoder: asyncio.subprocess.Process, pcm: BinaryIO):
+        self.rid: str = rid
+        self.decoder: asyncio.subprocess.Process = decoder
+        self.reader: Optional[asyncio.Task] = None
+        self.pcm: BinaryIO = pcm # s16le 16kHz mono, the media worker reads windows of it
+        self.size: int = 0 # bytes in pcm
+        self.committed: int = 0 # samples transcribed for good
+        self.last: int = 0 # samples received when the last pass was queued
+        self.language: Optional[str] = None # detected on the first window with speech
+        self.segments: List[P.TranscriptSegment] = []
+        self.queued: bool = False
+        self.final: bool = False # the stream ended, passes run until everything is committed
+        self.failed: bool = False
+        self.retries: int = 0 # failed passes since the last one that worked
+        self.alone: bool = False # its last pass failed in a batch, the next runs it by itself
+        self.finished = asyncio.Event()
+
+    @property
+    def received(self) -> int:
+        return self.size // 2
+
+
+class LiveTranscriber:
+    """Transcribes streamed recordings while they are recorded, so their
+    transcript is there about when the original is.
+
+    Each stream is decoded by its own ffmpeg as its chunks hit the spool. Every
+    STEP_SECONDS of new audio it queues a pass over a window from the end of
+    its committed text to what was received. Segments that end MARGIN_SECONDS
+    before the window does won't change with more audio, they are committed
+    and the window slides past them, the rest goes to the dashboard as pending
+    text. The passes of up to MAX_BATCH streams go to a media worker as one
+    job, which runs them as one batch through its model. After stop the last
+    windows are transcribed in full, which settles the pending edge."""
+
+    def __init__(self, recordings: RecordingsHandler, media: MediaHandler, services: Services):
+        self._recordings: RecordingsHandler = recordings
+        self._media: MediaHandler = media
+        self._services: Services = services
+        self._live: Dict[str, Live] = {}
+        self._queue: asyncio.Queue = asyncio.Queue() # streams due a pass, each at most once
+        self._worker: Optional[asyncio.Task] = None
+
+
+    async def start(self, meta: P.RecMetadata) -> bool:
+        """Starts transcribing the stream of a freshly staged meta, whose
+        transcript is then WORKING."""
+        if len(self._live) >= MAX_LIVE or meta.rid in self._live:
+            return False
+        try:
+            decoder = await asyncio.create_subprocess_exec(
+                AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(WHISPER_RATE), "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except (OSError, NotImplementedError) as e:
+            log.warning(f"No live transcription for {meta.rid}: {e}")
+            return False
+        pcm = await asyncio.to_thread(open, os.path.join(self._recordings.live_dir, f"{meta.rid}.pcm"), "wb")
+
+        live = self._live[meta.rid] = Live(meta.rid, decoder, pcm)
+        live.reader = asyncio.create_task(self._read(live))
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+        await self._recordings.set_transcript(meta.rid, P.RecStates.WORKING)
+        meta.transcript = P.RecStates.WORKING
+        return True
+
+
+    async def feed(self, rid: str, chunks: List[bytes]):
+        live = self._live.get(rid)
+        if not live or live.failed or live.final:
+            return
+        try:
+            live.decoder.stdin.write(b"".join(chunks))
+            await live.decoder.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg gave up on the container, finish() falls back to a full transcription
+            live.failed = True
+
+
+    async def finish(self, meta: P.RecMetadata):
+        """Completes the transcript once the original of meta is stored."""
+        live = self._live.get(meta.rid)
+        if not live:
+            return
+        with tracing.resume(f"rec:{meta.rid}"), tracing.span("job.live_transcript", rid=meta.rid):
+            stored = await self._finish(live, meta.duration)
+        self._live.pop(meta.rid, None)
+        await asyncio.to_thread(_remove, live.pcm)
+
+        if stored:
+            await self._services.notify_amend(stored)
+        else:
+            # the transcript is still WORKING, the regular job takes it from here
+            await self._services.transcribe(meta.rid)
+
+
+    async def _finish(self, live: Live, duration: float) -> Optional[P.RecMetadata]:
+        try:
+            live.decoder.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        await live.reader
+
+        # an mp4 with its index at the end decodes to nothing from a pipe
+        if live.failed or live.received / WHISPER_RATE < duration - COVERAGE_SLACK:
+            log.warning(f"Live transcript of {live.rid} lacks audio, transcribing it again")
+            return None
+
+        live.final = True
+        if not live.queued:
+            self._enqueue(live)
+        await live.finished.wait()
+        if live.failed:
+            return None
+
+        return await self._recordings.store_transcript(live.rid, P.TranscriptResult(
+                                                                rid=live.rid,
+                                                                language=live.language or "",
+                                                                duration=duration,
+                                                                segments=live.segments
+                                                            ))
+
+
+    async def cancel(self, rid: str):
+        """Stops transcribing a stream that won't be stored."""
+        live = self._live.pop(rid, None)
+        if not live:
+            return
+        live.failed = True
+        live.finished.set()
+        if live.decoder.returncode is None:
+            live.decoder.kill()
+        if live.reader:
+            await asyncio.gather(live.reader, return_exceptions=True)
+        await asyncio.to_thread(_remove, live.pcm)
+        await self._recordings.set_transcript(rid, P.RecStates.NA)
+
+
+    async def _read(self, live: Live):
+        while True:
+            data = await live.decoder.stdout.read(READ_BYTES)
+            if not data:
+                break
+            if live.failed:
+                continue
+            await asyncio.to_thread(_append, live.pcm, data)
+            live.size += len(data)
+            if not live.queued and live.received - live.last >= STEP:
+                self._enqueue(live)
+        await live.decoder.wait()
+
+
+    def _enqueue(self, live: Live):
+        live.queued = True
+        live.last = live.received
+        self._queue.put_nowait(live)
+
+
+    def _next_batch(self, first: Live) -> List[Live]:
+        batch = [first]
+        while not first.alone and len(batch) < MAX_BATCH and not self._queue.empty():
+            live = self._queue.get_nowait()
+            if live.alone:
+                self._queue.put_nowait(live) # gets its own pass after this one
+                break
+            batch.append(live)
+        for live in batch:
+            if live.failed:
+                live.queued = False
+                live.finished.set()
+        return [live for live in batch if not live.failed]
+
+
+    def _retry(self, batch: List[Live]):
+        """Queues the windows of a failed pass again, nothing of them is
+        committed. Past MAX_RETRIES a stream gives up on live transcription."""
+        for live in batch:
+            live.retries += 1
+            live.alone = live.alone or len(batch) > 1 # so one bad stream doesn't keep failing the others
+            if live.retries > MAX_RETRIES:
+                log.warning(f"Live transcription of {live.rid} failed {live.retries} times, giving up on it")
+                live.failed = True
+                live.queued = False
+                live.finished.set()
+            else:
+                self._queue.put_nowait(live)
+
+
+    async def _work(self):
+        while True:
+            batch = self._next_batch(await self._queue.get())
+            if not batch:
+                continue
+            lengths = [min(live.received - live.committed, MAX_WINDOW) for live in batch]
+            try:
+                results, languages = await self._media.live([
+                    (live.pcm.name, live.committed, length, live.language)
+                    for live, length in zip(batch, lengths)
+                ])
+            except Exception as e:
+                log.error(f"Live transcription pass over {len(batch)} streams failed: {e}")
+                self._retry(batch)
+                continue
+
+            for live, length, segments, language in zip(batch, lengths, results, languages):
+                live.queued = False
+                live.retries = 0
+                live.alone = False
+                if live.failed:
+                    # cancelled while its pass ran
+                    live.finished.set()
+                    continue
+                live.language = live.language or language
+                # None is a window without speech, which commits like one
+                await self._commit(live, length, segments or [])
+                if live.final:
+                    if live.received > live.committed:
+                        self._enqueue(live)
+                    else:
+                        live.finished.set()
+                elif live.received - live.last >= STEP:
+                    self._enqueue(live)
+
+
+    async def _commit(self, live: Live, length: int, segments: List[P.TranscriptSegment]):
+        final = live.final and length == live.received - live.committed
+        edge = (length - MARGIN) / WHISPER_RATE
+
+        if final:
+            keep, cut = segments, length
+        else:
+            keep = []
+            for s in segments[:-1]:
+                if s.end > edge:
+                    break
+                keep.append(s)
+            if length >= MAX_WINDOW and segments and not keep:
+                # a full window has to move on, the last segment may be cut off
+                keep = segments[:-1] or segments
+            if keep:
+                cut = int(keep[-1].end * WHISPER_RATE)
+            elif not segments:
+                cut = max(length - MARGIN, 0)
+            else:
+                cut = 0
+            if length >= MAX_WINDOW and cut <= 0:
+                cut = length - MARGIN
+
+        offset = live.committed / WHISPER_RATE
+        committed = [
+            P.TranscriptSegment(start=round(s.start + offset, 3), end=round(s.end + offset, 3), text=s.text)
+            for s in keep
+        ]
+        live.segments.extend(committed)
+        live.committed += cut
+        LIVE_LAG.observe((live.received - live.committed) / WHISPER_RATE)
+
+        pending = " ".join(s.text for s in segments[len(keep):])
+        if committed or not final:
+            await self._services.notify_transcript(P.TranscriptUpdate(
+                                                       rid=live.rid,
+                                                       segments=committed,
+                                                       pending=pending
+                                                   ))
@@ -2,6 +2,8 @@ from typing import List
 import backend.core.primitives as P
 from backend.handlers.DashboardHandler import DashboardHandler
 from backend.handlers.RecordingsHandler import RecordingsHandler
+from backend.utils.metrics import JOBS
+import backend.utils.tracing as tracing
 
 class Services:
     def __init__(self, dashboard: DashboardHandler, recordings: RecordingsHandler):
@@ -16,18 +18,61 @@ class Services:
                 body=meta
             ))
 
-    async def transcribe(self, rid: str):
-        meta = await self._recordings._transcribe(rid)
+    async def notify_staged(self, meta: P.RecMetadata):
+        await self._dashboard.notify(P.WSPayload(
+            kind=P.WSKind.EVENT,
+            msgType=P.WSEvents.REC_STAGED,
+            body=meta
+        ))
+
+    async def notify_transcript(self, update: P.TranscriptUpdate):
+        await self._dashboard.notify(P.WSPayload(
+            kind=P.WSKind.EVENT,
+            msgType=P.WSEvents.REC_TRANSCRIPT,
+            body=update
+        ))
+
+    # a streamed original was stored, same follow up as an upload
+    async def streamed(self, meta: P.RecMetadata):
         await self.notify_amend(meta)
+        await self.analyze(meta.rid)
+
+    async def transcribe(self, rid: str):
+        with tracing.resume(f"rec:{rid}"), tracing.span("job.transcribe", rid=rid):
+            JOBS.inc(1, "transcribe")
+            try:
+                meta = await self._recordings._transcribe(rid)
+            finally:
+                JOBS.dec(1, "transcribe")
+            await self.notify_amend(meta)
+
+    async def analyze(self, rid: str):
+        with tracing.resume(f"rec:{rid}"), tracing.span("job.analyze", rid=rid):
+            JOBS.inc(1, "analyze")
+            try:
+                meta = await self._recordings._analyze(rid)
+            finally:
+                JOBS.dec(1, "analyze")
+            await self.notify_amend(meta)
 
     async def merge(self, rids: List[str]):
-        meta = await self._recordings._merge(rids)
-        await self._dashboard.notify(P.WSPayload(
-                                    kind = P.WSKind.EVENT,
-                                    msgType = P.WSEvents.REC_STAGED,
-                                    body=meta
-                                 ))
+        with tracing.span("job.merge", inputs=len(rids)):
+            JOBS.inc(1, "merge")
+            try:
+                meta = await self._recordings._merge(rids)
+            finally:
+                JOBS.dec(1, "merge")
+            await self._dashboard.notify(P.WSPayload(
+                                        kind = P.WSKind.EVENT,
+                                        msgType = P.WSEvents.REC_STAGED,
+                                        body=meta
+                                     ))
 
     async def enhance(self, rid: str, props: int):
-        meta = await self._recordings._enhance(rid, props)
-        await self.notify_amend(meta)
+        with tracing.resume(f"rec:{rid}"), tracing.span("job.enhance", rid=rid):
+            JOBS.inc(1, "enhance")
+            try:
+                meta = await self._recordings._enhance(rid, props)
+            finally:
+                JOBS.dec(1, "enhance")
+            await self.notify_amend(meta)
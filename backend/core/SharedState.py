@@ -0,0 +1,150 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import queue
+import sqlite3
+import threading
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+
+
+# with HTTP workers (backend/rest.py) the control process mirrors recording and
+# session state into a SQLite file, the workers read it from there. WAL lets
+# them read while it writes, and storage/ is wiped on start, so nothing has to
+# survive a crash and writes skip fsync. The control process only queues its
+# writes, one thread runs them, whatever queued up meanwhile in one transaction,
+# so the handlers never wait on SQLite while they hold their locks.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    rid TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    original TEXT,
+    enhanced TEXT,
+    transcript TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    meta TEXT NOT NULL
+);
+"""
+ENABLED = os.environ.get("VOCALINK_HTTP_WORKERS", "") not in ("", "0") # set by app.py --http-workers=N
+
+
+class SharedState:
+    """Recording and session state shared between the control process, which
+    writes it, and the HTTP workers, which only read. Rows keep the order they
+    were first written in, like the dicts of the handlers."""
+
+    def __init__(self, path: str, writer: bool = False):
+        self.path: str = path
+        self._writes: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+        if writer:
+            # used by the writer thread alone once the schema is there
+            self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.executescript(SCHEMA)
+            self._writes = queue.SimpleQueue()
+            self._writer = threading.Thread(target=self._write, name="shared-state", daemon=True)
+            self._writer.start()
+        else:
+            self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None)
+
+
+    def close(self):
+        """Runs the writes still queued, then closes."""
+        if self._writer:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        self._db.close()
+
+
+    def _write(self):
+        while True:
+            writes = [self._writes.get()]
+            while True:
+                try:
+                    writes.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._db.execute("BEGIN")
+                for write in writes:
+                    if write:
+                        self._db.execute(*write)
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                # one at a time, only the bad one is lost
+                for write in writes:
+                    if write:
+                        try:
+                            self._db.execute(*write)
+                        except sqlite3.Error as e:
+                            log.error(f"Writing to the shared state failed: {e}")
+            if None in writes:
+                return
+
+
+    def put_recording(self, meta: P.RecMetadata, paths: Dict[str, Optional[str]]):
+        # serialized now, meta changes after this returns
+        self._writes.put((
+            "INSERT INTO recordings (rid, meta, original, enhanced, transcript) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(rid) DO UPDATE SET meta=excluded.meta, original=excluded.original, "
+            "enhanced=excluded.enhanced, transcript=excluded.transcript",
+            (meta.rid, meta.model_dump_json(), paths.get("original"), paths.get("enhanced"), paths.get("transcript"))
+        ))
+
+
+    def drop_recording(self, rid: str):
+        self._writes.put(("DELETE FROM recordings WHERE rid = ?", (rid,)))
+
+
+    def put_session(self, meta: P.SessionMetadata):
+        self._writes.put((
+            "INSERT INTO sessions (id, meta) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET meta=excluded.meta",
+            (meta.id, meta.model_dump_json())
+        ))
+
+
+    def drop_session(self, id: str):
+        self._writes.put(("DELETE FROM sessions WHERE id = ?", (id,)))
+
+
+    def recordings_json(self) -> str:
+        """All recordings as a JSON array, put together from the stored rows
+        without parsing them."""
+        rows = self._db.execute("SELECT meta FROM recordings ORDER BY rowid").fetchall()
+        return "[" + ",".join(meta for meta, in rows) + "]"
+
+
+    def sessions_json(self) -> str:
+        rows = self._db.execute("SELECT meta FROM sessions ORDER BY rowid").fetchall()
+        return "[" + ",".join(meta for meta, in rows) + "]"
+
+
+    def session_recordings(self, id: str) -> List[Tuple[P.RecMetadata, Dict[str, Optional[str]]]]:
+        rows = self._db.execute("SELECT meta, original, enhanced, transcript FROM recordings ORDER BY rowid").fetchall()
+        found = []
+        for meta, original, enhanced, transcript in rows:
+            meta = P.RecMetadata.model_validate_json(meta)
+            if meta.sessionId == id:
+                found.append((meta, {"original": original, "enhanced": enhanced, "transcript": transcript}))
+        return found
+
+
+    def recording(self, rid: str) -> Optional[Tuple[P.RecMetadata, Dict[str, Optional[str]]]]:
+        row = self._db.execute(
+            "SELECT meta, original, enhanced, transcript FROM recordings WHERE rid = ?", (rid,)
+        ).fetchone()
+        if not row:
+            return None
+        meta, original, enhanced, transcript = row
+        return P.RecMetadata.model_validate_json(meta), {
+            "original": original,
+            "enhanced": enhanced,
+            "transcript": transcript,
+        }
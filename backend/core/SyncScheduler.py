@@ -0,0 +1,162 @@
+from typing import Dict, Iterable, Optional, Set
+import asyncio
+import random
+
+import backend.core.primitives as P
+from backend.core.ClockSync import MAX_SYNC_AGE
+from backend.handlers.SessionsHandler import SessionsHandler
+from backend.handlers.SyncHandler import SyncHandler
+from backend.utils.logging import sync_log
+from backend.utils.utils import now_ms
+
+
+TICK_MS = 100
+IDLE_TICK_MS = 1_000 # nothing due within a tick matters while no session records
+MAX_PER_TICK = 3 # staggers bursts, at most 30 requests per second
+ERROR_BUDGET_MS = 2.0 # offset error we accept to accumulate between rounds
+MIN_INTERVAL = 2_000
+ARMED_INTERVAL = int(MAX_SYNC_AGE * 0.8) # estimates never go stale while a session records
+IDLE_INTERVAL = 60_000
+SPREAD = 0.15 # random +-15% on every interval
+ARMED_ROUNDS = 4
+IDLE_ROUNDS = 2
+
+
+class SyncScheduler:
+    """Asks sessions to run clock sync rounds instead of waiting for them to.
+
+    The interval follows the measured drift (how long until the offset error
+    exceeds ERROR_BUDGET_MS) and shrinks with jitter. While a session records,
+    or has a timed action staged, it is capped so no estimate goes stale. An
+    idle group backs off to save battery and airtime, even with the dashboard
+    online: opening it only brings the next rounds forward once."""
+
+    def __init__(self, sessions: SessionsHandler, sync: SyncHandler):
+        self._sessions: SessionsHandler = sessions
+        self._sync: SyncHandler = sync
+        self._due: Dict[str, int] = {} # sessionId, next request time
+        self._seen: Dict[str, int] = {} # sessionId, lastSync already planned from
+        self._was_armed: bool = False
+        self._recording: Set[str] = set()
+        self._staged: Dict[str, int] = {} # sessionId, when its staged action is given up
+        self._wake: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    # an action is likely soon, bring every session forward (still staggered)
+    def prime(self):
+        now = now_ms()
+        for id in self._due:
+            self._due[id] = min(self._due[id], now + random.randint(0, 1000))
+        self._wake.set()
+
+
+    def recording(self, id: str, active: bool):
+        self._staged.pop(id, None)
+        if active:
+            self._recording.add(id)
+        else:
+            self._recording.discard(id)
+
+
+    # a timed action went out, armed until the session acknowledges it or it is long past
+    def staged(self, ids: Iterable[str], trigger_time: int):
+        for id in ids:
+            self._staged[id] = trigger_time + MAX_SYNC_AGE
+        self._wake.set()
+
+
+    def _is_armed(self, now: int) -> bool:
+        for id, until in list(self._staged.items()):
+            if until <= now:
+                del self._staged[id]
+        return bool(self._recording or self._staged)
+
+
+    def _interval(self, drift: float, jitter: float, armed: bool) -> int:
+        cap = ARMED_INTERVAL if armed else IDLE_INTERVAL
+        if drift > 0:
+            interval = ERROR_BUDGET_MS / drift * 1000
+        else:
+            interval = cap
+        interval /= 1 + jitter / 20 # noisy links need more samples
+        interval = min(cap, max(MIN_INTERVAL, interval))
+        return int(interval * random.uniform(1 - SPREAD, 1 + SPREAD))
+
+
+    async def _request(self, id: str, rounds: int):
+        if await self._sync.request(id, rounds):
+            return
+        await self._sessions.send_to_one(id, P.WSPayload(
+                                    kind = P.WSKind.SYNC,
+                                    msgType = P.WSClockSync.SYNC_REQUEST,
+                                    body = P.ClockSyncRequest(rounds=rounds)
+                                ))
+
+
+    async def _tick(self):
+        now = now_ms()
+        states = await self._sessions.clock_states()
+        armed = self._is_armed(now)
+        if armed and not self._was_armed:
+            self.prime()
+        self._was_armed = armed
+
+        alive = set()
+        due = []
+        for id, last_sync, drift, jitter in states:
+            alive.add(id)
+            if id not in self._due:
+                # first sight, spread newcomers over the next second
+                self._due[id] = now + random.randint(0, 1000)
+                continue
+            if last_sync is not None and self._seen.get(id) != last_sync:
+                self._seen[id] = last_sync
+                self._due[id] = last_sync + self._interval(drift, jitter, armed)
+            if self._due[id] <= now:
+                due.append(id)
+
+        for id in list(self._due):
+            if id not in alive:
+                del self._due[id]
+                self._seen.pop(id, None)
+                self._recording.discard(id)
+                self._staged.pop(id, None)
+
+        due.sort(key=self._due.__getitem__)
+        for id in due[:MAX_PER_TICK]:
+            rounds = ARMED_ROUNDS if armed else IDLE_ROUNDS
+            await self._request(id, rounds)
+            # if the session never answers we ask again one full interval later
+            self._due[id] = now + (ARMED_INTERVAL if armed else IDLE_INTERVAL)
+
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                sync_log.error(f"scheduler tick failed: {e}")
+            self._wake.clear()
+            tick = TICK_MS if self._was_armed else IDLE_TICK_MS
+            try:
+                await asyncio.wait_for(self._wake.wait(), tick / 1000)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,215 @@
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from pydub import AudioSegment
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+from backend.utils.utils import parse_size
+
+
+# GET /recordings/{rid}/original|enhanced?format=opus|mp3|wav&bitrate=kbps
+# serve the audio transcoded, on the server and on the HTTP workers alike.
+# A variant is named after the file it comes from (device, inode, mtime) and
+# its format, so recordings sharing a blob share their variants, and a file
+# replaced by a new enhance gets new ones:
+# storage/transcodes/{dev}-{ino}-{mtime}-{bitrate}{ext}        done
+# storage/transcodes/{dev}-{ino}-{mtime}-{bitrate}{ext}.part   being encoded
+# Whoever creates the .part (O_EXCL, so one process of all) runs the ffmpeg
+# that writes it. Every request for the variant, the first one too, reads the
+# .part as it grows and goes on reading past its rename into place, so the
+# first bytes go out as soon as ffmpeg writes them and a dropped download
+# doesn't stop the encode. mp4 is written fragmented: a plain one gets its
+# index at the end and its header patched, after it was read. Done variants
+# are served as files (ranges work) and touched on every hit. Past
+# VOCALINK_TRANSCODE_CACHE (1G) the least recently used go.
+FORMATS = {"opus": ".ogg", "mp3": ".mp3", "wav": ".wav"}
+MEDIA_TYPES = {
+    ".m4a": "audio/mp4",
+    ".mp4": "audio/mp4",
+    ".mp3": "audio/mpeg",
+    ".ogg": "audio/ogg",
+    ".wav": "audio/wav",
+}
+FORMAT_QUERY = Query(None, pattern="^(opus|mp3|wav)$", description="Transcode to this format")
+BITRATE_QUERY = Query(None, ge=6, le=320, description="kbps, for opus and mp3")
+CACHE_BYTES = parse_size(os.environ.get("VOCALINK_TRANSCODE_CACHE", "1G"))
+# an mp4 that is read as it is written, here and by backend/core/Clips.py
+FRAGMENTED = ["-movflags", "frag_keyframe+empty_moov"]
+CONTAINER_ARGS = {".m4a": FRAGMENTED, ".mp4": FRAGMENTED}
+READ_BYTES = 64 * 1024
+POLL_SECONDS = 0.05 # between reads at the end of a .part
+STALL_SECONDS = 30 # a .part that long unchanged lost its encoder
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class TranscodeCache:
+    """Transcoded variants of recordings, see above. One per process."""
+
+    def __init__(self, root: str = "storage"):
+        self.dir: str = os.path.join(root, "transcodes")
+        os.makedirs(self.dir, exist_ok=True)
+        self._encoding: Dict[str, asyncio.Task] = {} # variant path, its encode in this process
+
+
+    def _variant(self, src: str, ext: str, bitrate: Optional[int]) -> str:
+        st = os.stat(src)
+        return os.path.join(self.dir, f"{st.st_dev}-{st.st_ino}-{st.st_mtime_ns}-{bitrate or 0}{ext}")
+
+
+    async def response(self, src: str, name: str, format: Optional[str], bitrate: Optional[int]):
+        """src served as is, or as format at bitrate kbps. name is the
+        download's name without extension."""
+        stored = os.path.splitext(src)[1].lower()
+        ext = FORMATS[format] if format else stored
+        if ext == stored and not bitrate:
+            return FileResponse(path=src, media_type=media_type(src), filename=f"{name}{ext}")
+        if ext not in P.SUPPORTED_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Can't encode {ext}")
+
+        try:
+            path = self._variant(src, ext, bitrate if ext != ".wav" else None)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Recording ID not found")
+        if os.path.exists(path):
+            await asyncio.to_thread(os.utime, path)
+            return FileResponse(path=path, media_type=media_type(path), filename=f"{name}{ext}")
+
+        self._start(src, path, ext, bitrate)
+        if not await self._ready(path):
+            raise HTTPException(status_code=500, detail="Transcoding failed")
+        return StreamingResponse(
+            self._follow(path),
+            media_type=media_type(path),
+            headers={"Content-Disposition": f'attachment; filename="{name}{ext}"'}
+        )
+
+
+    def _start(self, src: str, path: str, ext: str, bitrate: Optional[int]):
+        if path in self._encoding:
+            return
+        try:
+            os.close(os.open(f"{path}.part", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return # another process encodes it
+        except OSError as e:
+            log.error(f"Transcoding {src} to {ext} failed: {e}")
+            return
+        task = asyncio.create_task(self._encode(src, path, ext, bitrate))
+        self._encoding[path] = task
+        task.add_done_callback(lambda _: self._encoding.pop(path, None))
+
+
+    async def _encode(self, src: str, path: str, ext: str, bitrate: Optional[int]):
+        part = f"{path}.part"
+        config = P.SUPPORTED_FORMATS[ext]
+        args = ["-c:a", config["codec"], "-b:a", f"{bitrate}k" if bitrate else config["bitrate"]] if "codec" in config else []
+        started = time.perf_counter()
+        done = False
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+                "-i", src, "-vn", *args, *CONTAINER_ARGS.get(ext, []), "-f", config["format"], part,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, err = await proc.communicate()
+            except asyncio.CancelledError:
+                proc.kill()
+                raise
+            if proc.returncode != 0:
+                log.error(f"Transcoding {src} to {ext} failed: {err.decode(errors='replace').strip()}")
+                return
+            await asyncio.to_thread(os.replace, part, path)
+            done = True
+        except Exception as e:
+            log.error(f"Transcoding {src} to {ext} failed: {e}")
+            return
+        finally:
+            # gone, whoever waits on it gives up
+            if not done:
+                await asyncio.to_thread(_remove, part)
+        log.info(f"Transcoded {src} to {ext} at {bitrate or 'default'} kbps in {time.perf_counter() - started:.2f}s")
+        await asyncio.to_thread(self._trim)
+
+
+    async def _ready(self, path: str) -> bool:
+        """Waits for the first bytes of the variant, False when its encode failed."""
+        part = f"{path}.part"
+        while True:
+            try:
+                st = os.stat(part)
+            except FileNotFoundError:
+                return os.path.exists(path)
+            if st.st_size > 0:
+                return True
+            if time.time() - st.st_mtime > STALL_SECONDS:
+                # left by a process that died, the next request encodes it again
+                await asyncio.to_thread(_remove, part)
+                return False
+            await asyncio.sleep(POLL_SECONDS)
+
+
+    async def _follow(self, path: str) -> AsyncIterator[bytes]:
+        part = f"{path}.part"
+        try:
+            f = await asyncio.to_thread(open, part, "rb")
+        except FileNotFoundError:
+            f = await asyncio.to_thread(open, path, "rb")
+        try:
+            last = time.time()
+            while True:
+                chunk = await asyncio.to_thread(f.read, READ_BYTES)
+                if chunk:
+                    last = time.time()
+                    yield chunk
+                    continue
+                if not os.path.exists(part):
+                    # renamed into place, what was written after our last read is still ours to read
+                    while chunk := await asyncio.to_thread(f.read, READ_BYTES):
+                        yield chunk
+                    if not os.path.exists(path):
+                        log.error(f"Transcode {path} failed while it was served")
+                    return
+                if time.time() - last > STALL_SECONDS:
+                    log.error(f"Transcode {path} stalled, its encoder went away")
+                    await asyncio.to_thread(_remove, part)
+                    return
+                await asyncio.sleep(POLL_SECONDS)
+        finally:
+            f.close()
+
+
+    def _trim(self):
+        """Drops the least recently used variants past CACHE_BYTES."""
+        variants = []
+        for entry in os.scandir(self.dir):
+            if entry.name.endswith(".part"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            variants.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in variants)
+        for _, size, path in sorted(variants):
+            if total <= CACHE_BYTES:
+                break
+            _remove(path)
+            total -= size
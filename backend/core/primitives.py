@@ -1,7 +1,8 @@
 from pathlib import Path
 from enum import Enum 
 from pydantic import BaseModel, Field
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Dict
+import os
 
 from backend.utils.utils import get_random_name
 
@@ -9,9 +10,22 @@ from backend.utils.utils import get_random_name
 VERSION = "v0.84-alpha"
 
 CONFIG_PATH = Path("backend/config.json")
-PORT = 6210
+PORT = int(os.environ.get("VOCALINK_PORT", 6210)) # app.py --port=N, a second server on the same machine
+MEDIA_PORT = PORT + 1 # loopback only, media workers connect to the server here
+HTTP_PORT = PORT + 2 # HTTP workers serving downloads and uploads, when the server runs them
+CHANNEL_PORT = PORT + 3 # loopback only, HTTP workers hand uploads to the server here
 BROADCAST = "all"
 
+# how audio is written per extension: exports by the media workers, cold
+# originals the storage manager transcodes (.ogg)
+SUPPORTED_FORMATS = {
+    ".m4a": {"format": "mp4", "codec": "aac", "bitrate": "192k"},
+    ".mp4": {"format": "mp4", "codec": "aac", "bitrate": "192k"},
+    ".mp3": {"format": "mp3", "codec": "libmp3lame", "bitrate": "192k"},
+    ".ogg": {"format": "ogg", "codec": "libopus", "bitrate": "128k"},
+    ".wav": {"format": "wav"}
+}
+
 
 class SessionMetadata(BaseModel):
     id: str
@@ -31,7 +45,7 @@ class ServerConf(BaseModel):
     fmts: List[str] = [ ".m4a", ".mp3", ".ogg" ]
     fmtActive: int = Field(default=0, ge=0, le=2)
     noiseStrength: float = Field(default=0.75, ge=0.0, le=1.0)
-    amplitudeStrength: int = Field(default=-18, ge=-24, le=-12)
+    loudnessTarget: int = Field(default=-18, ge=-24, le=-12) # LUFS, what amplify brings recordings to
     filterBassBoost: float = Field(default=6.0, ge=0.0, le=12.0)
     airBoost: float = Field(default=4.0, ge=0.0, le=10.0)
     compressorThreshold: float = Field(default=-20.0, ge=-40.0, le=-10.0)
@@ -57,6 +71,7 @@ class ServerInfo(BaseModel):
     ip: str
     version: str = VERSION
     activeSessions: int = 0
+    httpPort: Optional[int] = None # where HTTP workers serve recordings, if they run
     conf: ServerConf
 
 
@@ -97,6 +112,10 @@ class WSEvents(str, Enum): # these are facts that should be notified
     REC_STAGE = "rec_stage" # session[RecStageInfo]::server[recMetaData]::dashboard
     REC_STAGED = "rec_staged" # server[RecMetadata]::session
     REC_AMEND = "rec_amend" # server[RecMetadata]::dashboard
+    REC_TRANSCRIPT = "rec_transcript" # server[TranscriptUpdate]::dashboard, live transcription of a stream
+
+# periodic per session chatter, logged through the sampled "session" category
+SESSION_TRAFFIC = (WSEvents.SESSION_UPDATE, WSEvents.SESSION_STATE_REPORT)
 
 
 class WSActions(str, Enum): # these are intents of session or dashboard
@@ -118,10 +137,11 @@ class WSActions(str, Enum): # these are intents of session or dashboard
 class RestAuth(BaseModel):
     key: str
 
-class WSClockSync(str, Enum): # sync channel
+class WSClockSync(str, Enum): # sync channel, prefer the binary /ws/sync endpoint
     TIK = "tik" # session[ClockSync]::server
     TOK = "tok" # server[ClockSync]::session-> ["TOKED" >> server]
     SYNC_REPORT = "sync_report" # session[ClockSyncReport]::server
+    SYNC_REQUEST = "sync_request" # server[ClockSyncRequest]::session, run a sync round now
 
 
 # TIK -> TOK -> TOKED -> SESSION_UPDATE
@@ -133,19 +153,24 @@ class ClockSyncTok(BaseModel):
     t2: int
     t3: int
 
+class ClockSyncRequest(BaseModel):
+    rounds: int # number of TIKs the session should send
+
 class ClockSyncReport(BaseModel):
-    theta: float
+    theta: float # server - session, ((t2 - t1) + (t3 - t4)) / 2
     rtt: float
 
 class WSActionTarget(BaseModel):
     id: str
-    triggerTime: Optional[int] = None
+    triggerTime: Optional[int] = None # server clock
+    localTriggerTime: Optional[int] = None # same instant in the receiving session's clock
 
 class Rename(BaseModel):
     name: str
 
 class WSEventTarget(BaseModel):
     id: str
+    at: Optional[int] = None # session clock time the action took effect (STARTED, RESUMED...)
 
 class SessionStates(str, Enum):
     STOPPED = "stopped"
@@ -158,6 +183,21 @@ class StateReport(BaseModel): # session -> server -> dashboard
     duration: int = 0 # in seconds
 
 
+class SkewSample(BaseModel):
+    event: WSEvents
+    triggerTime: int
+    sessions: int
+    missing: int
+    skew: int # ms between the earliest and latest start
+    maxError: int # ms, worst distance from triggerTime
+
+class SkewReport(BaseModel):
+    count: int
+    sum: int
+    buckets: Dict[str, int] # cumulative counts per upper bound in ms
+    recent: List[SkewSample]
+
+
 class RecStageInfo(BaseModel):
     sessionId: str
     recName: str
@@ -169,6 +209,14 @@ class RecStates(str, Enum):
     NA = "na"
     WORKING = "working"
     
+class RecStats(BaseModel):
+    lufs: Optional[float] = None # integrated loudness, None when everything is below the gate
+    truePeak: float # dBTP
+    rms: float # dBFS
+    clipping: float # share of samples at full scale
+    silence: float # share of 400ms blocks below -50 LUFS
+
+
 class RecMetadata(BaseModel):
     rid: str 
     recName: str #
@@ -182,6 +230,18 @@ class RecMetadata(BaseModel):
     enhanced: RecStates = RecStates.NA #
     transcript: RecStates = RecStates.NA #
     merged: Optional[List[str]] = None #
+    stats: Optional[RecStats] = None
+
+
+class TranscriptSegment(BaseModel):
+    start: float
+    end: float
+    text: str
+
+class TranscriptUpdate(BaseModel):
+    rid: str
+    segments: List[TranscriptSegment] # newly committed, they don't change anymore
+    pending: str = "" # tentative text after them, replaced by the next update
 
 
 class WSPayload(BaseModel):
@@ -196,9 +256,11 @@ class WSPayload(BaseModel):
         ClockSyncTik,
         ClockSyncTok,
         ClockSyncReport,
+        ClockSyncRequest,
         RecMetadata,
         RecStageInfo,
         RestAuth,
+        TranscriptUpdate,
     ]] = None
 
 
@@ -210,11 +272,6 @@ class QRData(BaseModel):
     port: int = PORT
 
 
-class TranscriptSegment(BaseModel):
-    start: float
-    end: float
-    text: str
-
 class TranscriptResult(BaseModel):
     rid: str
     language: str
@@ -224,6 +281,33 @@ class TranscriptResult(BaseModel):
 class MergeRequest(BaseModel):
     rids: List[str]
 
+class ExportRequest(BaseModel):
+    rids: List[str]
+
+
+############# Federation, see backend/handlers/PeersHandler.py #####################
+class NodeStatus(BaseModel):
+    id: str # random per run, tells a server reached under two addresses apart from two servers
+    name: str
+    url: str # its control server
+    filesUrl: str # where its recordings are downloaded from, its HTTP workers if it runs them
+    now: int # its clock when it answered, ms
+    activeSessions: int = 0
+    triggerDelay: int = 0 # ms its sessions need between an action and its trigger time
+    workers: int = 0 # connected media workers
+    load: float = 0.0 # queued and running media jobs per worker
+
+class NodeCatalog(BaseModel):
+    node: str
+    url: str
+    filesUrl: str
+    recordings: List[RecMetadata] = []
+    error: Optional[str] = None # the peer didn't answer, recordings is empty
+
+class FederatedAction(BaseModel):
+    action: WSActions # one of the *_ALL actions
+    triggerTime: Optional[int] = None # in the receiving server's clock
+
 
 class EnhanceProps:
     AMPLIFY: int = 1
@@ -1,4 +1,6 @@
-from typing import Optional
+from typing import List, Optional
+from contextlib import nullcontext
+import os
 import socket
 from fastapi import WebSocket
 from pydantic import ValidationError
@@ -7,11 +9,25 @@ import asyncio
 
 import backend.core.primitives as P
 from backend.utils.utils import get_local_ip, now_ms
-from backend.utils.logging import log
+from backend.utils.logging import log, ws_log, session_log
 from backend.handlers.DashboardHandler import DashboardHandler
 from backend.handlers.SessionsHandler import SessionsHandler
 from backend.handlers.RecordingsHandler import RecordingsHandler
+from backend.handlers.MediaHandler import MediaHandler
+from backend.handlers.SyncHandler import SyncHandler
+from backend.handlers.StreamHandler import StreamHandler
+from backend.handlers.HttpWorkersHandler import HttpWorkersHandler
+from backend.handlers.PeersHandler import PeersHandler, ENABLED as FEDERATION
+from backend.handlers.StorageHandler import StorageHandler
 from backend.core.Services import Services
+from backend.core.LiveTranscriber import LiveTranscriber
+from backend.core.SharedState import SharedState, ENABLED as SHARED_STATE
+from backend.core.ClockSync import SkewTracker
+from backend.core.Transcodes import TranscodeCache
+from backend.core.SyncScheduler import SyncScheduler
+from backend.utils.metrics import watch_loop_lag
+import backend.utils.watchdog as watchdog
+import backend.utils.tracing as tracing
 
 
 ACTION_MAP = {
@@ -22,10 +38,18 @@ ACTION_MAP = {
     P.WSActions.CANCEL_ALL: P.WSActions.CANCEL,
 }
 
+# event a session answers with once a synchronised action took effect
+ACTION_ACK = {
+    P.WSActions.START: P.WSEvents.STARTED,
+    P.WSActions.STOP: P.WSEvents.STOPPED,
+    P.WSActions.PAUSE: P.WSEvents.PAUSED,
+    P.WSActions.RESUME: P.WSEvents.RESUMED,
+}
+
 
 async def send_error(ws: WebSocket, type: P.WSErrors):
     msg = P.WSPayload(kind=P.WSKind.ERROR, msgType=type).model_dump()
-    log.info(msg)
+    ws_log.info("tx error %s", msg)
     await ws.send_json(msg)
 
 
@@ -41,8 +65,37 @@ class AppState:
 
         self.dashboard: DashboardHandler = DashboardHandler()
         self.sessions: SessionsHandler = SessionsHandler()
-        self.recordings: RecordingsHandler = RecordingsHandler(self.info.conf)
+        self.media: MediaHandler = MediaHandler(self.info.conf)
+        self.recordings: RecordingsHandler = RecordingsHandler(self.media)
+        self.transcodes: TranscodeCache = TranscodeCache(self.recordings.root)
         self.services: Services = Services(self.dashboard, self.recordings)
+        self.sync: SyncHandler = SyncHandler(self.apply_sync_report)
+        self.live: LiveTranscriber = LiveTranscriber(self.recordings, self.media, self.services)
+        self.streams: StreamHandler = StreamHandler(self.recordings, self.sessions, self.services, self.live)
+        self.skew: SkewTracker = SkewTracker()
+        self.storage: StorageHandler = StorageHandler(self.recordings, self.services)
+        self.scheduler: SyncScheduler = SyncScheduler(self.sessions, self.sync)
+
+        # with HTTP workers (app.py --http-workers=N) they serve recordings off a shared copy of the state
+        self.shared: Optional[SharedState] = None
+        self.http_workers: Optional[HttpWorkersHandler] = None
+        if SHARED_STATE:
+            self.shared = SharedState(os.path.join(self.recordings.root, "state.db"), writer=True)
+            self.recordings.shared = self.shared
+            self.sessions.shared = self.shared
+            self.http_workers = HttpWorkersHandler(self.recordings, self.services)
+            self.info.httpPort = P.HTTP_PORT
+
+        # with VOCALINK_FEDERATION_KEY set it works with the other servers on the LAN that have it
+        self.peers: Optional[PeersHandler] = None
+        if FEDERATION:
+            self.peers = PeersHandler(self.media, self.recordings.root)
+            self.media.offload = self.peers.offload
+
+        self._lag_watch: Optional[asyncio.Task] = None
+        self.watchdog: Optional[watchdog.LoopWatchdog] = (
+            watchdog.LoopWatchdog() if watchdog.ENABLED else None
+        )
 
         self.mdns: Optional[AsyncZeroconf] = None
         self.mdns_conf: Optional[AsyncServiceInfo] = None
@@ -114,8 +167,7 @@ class AppState:
 
         self.info.conf = conf
         self.info.conf.save()
-        self.recordings.audio.props = conf
-        self.recordings.audio.sync_params()
+        self.media.conf = conf
 
         status = self.reload_indends()
         log.info("Server configuration successfully updated.")
@@ -128,6 +180,35 @@ class AppState:
         return self.info
 
 
+    def _url(self, port: int) -> str:
+        return f"http://{self.info.ip}:{port}"
+
+
+    async def node_status(self) -> P.NodeStatus:
+        return P.NodeStatus(
+            id=self.peers.id if self.peers else "",
+            name=self.info.conf.name,
+            url=self._url(self.port),
+            filesUrl=self._url(self.info.httpPort or self.port),
+            now=now_ms(),
+            activeSessions=await self.sessions.getActiveCount(),
+            triggerDelay=await self.sessions.trigger_delay(),
+            workers=self.media.workers,
+            load=self.media.load(),
+        )
+
+
+    async def catalog(self) -> List[P.NodeCatalog]:
+        """Recordings of this server and of every peer, this server's first."""
+        local = P.NodeCatalog(
+            node=self.info.conf.name,
+            url=self._url(self.port),
+            filesUrl=self._url(self.info.httpPort or self.port),
+            recordings=await self.recordings.get_all_metas()
+        )
+        return [local] + (await self.peers.catalog() if self.peers else [])
+
+
     def _make_mdns_conf(self) -> AsyncServiceInfo:
         return AsyncServiceInfo(
             type_="_vocalink._tcp.local.",
@@ -136,7 +217,9 @@ class AppState:
             port=self.port,
             properties={
                 b"service": b"vocalink",
-                b"name": self.info.conf.name.encode('utf-8')
+                b"name": self.info.conf.name.encode('utf-8'),
+                **({b"http": str(self.info.httpPort).encode()} if self.info.httpPort else {}),
+                **({b"federation": b"1"} if self.peers else {})
             }
         )
 
@@ -177,7 +260,34 @@ class AppState:
                         ))
 
 
+    async def startup(self):
+        await self.start_mdns()
+        await self.media.start()
+        if self.peers:
+            await self.peers.start(self.mdns)
+        if self.http_workers:
+            await self.http_workers.start()
+        self.scheduler.start()
+        await self.storage.start()
+        self._lag_watch = asyncio.create_task(watch_loop_lag())
+        if self.watchdog:
+            self.watchdog.start()
+
+
     async def shutdown(self):
+        await self.scheduler.stop()
+        await self.storage.stop()
+        if self.peers:
+            await self.peers.stop()
+        self.media.stop()
+        if self.http_workers:
+            self.http_workers.stop()
+        if self.shared:
+            self.shared.close()
+        if self._lag_watch:
+            self._lag_watch.cancel()
+        if self.watchdog:
+            self.watchdog.stop()
         if not self.mdns:
             return
         if self.mdns_conf:
@@ -186,33 +296,11 @@ class AppState:
 
 
     async def _eval_triggerTime(self) -> int:
-        SAFETY_MS = 200
-        MIN_DELAY = 400
-        DEFAULT_DELAY = 600
-        MAX_SYNC_AGE = 10_000  # ms
-
-        metas = await self.sessions.getMetaFromAllActive()
-        valid_rtts = []
-        now = now_ms()
-
-        for meta in metas:
-            if not meta:
-                continue
-            if meta.lastRTT is None:
-                continue
-            if meta.lastSync is None:
-                continue
-            if now - meta.lastSync > MAX_SYNC_AGE:
-                continue
-            valid_rtts.append(meta.lastRTT)
-
-        if not valid_rtts:
-            delay = DEFAULT_DELAY
-        else:
-            max_rtt = max(valid_rtts)
-            delay = max(MIN_DELAY, int(max_rtt * 1.5) + SAFETY_MS)
-
-        return now + delay
+        delay = await self.sessions.trigger_delay()
+        if self.peers:
+            # late enough for the sessions of the slowest peer too
+            delay = max(delay, self.peers.trigger_delay())
+        return now_ms() + delay
     
 
     async def trigger_indent(self, method_name: str):
@@ -240,7 +328,7 @@ class AppState:
 
 
     async def handle_events(self, payload: P.WSPayload, ws: WebSocket):
-        log.info(P.WSPayload.model_dump(payload))
+        (session_log if payload.msgType in P.SESSION_TRAFFIC else ws_log).info("rx %s", payload)
         if payload.kind != P.WSKind.EVENT:
             return
 
@@ -248,6 +336,7 @@ class AppState:
 
         if event_type == P.WSEvents.DASHBOARD_INIT:
             await self.dashboard.assign(ws)
+            self.scheduler.prime()
             key = self.dashboard.key
             if key:
                 await self.dashboard.notify(P.WSPayload(
@@ -329,15 +418,23 @@ class AppState:
                 P.WSEvents.PAUSED,
             ):
             try:
-                P.WSEventTarget.model_validate(payload.body)
+                target = P.WSEventTarget.model_validate(payload.body)
             except ValidationError:
                 await send_error(ws, P.WSErrors.INVALID_BODY)
                 return
 
-            await asyncio.gather(
-                self.dashboard.notify(payload),
-                self.handle_indents(event_type),
-            )
+            if target.at is not None:
+                theta = await self.sessions.get_theta(target.id)
+                self.skew.record(event_type, target.id, target.at, theta)
+            self.scheduler.recording(target.id, event_type != P.WSEvents.STOPPED)
+
+            traced = event_type == P.WSEvents.STOPPED
+            with (tracing.resume(f"session:{target.id}") if traced else nullcontext()), \
+                 tracing.child_span(f"event.{event_type.value}", session=target.id):
+                await asyncio.gather(
+                    self.dashboard.notify(payload),
+                    self.handle_indents(event_type),
+                )
 
         elif event_type == P.WSEvents.SESSION_STATE_REPORT:
             try:
@@ -357,18 +454,22 @@ class AppState:
             meta = await self.sessions.getMetaFromActive(stageInfo.sessionId)
             if not meta:
                 return
-            recMeta = await self.recordings.stage(stageInfo, meta)
 
-            if not recMeta:
-                return
-            payload = P.WSPayload(
-                                  kind = P.WSKind.EVENT,
-                                  msgType = P.WSEvents.REC_STAGED,
-                                  body = recMeta
-                              )
+            # joins the trace of the stop that ended this recording, if any
+            with tracing.resume(f"session:{meta.id}", release=True), tracing.span("rec.stage", session=meta.id):
+                recMeta = await self.recordings.stage(stageInfo, meta)
 
-            await self.sessions.send_to_one(recMeta.sessionId, payload)
-            await self.dashboard.notify(payload)
+                if not recMeta:
+                    return
+                tracing.bind(f"rec:{recMeta.rid}")
+                payload = P.WSPayload(
+                                      kind = P.WSKind.EVENT,
+                                      msgType = P.WSEvents.REC_STAGED,
+                                      body = recMeta
+                                  )
+
+                await self.sessions.send_to_one(recMeta.sessionId, payload)
+                await self.dashboard.notify(payload)
 
         else:
             await send_error(ws, P.WSErrors.INVALID_EVENT)
@@ -378,7 +479,7 @@ class AppState:
                 pass
 
     async def handle_actions(self, payload: P.WSPayload, ws: WebSocket):
-        log.info(P.WSPayload.model_dump(payload))
+        ws_log.info("rx %s", payload)
         if payload.kind != P.WSKind.ACTION:
             return
 
@@ -405,7 +506,13 @@ class AppState:
             P.WSActions.GET_STATE,
         ):
             if await self.sessions.is_active(target.id):
-                await self.sessions.send_to_one(target.id, payload)
+                if action_type == P.WSActions.STOP:
+                    # stop-pressed is where a recording's trace begins
+                    with tracing.span("action.stop", session=target.id):
+                        tracing.bind(f"session:{target.id}")
+                        await self.sessions.send_to_one(target.id, payload)
+                else:
+                    await self.sessions.send_to_one(target.id, payload)
             else:
                 await self.dashboard.error(P.WSErrors.SESSION_NOT_FOUND)
 
@@ -415,6 +522,7 @@ class AppState:
                 return
 
             await self.sessions.drop(target.id)
+            await self.sync.drop(target.id)
             await self.dashboard.notify(P.WSPayload(
                 kind = P.WSKind.EVENT,
                 msgType = P.WSEvents.DROPPED,
@@ -422,21 +530,63 @@ class AppState:
             ))
 
         elif action_type in ACTION_MAP:
-            action = ACTION_MAP[action_type]
-            if action != P.WSActions.CANCEL:
-                target.triggerTime = await self._eval_triggerTime()
-            await self.sessions.broadcast(P.WSPayload(
-                                        kind = P.WSKind.ACTION,
-                                        msgType = action,
-                                        body = target
-                                    ))
-
+            await self.broadcast_action(action_type, target)
 
         else:
             await send_error(ws, P.WSErrors.INVALID_ACTION)
 
 
-    async def handle_sync(self, payload: P.WSPayload, ws: WebSocket):
+    async def broadcast_action(
+        self,
+        action_type: P.WSActions,
+        target: P.WSActionTarget,
+        forwarded: bool = False
+    ) -> List[str]:
+        """Sends one of the *_ALL actions to every session, with federation to
+        the sessions of every peer too, at the same instant. One a peer
+        forwarded brings its trigger time and goes no further."""
+        action = ACTION_MAP[action_type]
+        broadcast = P.WSPayload(
+                        kind = P.WSKind.ACTION,
+                        msgType = action,
+                        body = target
+                    )
+        forward = self.peers is not None and not forwarded
+        if action == P.WSActions.CANCEL:
+            await asyncio.gather(
+                self.sessions.broadcast(broadcast),
+                *([self.peers.forward(action_type, None)] if forward else [])
+            )
+            return []
+
+        with tracing.span(f"action.{action_type.value}", forwarded=forwarded) as span:
+            if not forwarded:
+                target.triggerTime = await self._eval_triggerTime()
+            elif target.triggerTime is None or target.triggerTime < now_ms():
+                # our sessions start as soon as they get it, behind the peer's
+                log.warning(f"[FEDERATION] {action_type.value} arrived after its trigger time")
+                target.triggerTime = max(target.triggerTime or 0, now_ms())
+
+            if forward:
+                ids, reached = await asyncio.gather(
+                    self.sessions.broadcast_timed(broadcast, target.triggerTime),
+                    self.peers.forward(action_type, target.triggerTime)
+                )
+                span.attrs["peerSessions"] = reached
+            else:
+                ids = await self.sessions.broadcast_timed(broadcast, target.triggerTime)
+            self.skew.open(ACTION_ACK[action], target.triggerTime, ids)
+            self.scheduler.staged(ids, target.triggerTime)
+            span.attrs["sessions"] = len(ids)
+            if action == P.WSActions.STOP:
+                for id in ids:
+                    tracing.bind(f"session:{id}")
+        return ids
+
+
+    async def handle_sync(self, payload: P.WSPayload, ws: WebSocket, rx: Optional[int] = None):
+        # rx is the receive timestamp taken by the caller before validation
+        t2 = rx if rx is not None else now_ms()
         if payload.kind != P.WSKind.SYNC:
             return
 
@@ -446,19 +596,17 @@ class AppState:
             return
 
         if payload.msgType == P.WSClockSync.TIK:
-            try:
-                sync_req = P.ClockSyncTik.model_validate(payload.body)
-            except ValidationError:
+            body = payload.body
+            if not isinstance(body, P.ClockSyncTik):
                 await send_error(ws, P.WSErrors.INVALID_BODY)
                 return
 
-            t2 = now_ms()
-            t1 = sync_req.t1
-            await self.sessions.send_to_one(id, P.WSPayload(
-                                      kind = P.WSKind.SYNC,
-                                      msgType = P.WSClockSync.TOK,
-                                      body = P.ClockSyncTok(t1=t1, t2=t2, t3=now_ms())
-                                  ))
+            # answer on the socket directly, send_to_one would take the sessions lock
+            await ws.send_json({
+                "kind": P.WSKind.SYNC.value,
+                "msgType": P.WSClockSync.TOK.value,
+                "body": {"t1": body.t1, "t2": t2, "t3": now_ms()},
+            })
 
         elif payload.msgType == P.WSClockSync.SYNC_REPORT:
             try:
@@ -467,13 +615,17 @@ class AppState:
                 await send_error(ws, P.WSErrors.INVALID_BODY)
                 return
 
-            meta = await self.sessions.update_sync(id, report)
-            if meta:
-                await self.dashboard.notify(P.WSPayload(
-                                            kind = P.WSKind.EVENT,
-                                            msgType = P.WSEvents.SESSION_UPDATE,
-                                            body = meta
-                                        ))
+            await self.apply_sync_report(id, report)
+
+
+    async def apply_sync_report(self, id: str, report: P.ClockSyncReport):
+        meta = await self.sessions.update_sync(id, report)
+        if meta:
+            await self.dashboard.notify(P.WSPayload(
+                                        kind = P.WSKind.EVENT,
+                                        msgType = P.WSEvents.SESSION_UPDATE,
+                                        body = meta
+                                    ))
 
     async def handle_disconnect(self, ws: WebSocket):
         if ws == await self.dashboard.ws():
@@ -496,4 +648,5 @@ class AppState:
                 ))
 
             await self.sessions.drop(id)
+            await self.sync.drop(id)
             log.info(f"Session [{id}] disconnected.")
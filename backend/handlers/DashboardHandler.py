@@ -2,8 +2,9 @@ from typing import Optional
 from fastapi import WebSocket
 import asyncio
 import backend.core.primitives as P
-from backend.utils.logging import log
+from backend.utils.logging import log, ws_log, session_log
 import backend.utils.cypher as cypher
+from backend.utils.tracing import child_span
 
 
 class DashboardHandler:
@@ -41,8 +42,9 @@ class DashboardHandler:
             if not self._dashboard:
                 return
         try:
-            await self._dashboard.send_json(payload.model_dump())
-            log.info(payload)
+            with child_span("ws.notify", msgType=payload.msgType.value):
+                await self._dashboard.send_json(payload.model_dump())
+            (session_log if payload.msgType in P.SESSION_TRAFFIC else ws_log).info("tx dashboard %s", payload)
         except Exception:
             log.warning('dashboard got disconnected due to unexpected exception')
             await self.drop(self._dashboard)
@@ -56,7 +58,7 @@ class DashboardHandler:
         payload = P.WSPayload(kind=P.WSKind.ERROR, msgType=err)
         try:
             await self._dashboard.send_json(payload.model_dump())
-            log.info(payload)
+            ws_log.info("tx dashboard %s", payload)
         except Exception:
             log.warning('dashboard got disconnected due to unexpected exception')
             await self.drop(self._dashboard)
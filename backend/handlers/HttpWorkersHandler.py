@@ -0,0 +1,115 @@
+from typing import Dict, Optional, Set
+import asyncio
+import json
+import os
+import secrets
+
+import backend.core.primitives as P
+from backend.core.Services import Services
+from backend.handlers.RecordingsHandler import RecordingsHandler
+from backend.utils.logging import log
+from backend.utils.metrics import HTTP_WORKERS, UPLOAD_BYTES, UPLOAD_SECONDS
+import backend.utils.tracing as tracing
+
+
+# HTTP workers (backend/rest.py) serve downloads, uploads and listings next to
+# this process and read recordings and sessions from SharedState. What changes
+# state comes back here, so this process stays the only writer. Workers connect
+# to 127.0.0.1:CHANNEL_PORT, both sides send JSON lines:
+# HELLO    worker -> server : {"type": "hello", "pid": int, "key": str}
+# UPLOADED worker -> server : {"type": "uploaded", "id": int, "rid": str, "path": str, "size": int, "sha256": str, "start": ns, "end": ns}
+# REPLY    server -> worker : {"type": "reply", "id": int, "ok": bool}
+# USED     worker -> server : {"type": "used", "rid": str}, a download, not answered
+#
+# An upload is written next to its original by the worker, path is that file,
+# sha256 its hash taken while writing it (see backend/core/BlobStore.py).
+# With VOCALINK_MEDIA_KEY set, a worker has to say it in its hello, as media
+# workers do.
+KEY = os.environ.get("VOCALINK_MEDIA_KEY")
+
+
+class HttpWorkersHandler:
+    """The control process' end of the channel HTTP workers report to."""
+
+    def __init__(self, recordings: RecordingsHandler, services: Services):
+        self._recordings: RecordingsHandler = recordings
+        self._services: Services = services
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+
+    async def start(self, port: int = P.CHANNEL_PORT):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", port)
+
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = json.loads(await reader.readline())
+            if hello.get("type") != "hello" or (KEY and not secrets.compare_digest(str(hello.get("key", "")), KEY)):
+                raise ValueError("not an HTTP worker")
+            pid = int(hello.get("pid", 0))
+        except (ValueError, AttributeError, ConnectionError) as e:
+            log.warning(f"Rejected an HTTP worker connection: {e}")
+            writer.close()
+            return
+
+        HTTP_WORKERS.inc(1)
+        log.info(f"HTTP worker {pid} connected.")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                if msg.get("type") == "uploaded":
+                    # a worker has several requests in flight, answer each when it's done
+                    self._spawn(self._reply(writer, msg["id"], self.uploaded(pid, msg)))
+                elif msg.get("type") == "used":
+                    # the storage manager evicts the least recently used
+                    self._recordings.touch(msg["rid"])
+        except (ConnectionError, ValueError) as e:
+            log.warning(f"HTTP worker {pid} lost: {e!r}")
+        finally:
+            HTTP_WORKERS.dec(1)
+            log.info(f"HTTP worker {pid} disconnected.")
+            writer.close()
+
+
+    async def _reply(self, writer: asyncio.StreamWriter, id: int, handled):
+        try:
+            ok = await handled
+        except Exception as e:
+            log.error(f"HTTP worker message {id} failed: {e}")
+            ok = False
+        if writer.is_closing():
+            return
+        writer.write(json.dumps({"type": "reply", "id": id, "ok": ok}).encode() + b"\n")
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+    async def uploaded(self, pid: int, msg: Dict) -> bool:
+        rid = msg["rid"]
+        UPLOAD_BYTES.inc(msg["size"])
+        UPLOAD_SECONDS.observe((msg["end"] - msg["start"]) / 1e9)
+        with tracing.resume(f"rec:{rid}"), tracing.span("rec.upload", rid=rid, worker=pid):
+            tracing.record(tracing.current(), "rec.save", msg["start"], msg["end"], bytes=msg["size"])
+            meta = await self._recordings.store_upload(rid, msg["path"], msg["size"], msg["sha256"])
+            if not meta or meta.original != P.RecStates.OK:
+                return False
+            await self._services.notify_amend(meta)
+        self._spawn(self._services.analyze(rid))
+        return True
+
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
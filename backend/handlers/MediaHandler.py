@@ -0,0 +1,331 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import time
+
+import backend.core.primitives as P
+from backend.utils.logging import log
+from backend.utils.metrics import AUDIO_STAGE, MEDIA_LOST, MEDIA_WORKERS
+import backend.utils.profiler as profiler
+import backend.utils.tracing as tracing
+
+
+# media jobs run in worker processes (python -m backend.worker), a crash or OOM
+# in ffmpeg, noisereduce or the Whisper model takes down a worker, not the server.
+# Workers connect to 127.0.0.1:MEDIA_PORT, both sides send JSON lines and only
+# file paths cross, never audio:
+# HELLO    worker -> server : {"type": "hello", "pid": int, "key": str}
+# JOB      server -> worker : {"type": "job", "id": int, "job": str, "rid": str, "args": [...], "conf": ServerConf, "profile": hz | null}
+# STAGE    worker -> server : {"type": "stage", "id": int, "stage": str, "start": ns, "end": ns | null}, null while it runs
+# PROGRESS worker -> server : {"type": "progress", "id": int, "stage": str, "done": 0..1}
+# RESULT   worker -> server : {"type": "result", "id": int, "result": ..., "profile": {"samples": [[stack, count]], "duration": s} | null}
+# ERROR    worker -> server : {"type": "error", "id": int, "error": str}
+#
+# A worker runs one job at a time. When it goes away mid-job the job goes to
+# the next worker, a job that took down MAX_ATTEMPTS workers fails. With
+# VOCALINK_MEDIA_KEY set, a worker has to say it in its hello.
+MAX_ATTEMPTS = 2
+MAX_LINE = 64 * 1024 * 1024 # a long recording's transcript is one line
+LIVE = 0 # priorities, live transcription passes can't wait behind an enhance
+BATCH = 1
+KEY = os.environ.get("VOCALINK_MEDIA_KEY")
+
+
+class MediaJobError(RuntimeError):
+    pass
+
+
+class Job:
+    __slots__ = ('id', 'name', 'rid', 'args', 'conf', 'future', 'trace', 'stage', 'done', 'attempts', 'queued')
+
+    def __init__(self, id: int, name: str, rid: str, args: List[Any], future: asyncio.Future, conf: Optional[Dict] = None):
+        self.id: int = id
+        self.name: str = name
+        self.rid: str = rid
+        self.args: List[Any] = args
+        self.conf: Optional[Dict] = conf # the ServerConf it runs with, this server's when None
+        self.future: asyncio.Future = future
+        self.trace: Optional[Tuple[str, str]] = tracing.current() # stages done in the worker join it
+        self.stage: Optional[str] = None
+        self.done: Optional[float] = None # share of the stage, where the worker knows it
+        self.attempts: int = 0
+        self.queued: float = time.time()
+
+
+class Worker:
+    __slots__ = ('pid', 'connected', 'jobs', 'job')
+
+    def __init__(self, pid: int):
+        self.pid: int = pid
+        self.connected: float = time.time()
+        self.jobs: int = 0
+        self.job: Optional[Job] = None
+
+
+class MediaHandler:
+    """Runs AudioToolkit jobs in media worker processes and waits for their
+    results, the server process itself never decodes audio or loads a model.
+
+    Jobs queue until a worker is free, so with no worker connected they wait
+    for app.py (or `python -m backend.worker`) to start one."""
+
+    def __init__(self, conf: P.ServerConf):
+        self.conf: P.ServerConf = conf # sent with every job, workers follow config changes
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue() # (priority, id, Job)
+        self._ids = itertools.count(1)
+        self._workers: List[Worker] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._waiting_logged: bool = False
+        # with federation (PeersHandler) transcribe and enhance may run on a less
+        # loaded server, offload returns the job's result or None to run it here
+        self.offload: Optional[Callable[..., Awaitable[Optional[Any]]]] = None
+
+
+    async def start(self, port: int = P.MEDIA_PORT):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", port, limit=MAX_LINE)
+
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+
+
+    async def _submit(self, name: str, rid: str, args: List[Any], priority: int = BATCH, conf: Optional[Dict] = None) -> Any:
+        job = Job(next(self._ids), name, rid, args, asyncio.get_running_loop().create_future(), conf)
+        if not self._workers and not self._waiting_logged:
+            log.warning("No media worker connected, jobs wait for one (python -m backend.worker)")
+            self._waiting_logged = True
+        self._queue.put_nowait((priority, job.id, job))
+        return await job.future
+
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = json.loads(await reader.readline())
+            if hello.get("type") != "hello" or (KEY and not secrets.compare_digest(str(hello.get("key", "")), KEY)):
+                raise ValueError("not a media worker")
+            worker = Worker(int(hello.get("pid", 0)))
+        except (ValueError, AttributeError, ConnectionError) as e:
+            log.warning(f"Rejected a media worker connection: {e}")
+            writer.close()
+            return
+
+        self._workers.append(worker)
+        self._waiting_logged = False
+        MEDIA_WORKERS.inc(1)
+        log.info(f"Media worker {worker.pid} connected.")
+        try:
+            while True:
+                item = await self._next(reader)
+                if item is None:
+                    break
+                priority, _, job = item
+                if job.future.done(): # its caller gave up
+                    continue
+
+                worker.job = job
+                try:
+                    await self._run(job, reader, writer)
+                except Exception as e: # the worker broke the protocol or went away
+                    self._lost(worker, job, priority, e)
+                    break
+                finally:
+                    worker.job = None
+                    worker.jobs += 1
+        finally:
+            self._workers.remove(worker)
+            MEDIA_WORKERS.dec(1)
+            log.info(f"Media worker {worker.pid} disconnected.")
+            writer.close()
+
+
+    async def _next(self, reader: asyncio.StreamReader) -> Optional[Tuple[int, int, Job]]:
+        """The next queued job, None once the idle worker went away."""
+        get = asyncio.ensure_future(self._queue.get())
+        gone = asyncio.ensure_future(reader.read(1)) # an idle worker has nothing to say
+        await asyncio.wait((get, gone), return_when=asyncio.FIRST_COMPLETED)
+        if not gone.done():
+            gone.cancel()
+            await asyncio.gather(gone, return_exceptions=True) # the reader is the job's again
+            return get.result()
+
+        if get.done():
+            self._queue.put_nowait(get.result())
+        else:
+            get.cancel()
+        return None
+
+
+    async def _run(self, job: Job, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(json.dumps({
+            "type": "job",
+            "id": job.id,
+            "job": job.name,
+            "rid": job.rid,
+            "args": job.args,
+            "conf": job.conf or self.conf.model_dump(),
+            "profile": profiler.job_hz(job.rid),
+        }).encode() + b"\n")
+        await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("closed")
+            msg = json.loads(line)
+            if msg["id"] != job.id:
+                continue
+
+            kind = msg["type"]
+            if kind == "stage":
+                job.stage, job.done = msg["stage"], None
+                if msg["end"] is not None:
+                    AUDIO_STAGE.observe((msg["end"] - msg["start"]) / 1e9, msg["stage"])
+                    tracing.record(job.trace, f"audio.{msg['stage']}", msg["start"], msg["end"])
+            elif kind == "progress":
+                job.stage, job.done = msg["stage"], msg["done"]
+            elif kind == "result":
+                if msg.get("profile"):
+                    profiler.add_job_samples(job.rid, msg["profile"]["samples"], msg["profile"]["duration"])
+                if not job.future.done():
+                    job.future.set_result(msg["result"])
+                return
+            elif kind == "error":
+                if not job.future.done():
+                    job.future.set_exception(MediaJobError(msg["error"]))
+                return
+
+
+    def _lost(self, worker: Worker, job: Job, priority: int, e: Exception):
+        MEDIA_LOST.inc(1)
+        job.attempts += 1
+        log.error(f"Media worker {worker.pid} went away running {job.name} for {job.rid}: {e!r}")
+        if job.attempts < MAX_ATTEMPTS:
+            job.stage, job.done = None, None
+            self._queue.put_nowait((priority, job.id, job))
+        elif not job.future.done():
+            job.future.set_exception(MediaJobError(f"{job.name} took down {job.attempts} media workers"))
+
+
+    @property
+    def workers(self) -> int:
+        return len(self._workers)
+
+
+    def load(self) -> float:
+        """Queued and running jobs per connected worker."""
+        busy = sum(1 for w in self._workers if w.job is not None) + self._queue.qsize()
+        return busy / max(1, len(self._workers))
+
+
+    def status(self) -> Dict:
+        now = time.time()
+        return {
+            "queued": self._queue.qsize(),
+            "workers": [
+                {
+                    "pid": w.pid,
+                    "uptime": round(now - w.connected, 1),
+                    "jobs": w.jobs,
+                    "job": None if w.job is None else {
+                        "job": w.job.name,
+                        "rid": w.job.rid,
+                        "stage": w.job.stage,
+                        "done": w.job.done,
+                        "seconds": round(now - w.job.queued, 1),
+                        "attempt": w.job.attempts + 1,
+                    },
+                }
+                for w in self._workers
+            ],
+        }
+
+
+    async def transcribe(
+        self,
+        rid: str,
+        path: str,
+        regions_path: Optional[str] = None,
+        local: bool = False # a job a peer routed here, never passed on again
+    ) -> P.TranscriptResult:
+        if self.offload and not local:
+            result = await self.offload("transcribe", rid, {"original": path, "regions": regions_path}, [])
+            if result is not None:
+                return P.TranscriptResult.model_validate(result)
+        result = await self._submit("transcribe", rid, [path, rid, regions_path])
+        return P.TranscriptResult.model_validate(result)
+
+
+    async def analyze(self, rid: str, path: str, regions_path: Optional[str] = None) -> P.RecStats:
+        return P.RecStats.model_validate(await self._submit("analyze", rid, [path, regions_path]))
+
+
+    async def enhance(
+        self,
+        rid: str,
+        input_path: str,
+        output_path: str,
+        props: int,
+        profile_keys: Sequence[str] = (),
+        stats: Optional[P.RecStats] = None,
+        regions_path: Optional[str] = None,
+        local: bool = False,
+        conf: Optional[Dict] = None # a peer's, for a job it routed here
+    ) -> Tuple[float, int]:
+        if self.offload and not local:
+            # rendered with our settings. The noise profiles stay with our
+            # workers, the peer estimates the noise from the audio alone
+            result = await self.offload(
+                "enhance",
+                rid,
+                {"original": input_path, "regions": regions_path},
+                [props, stats.model_dump() if stats else None, self.conf.model_dump()],
+                output_path
+            )
+            if result is not None:
+                duration, size = result
+                return duration, size
+        duration, size = await self._submit("enhance", rid, [
+            input_path,
+            output_path,
+            props,
+            list(profile_keys),
+            stats.model_dump() if stats else None,
+            regions_path
+        ], conf=conf)
+        return duration, size
+
+
+    async def merge(
+        self,
+        rid: str,
+        inputs: List[str],
+        output: str,
+        mode: str = "overlap",
+        stats: Sequence[Optional[P.RecStats]] = ()
+    ) -> Tuple[float, int, P.RecStats]:
+        duration, size, merged = await self._submit("merge", rid, [
+            inputs,
+            output,
+            mode,
+            [s.model_dump() if s else None for s in stats]
+        ])
+        return duration, size, P.RecStats.model_validate(merged)
+
+
+    async def live(
+        self,
+        windows: List[Tuple[str, int, int, Optional[str]]]
+    ) -> Tuple[List[Optional[List[P.TranscriptSegment]]], List[Optional[str]]]:
+        """One live transcription pass over windows of s16le 16kHz PCM files,
+        given as (path, first sample, samples, language or None). Returns the
+        segments of each window, None without speech, and its language."""
+        result = await self._submit("live", "live", [windows], LIVE)
+        segments = [
+            None if s is None else [P.TranscriptSegment.model_validate(x) for x in s]
+            for s in result["segments"]
+        ]
+        return segments, result["languages"]
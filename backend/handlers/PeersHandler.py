@@ -0,0 +1,434 @@
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import os
+import secrets
+import shutil
+import time
+import uuid
+
+import httpx
+from fastapi import UploadFile
+from zeroconf import ServiceStateChange
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncServiceInfo, AsyncZeroconf
+
+import backend.core.primitives as P
+from backend.core.ClockSync import ClockFilter
+from backend.handlers.MediaHandler import MediaHandler
+from backend.utils.logging import log
+from backend.utils.metrics import PEERS, ROUTED_JOBS
+from backend.utils.utils import now_ms
+import backend.utils.tracing as tracing
+
+
+# servers on the LAN started with the same VOCALINK_FEDERATION_KEY find each
+# other through the _vocalink._tcp records they advertise anyway, VOCALINK_PEERS
+# (host:port,...) adds some by hand, e.g. a second server on another localhost
+# port. They talk HTTP and send the key in X-Federation-Key:
+# GET  /federation/node                      -> NodeStatus, polled every POLL_SECONDS, the round trip also times the peer's clock
+# GET  {filesUrl}/recordings                 -> its recordings, for the merged catalog
+# POST /federation/action                    FederatedAction, triggerTime in the peer's clock -> {"sessions": int}
+# POST /federation/jobs/{transcribe|enhance} multipart rid, args (JSON list), original, regions? -> the result as JSON,
+#                                            enhance answers with the enhanced file and its result in X-Job-Result,
+#                                            its args are [props, stats, ServerConf], rendered with the sender's settings
+#
+# A *_ALL action gets a trigger time late enough for every server's sessions and
+# each peer gets it in its own clock. Transcribe and enhance go to the least
+# loaded peer while every local media worker is busy and that peer has one free.
+KEY = os.environ.get("VOCALINK_FEDERATION_KEY", "")
+ENABLED = bool(KEY)
+STATIC_PEERS = [p.strip() for p in os.environ.get("VOCALINK_PEERS", "").split(",") if p.strip()]
+HEADER = "X-Federation-Key"
+SERVICE = "_vocalink._tcp.local."
+POLL_SECONDS = 2
+LOST_SECONDS = 3 * POLL_SECONDS # a peer that missed this many polls is left out
+REQUEST_TIMEOUT = 3
+JOB_TIMEOUT = httpx.Timeout(REQUEST_TIMEOUT, read=None) # an enhance runs for minutes
+COPY_BYTES = 1024 * 1024
+
+
+def _copy(file, path: str):
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(file, buffer, COPY_BYTES)
+
+
+def _open(path: str) -> Tuple[BinaryIO, int]:
+    file = open(path, "rb")
+    return file, os.fstat(file.fileno()).st_size
+
+
+class _Multipart:
+    """A multipart/form-data body streamed from the files, read off the loop.
+    httpx only takes files it reads on the loop itself."""
+
+    def __init__(self, data: Dict[str, str], files: Dict[str, Tuple[str, BinaryIO, int]]):
+        self.boundary: str = secrets.token_hex(16)
+        self._files = files
+        self._head = b"".join(
+            self._part(f'name="{field}"') + value.encode() + b"\r\n" for field, value in data.items()
+        )
+        self.length: int = len(self._head) + len(self._tail()) + sum(
+            len(self._part(f'name="{field}"; filename="{name}"', True)) + size + 2
+            for field, (name, _, size) in files.items()
+        )
+
+    def _part(self, disposition: str, file: bool = False) -> bytes:
+        head = f"--{self.boundary}\r\nContent-Disposition: form-data; {disposition}\r\n"
+        if file:
+            head += "Content-Type: application/octet-stream\r\n"
+        return (head + "\r\n").encode()
+
+    def _tail(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        yield self._head
+        for field, (name, file, _) in self._files.items():
+            yield self._part(f'name="{field}"; filename="{name}"', True)
+            while chunk := await asyncio.to_thread(file.read, COPY_BYTES):
+                yield chunk
+            yield b"\r\n"
+        yield self._tail()
+
+
+class Peer:
+    __slots__ = ('address', 'mdns', 'status', 'clock', 'seen', 'failing', 'routed')
+
+    def __init__(self, address: str, mdns: bool):
+        self.address: str = address # host:port of its control server
+        self.mdns: bool = mdns # forgotten when its record goes away
+        self.status: Optional[P.NodeStatus] = None
+        self.clock: ClockFilter = ClockFilter() # theta is its clock minus ours
+        self.seen: float = 0.0
+        self.failing: bool = False # its last poll went unanswered
+        self.routed: int = 0 # jobs sent since its last status, they count against its load
+
+
+    @property
+    def up(self) -> bool:
+        return self.status is not None and time.time() - self.seen < LOST_SECONDS
+
+
+    def load(self) -> float:
+        status = self.status
+        return status.load + self.routed / max(1, status.workers)
+
+
+    def clock_of(self, t: int) -> int:
+        """t, in our clock, as the peer's clock reads it."""
+        return t + round(self.clock.theta or 0)
+
+
+class PeersHandler:
+    """The other servers of this server's federation, how to reach them and
+    how busy they are."""
+
+    def __init__(self, media: MediaHandler, root: str = "storage"):
+        self.id: str = secrets.token_hex(8)
+        self._media: MediaHandler = media
+        self.jobs_dir: str = os.path.join(root, "federation") # files of jobs peers routed here
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        self._peers: Dict[str, Peer] = {address: Peer(address, False) for address in STATIC_PEERS}
+        self._names: Dict[str, str] = {} # mDNS name, address
+        self._ignored: Set[str] = set() # addresses that turned out to be us or a peer known under another
+        self._http: Optional[httpx.AsyncClient] = None
+        self._browser: Optional[AsyncServiceBrowser] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+
+    def accepts(self, key: Optional[str]) -> bool:
+        return bool(key) and secrets.compare_digest(key, KEY)
+
+
+    async def start(self, mdns: Optional[AsyncZeroconf]):
+        self._loop = asyncio.get_running_loop()
+        self._http = httpx.AsyncClient(headers={HEADER: KEY}, timeout=REQUEST_TIMEOUT)
+        if mdns:
+            self._browser = AsyncServiceBrowser(mdns.zeroconf, SERVICE, handlers=[self._on_service])
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._browser:
+            await self._browser.async_cancel()
+        if self._http:
+            await self._http.aclose()
+
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+    def _on_service(self, zeroconf, service_type: str, name: str, state_change: ServiceStateChange):
+        # zeroconf calls this from its own thread
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._spawn, self._resolve(zeroconf, service_type, name, state_change))
+
+
+    async def _resolve(self, zeroconf, service_type: str, name: str, state_change: ServiceStateChange):
+        if state_change == ServiceStateChange.Removed:
+            address = self._names.pop(name, None)
+            peer = self._peers.get(address) if address else None
+            if peer and peer.mdns:
+                del self._peers[peer.address]
+                log.info(f"[FEDERATION] {name} went away")
+            return
+
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(zeroconf, 3000):
+            return
+        # servers without a federation key don't say so, and wouldn't answer
+        if not info.properties.get(b"federation"):
+            return
+        addresses = info.parsed_addresses()
+        if not addresses or not info.port:
+            return
+        address = f"{addresses[0]}:{info.port}"
+        self._names[name] = address
+        if address not in self._peers and address not in self._ignored:
+            self._peers[address] = Peer(address, True)
+
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self._poll(peer) for peer in list(self._peers.values())))
+            PEERS.set(len(self.up()))
+            await asyncio.sleep(POLL_SECONDS)
+
+
+    async def _poll(self, peer: Peer):
+        t0 = now_ms()
+        try:
+            res = await self._http.get(f"http://{peer.address}/federation/node")
+            res.raise_for_status()
+            status = P.NodeStatus.model_validate_json(res.content)
+        except (httpx.HTTPError, ValueError) as e:
+            if peer.status and not peer.failing:
+                log.warning(f"[FEDERATION] {peer.status.name} at {peer.address} stopped answering: {e!r}")
+            peer.failing = True
+            return
+        t3 = now_ms()
+
+        if status.id == self.id or any(
+            p is not peer and p.status and p.status.id == status.id for p in self._peers.values()
+        ):
+            self._peers.pop(peer.address, None)
+            self._ignored.add(peer.address)
+            return
+
+        if not peer.up or peer.failing:
+            log.info(f"[FEDERATION] {status.name} at {peer.address} joined")
+        # same estimate as a session's clock sync, the peer read its clock halfway through
+        peer.clock.add(t3 - t0, status.now - (t0 + t3) / 2, t3)
+        peer.status, peer.seen, peer.failing, peer.routed = status, time.time(), False, 0
+
+
+    def up(self) -> List[Peer]:
+        return [peer for peer in self._peers.values() if peer.up]
+
+
+    def trigger_delay(self) -> int:
+        """What the slowest peer needs between an action and its trigger time,
+        its sessions' delay and the way there."""
+        return max((p.status.triggerDelay + round(p.clock.bound or 0) for p in self.up()), default=0)
+
+
+    async def forward(self, action: P.WSActions, triggerTime: Optional[int]) -> int:
+        """Sends a *_ALL action to every peer, triggerTime in our clock.
+        Returns how many of their sessions it reached."""
+        reached = await asyncio.gather(*(self._forward(peer, action, triggerTime) for peer in self.up()))
+        return sum(reached)
+
+
+    async def _forward(self, peer: Peer, action: P.WSActions, triggerTime: Optional[int]) -> int:
+        body = P.FederatedAction(
+            action=action,
+            triggerTime=None if triggerTime is None else peer.clock_of(triggerTime)
+        )
+        try:
+            res = await self._http.post(
+                f"http://{peer.address}/federation/action",
+                content=body.model_dump_json(),
+                headers={"Content-Type": "application/json"}
+            )
+            res.raise_for_status()
+            return int(res.json()["sessions"])
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            log.error(f"[FEDERATION] {action.value} didn't reach {peer.status.name}: {e!r}")
+            return 0
+
+
+    async def catalog(self) -> List[P.NodeCatalog]:
+        """The recordings of every peer, downloaded from where each serves them."""
+        return await asyncio.gather(*(self._catalog(peer) for peer in self.up()))
+
+
+    async def _catalog(self, peer: Peer) -> P.NodeCatalog:
+        status = peer.status
+        entry = P.NodeCatalog(node=status.name, url=status.url, filesUrl=status.filesUrl)
+        try:
+            res = await self._http.get(f"{status.filesUrl}/recordings")
+            res.raise_for_status()
+            entry.recordings = [P.RecMetadata.model_validate(r) for r in res.json()]
+        except (httpx.HTTPError, ValueError) as e:
+            entry.error = repr(e)
+        return entry
+
+
+    def _pick(self) -> Optional[Peer]:
+        """The least loaded peer with a free worker, while none of ours is."""
+        if self._media.workers and self._media.load() < 1:
+            return None
+        peers = [p for p in self.up() if p.status.workers]
+        best = min(peers, key=Peer.load, default=None)
+        if best is None or best.load() >= 1:
+            return None
+        return best
+
+
+    async def offload(
+        self,
+        job: str,
+        rid: str,
+        inputs: Dict[str, Optional[str]],
+        args: List[Any],
+        output: Optional[str] = None
+    ) -> Optional[Any]:
+        """Runs job on a less loaded peer, MediaHandler.offload. Sends the files
+        in inputs along and stores what the peer made at output. None when it
+        stays here, or the peer failed and it runs here after all."""
+        peer = self._pick()
+        if not peer:
+            return None
+
+        peer.routed += 1
+        name = peer.status.name
+        files = {}
+        try:
+            with tracing.child_span("federation.job", job=job, peer=name):
+                for field, path in inputs.items():
+                    if not path:
+                        continue
+                    try:
+                        file, size = await asyncio.to_thread(_open, path)
+                    except FileNotFoundError:
+                        continue
+                    files[field] = (os.path.basename(path), file, size)
+                body = _Multipart({"rid": rid, "args": json.dumps(args)}, files)
+                async with self._http.stream(
+                    "POST",
+                    f"http://{peer.address}/federation/jobs/{job}",
+                    content=body,
+                    headers={
+                        "Content-Type": f"multipart/form-data; boundary={body.boundary}",
+                        "Content-Length": str(body.length)
+                    },
+                    timeout=JOB_TIMEOUT
+                ) as res:
+                    res.raise_for_status()
+                    if output is None:
+                        result = json.loads(await res.aread())
+                    else:
+                        result = json.loads(res.headers["X-Job-Result"])
+                        await self._receive(res, output)
+        except (httpx.HTTPError, OSError, ValueError, KeyError) as e:
+            ROUTED_JOBS.inc(1, job, "failed")
+            log.error(f"[FEDERATION] {job} of {rid} failed on {name}, running it here: {e!r}")
+            return None
+        finally:
+            for _, file, _ in files.values():
+                file.close()
+
+        ROUTED_JOBS.inc(1, job, "ok")
+        log.info(f"[FEDERATION] {job} of {rid} ran on {name}")
+        return result
+
+
+    async def _receive(self, res: httpx.Response, output: str):
+        part = f"{output}.part"
+        try:
+            with open(part, "wb") as file:
+                async for chunk in res.aiter_bytes(COPY_BYTES):
+                    await asyncio.to_thread(file.write, chunk)
+            os.replace(part, output)
+        except BaseException:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            raise
+
+
+    async def run_job(
+        self,
+        job: str,
+        rid: str,
+        args: List[Any],
+        original: UploadFile,
+        regions: Optional[UploadFile]
+    ) -> Tuple[Any, str, Optional[str]]:
+        """Runs a job a peer routed here, on copies of its files. Returns the
+        result, the directory to remove once it was sent and enhance's output."""
+        dir = os.path.join(self.jobs_dir, uuid.uuid4().hex)
+        os.makedirs(dir)
+        _, ext = os.path.splitext(original.filename or "")
+        original_path = os.path.join(dir, f"original{ext}")
+        regions_path = os.path.join(dir, "regions.json") # the worker caches what it detects here
+        try:
+            with tracing.span(f"federation.{job}", rid=rid):
+                await asyncio.to_thread(_copy, original.file, original_path)
+                if regions:
+                    await asyncio.to_thread(_copy, regions.file, regions_path)
+
+                if job == "transcribe":
+                    result = await self._media.transcribe(rid, original_path, regions_path, local=True)
+                    return result.model_dump(), dir, None
+
+                props, stats, conf = args
+                output = os.path.join(dir, f"enhanced{ext}")
+                duration, size = await self._media.enhance(
+                    rid,
+                    original_path,
+                    output,
+                    props,
+                    (), # our noise profiles are of our sessions
+                    P.RecStats.model_validate(stats) if stats else None,
+                    regions_path,
+                    local=True,
+                    conf=P.ServerConf.model_validate(conf).model_dump()
+                )
+                return [duration, size], dir, output
+        except BaseException:
+            shutil.rmtree(dir, ignore_errors=True)
+            raise
+
+
+    def report(self) -> List[Dict]:
+        now = time.time()
+        return [
+            {
+                "address": peer.address,
+                "mdns": peer.mdns,
+                "up": peer.up,
+                "name": peer.status.name if peer.status else None,
+                "lastSeen": round(now - peer.seen, 1) if peer.seen else None,
+                "offsetMs": peer.clock.theta,
+                "rttMs": peer.clock.bound,
+                "activeSessions": peer.status.activeSessions if peer.status else None,
+                "workers": peer.status.workers if peer.status else None,
+                "load": peer.load() if peer.status else None,
+            }
+            for peer in self._peers.values()
+        ]
@@ -1,19 +1,37 @@
-from typing import Dict, List, Optional, Callable 
+from typing import Dict, List, Optional, Callable, Set, Tuple
 from enum import Enum
 import asyncio
+import glob
+import hashlib
 import os
+import re
 import shutil
 import uuid
 import json
+import time
 from fastapi import UploadFile
 
 import backend.core.primitives as P
 from backend.utils.logging import log
 from backend.utils.utils import now_ms
-from backend.utils.audioToolkit import AudioToolkit
+from backend.handlers.MediaHandler import MediaHandler
+from backend.core.SharedState import SharedState
+from backend.core.BlobStore import BlobStore, COMPACT, digest_file, link, new_digest
+from backend.utils.metrics import TimedLock, DEDUP_BYTES, REUSED, UPLOAD_BYTES, UPLOAD_SECONDS
+from backend.utils.tracing import child_span
 
 NotifyCallback = Callable[[P.WSPayload], None]
-ALLOWED_EXTENSIONS = {".m4a", ".mp4", ".ogg"}
+ALLOWED_EXTENSIONS = {".m4a", ".mp4", ".ogg", ".wav"}
+# ServerConf fields an enhance render depends on besides its props
+ENHANCE_SETTINGS = ("noiseStrength", "loudnessTarget", "filterBassBoost", "airBoost", "compressorThreshold", "compressorRatio")
+
+def _write_text(path: str, text: str):
+    # replaced, not rewritten, other recordings may link to the old one
+    temp = f"{path}.tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp, path)
+
 
 class RecordingTypes(Enum):
     ORIGINAL = 'original'
@@ -21,23 +39,36 @@ class RecordingTypes(Enum):
     TRANSCRIPT = 'transcript'
 
 class RecordingsHandler:
-    def __init__(self, conf: P.ServerConf, root: str = "storage"):    
+    def __init__(self, media: MediaHandler, root: str = "storage"):    
         self.root: str = root
         if os.path.exists(self.root):
             shutil.rmtree(self.root)
 
         self._recordings: Dict[str, P.RecMetadata] = {}
-        self._lock = asyncio.Lock()
+        self._lock = TimedLock("recordings")
 
-        self.audio = AudioToolkit(conf)
+        self.media: MediaHandler = media
+        self.shared: Optional[SharedState] = None # set when HTTP workers serve recordings
 
         self.original_dir: str = os.path.join(root, "original")
         self.enhanced_dir: str = os.path.join(root, "enhanced")
         self.transcripts_dir: str = os.path.join(root, "transcripts")
+        self.regions_dir: str = os.path.join(root, "regions")
+        self.spool_dir: str = os.path.join(root, "spool")
+        self.live_dir: str = os.path.join(root, "live")
 
         os.makedirs(self.original_dir, exist_ok=True)
         os.makedirs(self.enhanced_dir, exist_ok=True)
         os.makedirs(self.transcripts_dir, exist_ok=True)
+        os.makedirs(self.regions_dir, exist_ok=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        os.makedirs(self.live_dir, exist_ok=True)
+        self.blobs: BlobStore = BlobStore(root)
+        self.used: Dict[str, float] = {} # rid, when its audio was last read, the storage manager evicts by it
+        # storage passes change files outside the lock, see compact and evict_*
+        self._moving: Dict[str, asyncio.Event] = {} # rid, set once its files are in place
+        self._dropping: Set[str] = set() # blob hashes whose renders are being removed
+        self._renders: Dict[str, asyncio.Event] = {} # render path, set once its enhance is over
 
     def _get_ext(self, recName: str) -> str:
         _, ext = os.path.splitext(recName or "")
@@ -46,9 +77,16 @@ class RecordingsHandler:
         return ext
 
     def _original_path(self, meta: P.RecMetadata) -> str:
-        ext = self._get_ext(meta.recName)
+        # transcoded once it went cold, see backend/handlers/StorageHandler.py
+        ext = COMPACT if meta.rid in self.blobs.compact else self._get_ext(meta.recName)
         return os.path.join(self.original_dir, f"{meta.rid}{ext}")
 
+    def _upload_temp(self, path: str, original: str) -> bool:
+        # what an HTTP worker writes, {original}.{pid}.tmp in the originals dir
+        name = os.path.basename(path)
+        return (re.fullmatch(re.escape(os.path.basename(original)) + r"\.\d+\.tmp", name) is not None
+                and os.path.realpath(path) == os.path.join(os.path.realpath(self.original_dir), name))
+
     def _enhanced_path(self, meta: P.RecMetadata) -> str:
         ext = self._get_ext(meta.recName)
         return os.path.join(self.enhanced_dir, f"{meta.rid}{ext}")
@@ -56,23 +94,73 @@ class RecordingsHandler:
     def _transcript_path(self, meta: P.RecMetadata) -> str:
         return os.path.join(self.transcripts_dir, f"{meta.rid}.json")
 
+    def _regions_path(self, meta: P.RecMetadata) -> str:
+        # shared by every recording of the same audio once it is stored
+        return self.blobs.derived(meta.rid, ".regions.json") or os.path.join(self.regions_dir, f"{meta.rid}.json")
+
+    def _spool_path(self, meta: P.RecMetadata) -> str:
+        return os.path.join(self.spool_dir, f"{meta.rid}.part")
+
+    def _store_blob(self, rid: str, hash: str, temp_path: str, original: str) -> int:
+        """Stores the file at temp_path as the original of rid and returns its
+        size, called with the lock held."""
+        size = os.path.getsize(temp_path)
+        if not self.blobs.store(rid, hash, temp_path, original):
+            DEDUP_BYTES.inc(size)
+            log.info(f"Original of {rid} is already stored, linked to it")
+        return size
+
+    def _render_suffix(self, props: int, profile_keys: Tuple[str, ...], ext: str) -> str:
+        # a render made with other settings or another noise profile isn't this one
+        key = json.dumps([[getattr(self.media.conf, name) for name in ENHANCE_SETTINGS], list(profile_keys)])
+        return f".enhanced-{props}-{hashlib.sha256(key.encode()).hexdigest()[:12]}{ext}"
+
+    def touch(self, rid: str):
+        self.used[rid] = time.time()
+
+    def last_used(self, meta: P.RecMetadata) -> float:
+        return self.used.get(meta.rid, meta.createdAt / 1000)
+
+    def _idle(self, meta: P.RecMetadata) -> bool:
+        return P.RecStates.WORKING not in (meta.original, meta.enhanced, meta.transcript) and meta.rid not in self._moving
+
+    def paths(self, meta: P.RecMetadata) -> Dict[str, str]:
+        """Where the files of meta are, or would be."""
+        try:
+            return {
+                "original": self._original_path(meta),
+                "enhanced": self._enhanced_path(meta),
+                "transcript": self._transcript_path(meta),
+            }
+        except ValueError:
+            return {"transcript": self._transcript_path(meta)}
+
+    def _share(self, meta: P.RecMetadata):
+        """Mirrors meta to the HTTP workers, called with the lock held after
+        every change."""
+        if self.shared is not None:
+            self.shared.put_recording(meta, self.paths(meta))
+
     async def set_original(self, rid: str, state: P.RecStates):
         async with self._lock:
             meta = self._recordings.get(rid)
             if meta:
                 meta.original = state
+                self._share(meta)
 
     async def set_transcript(self, rid: str, state: P.RecStates):
         async with self._lock:
             meta = self._recordings.get(rid)
             if meta:
                 meta.transcript = state
+                self._share(meta)
 
     async def set_enhanced(self, rid: str, state: P.RecStates):
         async with self._lock:
             meta = self._recordings.get(rid)
             if meta:
                 meta.enhanced = state
+                self._share(meta)
 
 
     async def stage(self, info: P.RecStageInfo, session: P.SessionMetadata ) -> Optional[P.RecMetadata]:
@@ -89,6 +177,7 @@ class RecordingsHandler:
         )
         async with self._lock:
             self._recordings[meta.rid] = meta
+            self._share(meta)
         return meta
 
 
@@ -110,19 +199,28 @@ class RecordingsHandler:
             return meta
 
         try:
-            with open(temp_path, "wb") as buffer:
-                while True:
-                    chunk = await file.read(1024 * 1024)
-                    if not chunk:
-                        break
-                    buffer.write(chunk)
-
-            os.replace(temp_path, path)
-            size = os.path.getsize(path)
+            started = time.perf_counter()
+            digest = new_digest() # taken on the way to disk, the file is never read back
+            with child_span("rec.save", rid=rid) as span:
+                with open(temp_path, "wb") as buffer:
+                    while True:
+                        chunk = await file.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        buffer.write(chunk)
+                        digest.update(chunk)
+                        UPLOAD_BYTES.inc(len(chunk))
+
+                size = os.path.getsize(temp_path)
+                if span:
+                    span.attrs["bytes"] = size
+            UPLOAD_SECONDS.observe(time.perf_counter() - started)
 
             async with self._lock:
+                await asyncio.to_thread(self._store_blob, rid, digest.hexdigest(), temp_path, path)
                 meta.sizeBytes = size
                 meta.original = P.RecStates.OK
+                self._share(meta)
 
             return meta
         except Exception as e:
@@ -136,13 +234,75 @@ class RecordingsHandler:
             async with self._lock:
                 if rid in self._recordings:
                     meta.original = P.RecStates.NA
+                    self._share(meta)
             return meta
 
         finally:
             await file.close()
 
 
+    async def store_upload(self, rid: str, temp_path: str, size: int, hash: str) -> Optional[P.RecMetadata]:
+        """Moves an upload an HTTP worker wrote to temp_path in as the original
+        of rid, hash is the sha256 it took while writing it."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.original != P.RecStates.WORKING:
+                return None
+
+            try:
+                original = self._original_path(meta)
+                if not self._upload_temp(temp_path, original):
+                    raise ValueError(f"{temp_path!r} is not an upload of it")
+                await asyncio.to_thread(self._store_blob, rid, hash, temp_path, original)
+            except (ValueError, OSError) as e:
+                log.error(f"Storing the upload of {rid} failed: {e}")
+                meta.original = P.RecStates.NA
+                self._share(meta)
+                return meta.model_copy()
+
+            meta.sizeBytes = size
+            meta.original = P.RecStates.OK
+            self._share(meta)
+            return meta.model_copy()
+
+
+    async def spool(self, rid: str) -> Optional[str]:
+        """Path a live stream of rid appends to, None once its original is stored."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.original != P.RecStates.WORKING:
+                return None
+            return self._spool_path(meta)
+
+
+    async def adopt(self, rid: str, duration: float, hash: str) -> Optional[P.RecMetadata]:
+        """Moves the finished spool of rid in as its original, hash is the
+        sha256 of what was appended to it."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.original != P.RecStates.WORKING:
+                return None
+
+            try:
+                # the lock keeps the blob refs consistent, the loop goes on meanwhile
+                size = await asyncio.to_thread(
+                    self._store_blob, rid, hash, self._spool_path(meta), self._original_path(meta)
+                )
+            except (ValueError, OSError) as e:
+                log.error(f"Storing the stream of {rid} failed: {e}")
+                meta.original = P.RecStates.NA
+                self._share(meta)
+                return meta.model_copy()
+
+            meta.sizeBytes = size
+            meta.duration = duration
+            meta.original = P.RecStates.OK
+            self._share(meta)
+            return meta.model_copy()
+
+
     async def _transcribe(self, rid: str) -> Optional[P.RecMetadata]:
+        await self._settled([rid])
         async with self._lock:
             meta = self._recordings.get(rid)
             if not meta:
@@ -150,35 +310,102 @@ class RecordingsHandler:
             if meta.transcript != P.RecStates.WORKING:
                 return None
 
+            # the same audio was transcribed for another recording
+            done = self.blobs.derived(rid, ".transcript.json")
+            if done and os.path.exists(done):
+                try:
+                    link(done, self._transcript_path(meta))
+                    meta.transcript = P.RecStates.OK
+                    self._share(meta)
+                    REUSED.inc(1, "transcribe")
+                    return meta.model_copy()
+                except OSError as e:
+                    log.error(f"Reusing the transcript of {rid} failed: {e}")
+
         original = self._original_path(meta)
+        self.touch(rid)
 
         if not os.path.exists(original):
             async with self._lock:
                 meta.transcript = P.RecStates.NA
+                self._share(meta)
                 return meta.model_copy()
 
         try:
-            transcript_result: P.TranscriptResult = await asyncio.to_thread(
-                self.audio.transcribe,
-                original,
-                rid
-            )
+            # stages timed by the media worker join the trace under this span
+            with child_span("worker.transcribe"):
+                transcript_result: P.TranscriptResult = await self.media.transcribe(
+                    rid,
+                    original,
+                    self._regions_path(meta)
+                )
 
-            transcript_path = self._transcript_path(meta)
-
-            with open(transcript_path, "w", encoding="utf-8") as f:
-                f.write(transcript_result.model_dump_json(indent=2))
+            return await self.store_transcript(rid, transcript_result)
 
+        except Exception as e:
+            log.error(f"Transcription failed for {rid}: {e}")
             async with self._lock:
-                meta.transcript = P.RecStates.OK
+                meta.transcript = P.RecStates.NA
+                self._share(meta)
                 return meta.model_copy()
 
-        except Exception as e:
-            log.error(f"Transcription failed for {rid}: {e}")
+
+    async def store_transcript(self, rid: str, result: P.TranscriptResult) -> Optional[P.RecMetadata]:
+        """Writes result as the transcript of rid, which has to be WORKING on one."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.transcript != P.RecStates.WORKING:
+                return None
+            transcript_path = self._transcript_path(meta)
+            shared_path = self.blobs.derived(rid, ".transcript.json")
+
+        try:
+            with child_span("rec.write_transcript"):
+                await asyncio.to_thread(_write_text, shared_path or transcript_path, result.model_dump_json(indent=2))
+                if shared_path:
+                    await asyncio.to_thread(link, shared_path, transcript_path)
+        except OSError as e:
+            log.error(f"Storing the transcript of {rid} failed: {e}")
             async with self._lock:
                 meta.transcript = P.RecStates.NA
+                self._share(meta)
+                return meta.model_copy()
+
+        async with self._lock:
+            meta.transcript = P.RecStates.OK
+            self._share(meta)
+            return meta.model_copy()
+
+
+    async def _analyze(self, rid: str) -> Optional[P.RecMetadata]:
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.original != P.RecStates.OK:
+                return None
+            original = self._original_path(meta)
+            regions = self._regions_path(meta)
+            hash = self.blobs.of(rid)
+            stats = self.blobs.stats.get(hash) if hash else None
+            if stats:
+                meta.stats = stats
+                self._share(meta)
+                REUSED.inc(1, "analyze")
                 return meta.model_copy()
 
+        try:
+            with child_span("worker.analyze"):
+                stats: P.RecStats = await self.media.analyze(rid, original, regions)
+        except Exception as e:
+            log.error(f"Analysis failed for {rid}: {e}")
+            return None
+
+        async with self._lock:
+            if hash:
+                self.blobs.stats[hash] = stats
+            meta.stats = stats
+            self._share(meta)
+            return meta.model_copy()
+
 
     def resolve_transcript(self, rid: str) -> Optional[P.TranscriptResult]:
         meta = self._recordings.get(rid)
@@ -203,13 +430,15 @@ class RecordingsHandler:
         if not ids:
             return None
 
+        await self._settled(ids)
         async with self._lock:
-            metas = []
+            metas: List[P.RecMetadata] = []
             for id in ids:
                 meta = self._recordings.get(id)
                 if not meta or meta.original != P.RecStates.OK:
                     return None
                 metas.append(meta)
+                self.touch(id)
 
             new_id = str(uuid.uuid4())
             ext = self._get_ext(metas[0].recName)
@@ -226,29 +455,62 @@ class RecordingsHandler:
             )
 
             self._recordings[new_id] = merged_meta
+            output = self._original_path(merged_meta)
+
+            # the same recordings were merged before
+            inputs = tuple(self.blobs.of(meta.rid) or "" for meta in metas)
+            done = self.blobs.merges.get(inputs) if all(inputs) else None
+            if done:
+                hash, duration = done
+                try:
+                    self.blobs.link_blob(new_id, hash, output)
+                    merged_meta.duration = duration
+                    merged_meta.sizeBytes = os.path.getsize(output)
+                    merged_meta.stats = self.blobs.stats.get(hash)
+                    merged_meta.merged = ids
+                    merged_meta.original = P.RecStates.OK
+                    self._share(merged_meta)
+                    REUSED.inc(1, "merge")
+                    return merged_meta.model_copy()
+                except OSError as e:
+                    log.error(f"Reusing a merge failed: {e}")
+            self._share(merged_meta)
 
         try:
-            duration, size = await asyncio.to_thread(
-                self.audio.merge,
-                [self._original_path(meta) for meta in metas],
-                self._original_path(merged_meta),
-            )
+            with child_span("worker.merge"):
+                duration, size, stats = await self.media.merge(
+                    new_id,
+                    [self._original_path(meta) for meta in metas],
+                    output,
+                    "overlap",
+                    [meta.stats for meta in metas]
+                )
+            # ffmpeg wrote it, so this is the one original read back for its hash
+            hash = await asyncio.to_thread(digest_file, output)
 
             async with self._lock:
+                await asyncio.to_thread(self._store_blob, new_id, hash, output, output)
+                self.blobs.stats[hash] = stats
+                if all(inputs):
+                    self.blobs.merges[inputs] = (hash, duration)
                 merged_meta.duration = duration
                 merged_meta.sizeBytes = size
+                merged_meta.stats = stats
                 merged_meta.merged = ids
                 merged_meta.original = P.RecStates.OK
+                self._share(merged_meta)
                 return merged_meta.model_copy()
 
         except Exception as e:
             log.error(f"Merge failed: {e}")
             async with self._lock:
                 merged_meta.merged = None
+                self._share(merged_meta)
                 return merged_meta.model_copy()
 
 
     async def _enhance(self, rid: str, props: int) -> Optional[P.RecMetadata]:
+        await self._settled([rid])
         async with self._lock:
             meta = self._recordings.get(rid)
             if not meta:
@@ -256,28 +518,275 @@ class RecordingsHandler:
             
             original_path = self._original_path(meta)
             if not os.path.exists(original_path):
-                return None
+                # e.g. evicted, see backend/handlers/StorageHandler.py
+                meta.enhanced = P.RecStates.NA
+                self._share(meta)
+                return meta.model_copy()
+            self.touch(rid)
 
             meta.enhanced = P.RecStates.WORKING
+            self._share(meta)
             enhanced_path = self._enhanced_path(meta)
+            # same phone, same room: reuse its noise floor. Merges mix several phones
+            profile_keys = () if meta.merged else (f"session:{meta.sessionId}", f"device:{meta.device}")
+            stats = meta.stats
+            regions = self._regions_path(meta)
+            # rendered per audio, props and settings, whichever recording asked first
+            render = self.blobs.derived(rid, self._render_suffix(props, profile_keys, os.path.splitext(enhanced_path)[1]))
+            if self.blobs.of(rid) in self._dropping:
+                render = None # rendered for this one alone
+            rendering = self._renders.get(render) if render else None
+            reused = bool(render) and not rendering and os.path.exists(render)
+            if render and not rendering and not reused:
+                self._renders[render] = asyncio.Event()
+
+        if rendering:
+            # another recording of the audio renders it, wait for it
+            await rendering.wait()
+            reused = await asyncio.to_thread(os.path.exists, render)
+            if not reused:
+                render = None # it failed, rendered for this one alone
+        owned = bool(render) and not reused
 
         try:
-            await asyncio.to_thread(
-                self.audio.enhance,
-                original_path,
-                enhanced_path,
-                props
-            )
+            if reused:
+                REUSED.inc(1, "enhance")
+            else:
+                with child_span("worker.enhance", props=props):
+                    await self.media.enhance(
+                        rid,
+                        original_path,
+                        render or enhanced_path,
+                        props,
+                        profile_keys,
+                        stats,
+                        regions
+                    )
+            if render:
+                await asyncio.to_thread(link, render, enhanced_path)
 
             async with self._lock:
                 meta.enhanced = P.RecStates.OK
+                self._share(meta)
                 return meta.model_copy()
 
         except Exception as e:
             log.error(f"Enhancement failed for {rid}: {e}")
+            if owned:
+                # a render cut short must not be taken for a finished one
+                await asyncio.to_thread(self._delete_file_safely, render)
             async with self._lock:
                 meta.enhanced = P.RecStates.NA
+                self._share(meta)
                 return meta.model_copy()
+        finally:
+            if owned:
+                self._renders.pop(render).set()
+
+
+    async def by_last_use(self) -> List[P.RecMetadata]:
+        """Every recording, least recently used first."""
+        async with self._lock:
+            metas = sorted(self._recordings.values(), key=self.last_used)
+            return [meta.model_copy() for meta in metas]
+
+
+    async def cold_blobs(self, before: float) -> List[Tuple[str, str]]:
+        """(hash, path) of the untranscoded blobs whose every recording was
+        last used before `before`, least recently used first."""
+        async with self._lock:
+            found: List[Tuple[float, str, str]] = []
+            for hash in {self.blobs.of(rid) for rid in self._recordings} - {None}:
+                metas = [self._recordings.get(rid) for rid in self.blobs.refs(hash) if rid not in self.blobs.compact]
+                if not metas or not all(
+                    meta and self._idle(meta) and meta.original == P.RecStates.OK
+                    and os.path.splitext(meta.recName)[1] != COMPACT
+                    for meta in metas
+                ):
+                    continue
+                used = max(self.last_used(meta) for meta in metas)
+                if used < before:
+                    found.append((used, hash, self.blobs.path(hash)))
+            return [(hash, path) for _, hash, path in sorted(found)]
+
+
+    async def compact(self, hash: str, temp_path: str) -> List[P.RecMetadata]:
+        """Moves the transcode of blob hash at temp_path in, as the original of
+        every recording that read the blob."""
+        async with self._lock:
+            metas = [self._recordings.get(rid) for rid in self.blobs.refs(hash) if rid not in self.blobs.compact]
+            # used or changed while it was transcoded, try again when it's cold
+            ready = metas and all(meta and self._idle(meta) and meta.original == P.RecStates.OK for meta in metas)
+            if ready:
+                done = self._move([meta.rid for meta in metas])
+        if not ready:
+            await asyncio.to_thread(self._delete_file_safely, temp_path)
+            return []
+
+        compact = self.blobs.path(hash, COMPACT)
+        links = [os.path.join(self.original_dir, f"{meta.rid}{COMPACT}") for meta in metas]
+        try:
+            size = await asyncio.to_thread(self._link_compact, temp_path, compact, links)
+        except OSError as e:
+            log.error(f"Storing the transcode of blob {hash} failed: {e}")
+            await asyncio.to_thread(self._delete_files, [*links, compact])
+            self._moved(metas, done)
+            return []
+
+        async with self._lock:
+            # deleted meanwhile, their link goes
+            olds = [path for meta, path in zip(metas, links) if self._recordings.get(meta.rid) is not meta]
+            kept = [meta for meta in metas if self._recordings.get(meta.rid) is meta]
+            olds += [old for old in map(self._original_path, kept) if old not in links]
+            if not self.blobs.refs(hash):
+                olds.append(compact)
+            if kept:
+                # the blob goes unless another recording still reads it, its refs change with it
+                await asyncio.to_thread(self.blobs.compacted, hash, {meta.rid for meta in kept})
+            for meta in kept:
+                meta.sizeBytes = size
+                self._share(meta)
+            changed = [meta.model_copy() for meta in kept]
+        await asyncio.to_thread(self._delete_files, olds)
+        self._moved(metas, done)
+        return changed
+
+
+    def _link_compact(self, temp_path: str, compact: str, links: List[str]) -> int:
+        os.replace(temp_path, compact)
+        for path in links:
+            link(compact, path)
+        return os.path.getsize(compact)
+
+
+    def _move(self, rids: List[str]) -> asyncio.Event:
+        """Marks the files of rids as changing outside the lock, jobs wait for
+        _moved, see _settled. Called with the lock held."""
+        done = asyncio.Event()
+        for rid in rids:
+            self._moving[rid] = done
+        return done
+
+
+    def _moved(self, metas: List[P.RecMetadata], done: asyncio.Event):
+        for meta in metas:
+            self._moving.pop(meta.rid, None)
+        done.set()
+
+
+    async def _settled(self, rids: List[str]):
+        for rid in rids:
+            while done := self._moving.get(rid):
+                await done.wait()
+
+
+    def _rendering(self, hash: Optional[str]) -> bool:
+        # a recording of the audio is writing or linking its render
+        return any(
+            (meta := self._recordings.get(rid)) and meta.enhanced == P.RecStates.WORKING
+            for rid in self.blobs.refs(hash)
+        ) if hash else False
+
+
+    def _frees(self, path: str) -> int:
+        """Bytes removing path would free: none while another link to the file is left."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        return st.st_size if st.st_nlink == 1 else 0
+
+
+    def _unlink(self, path: str) -> int:
+        freed = self._frees(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return freed
+
+
+    def _unlink_renders(self, paths: List[str]) -> int:
+        # only the ones no recording links
+        return sum(self._unlink(path) for path in paths if self._frees(path))
+
+
+    async def drop_render(self, path: str) -> int:
+        """Removes an enhanced render no recording links, returns the bytes freed."""
+        hash = os.path.basename(path).split(".", 1)[0]
+        async with self._lock:
+            if self._rendering(hash) or hash in self._dropping:
+                return 0
+            self._dropping.add(hash)
+        try:
+            return await asyncio.to_thread(self._unlink_renders, [path])
+        finally:
+            self._dropping.discard(hash)
+
+
+    async def evict_enhanced(self, rid: str) -> Tuple[int, Optional[P.RecMetadata]]:
+        """Drops the enhanced file of rid, it can be enhanced again. Returns the
+        bytes freed and the changed meta."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.enhanced != P.RecStates.OK or rid in self._moving:
+                return 0, None
+            enhanced = self._enhanced_path(meta)
+            # its render too, once no other recording links it
+            hash = self.blobs.of(rid)
+            render = self.blobs.derived(rid, ".enhanced-")
+            if self._rendering(hash) or hash in self._dropping:
+                render = None
+            elif render:
+                self._dropping.add(hash)
+            meta.enhanced = P.RecStates.NA
+            self._share(meta)
+            changed = meta.model_copy()
+            done = self._move([rid])
+
+        try:
+            freed = await asyncio.to_thread(
+                lambda: self._unlink(enhanced) + self._unlink_renders(glob.glob(glob.escape(render) + "*") if render else [])
+            )
+        finally:
+            if render:
+                self._dropping.discard(hash)
+            self._moved([meta], done)
+        return freed, changed
+
+
+    async def evict_original(self, rid: str) -> Tuple[int, Optional[P.RecMetadata]]:
+        """Drops the audio of rid, original and enhanced. Its metadata and
+        transcript stay. Returns the bytes freed and the changed meta."""
+        async with self._lock:
+            meta = self._recordings.get(rid)
+            if not meta or meta.original != P.RecStates.OK or not self._idle(meta):
+                return 0, None
+            paths = [self._original_path(meta), self._enhanced_path(meta)]
+            hash = self.blobs.of(rid)
+            # the last recording of it, release() removes these. The refs and
+            # the blob's files change together
+            blob = hash and self.blobs.refs(hash) == {rid}
+            freed = await asyncio.to_thread(
+                lambda: sum(self._frees(path) for path in glob.glob(glob.escape(self.blobs.path(hash)) + "*")) if blob else 0
+            )
+            await asyncio.to_thread(self.blobs.release, rid)
+            meta.original = P.RecStates.NA
+            meta.enhanced = P.RecStates.NA
+            self._share(meta)
+            changed = meta.model_copy()
+            done = self._move([rid])
+
+        try:
+            freed += await asyncio.to_thread(lambda: sum(self._unlink(path) for path in paths))
+        finally:
+            self._moved([meta], done)
+        return freed, changed
+
+
+    def _delete_files(self, paths: List[str]):
+        for path in paths:
+            self._delete_file_safely(path)
 
 
     def _delete_file_safely(self, path: str):
@@ -297,13 +806,20 @@ class RecordingsHandler:
             files_to_remove = [
                 self._original_path(meta),
                 self._enhanced_path(meta),
-                self._transcript_path(meta)
+                self._transcript_path(meta),
+                os.path.join(self.regions_dir, f"{rid}.json"),
+                self._spool_path(meta)
             ]
 
             for path in files_to_remove:
                 self._delete_file_safely(path)
+            # its blob and what was derived from it go once no recording links them
+            self.blobs.release(rid)
 
             del self._recordings[rid]
+            self.used.pop(rid, None)
+            if self.shared:
+                self.shared.drop_recording(rid)
             
         log.info(f"Deleted all records and files for RID: {rid}")
         return True
@@ -319,6 +835,7 @@ class RecordingsHandler:
                 self._get_ext(new_name)
                 old_name = meta.recName
                 meta.recName = new_name
+                self._share(meta)
             
                 log.info(f"Renamed recording {rid}: '{old_name}' -> '{new_name}'")
                 return meta.model_copy()
@@ -371,6 +888,8 @@ class RecordingsHandler:
         meta = self._recordings.get(rid)
         if not meta:
             return None
+        if pathof != RecordingTypes.TRANSCRIPT:
+            self.touch(rid)
 
         if pathof == RecordingTypes.ORIGINAL:
             return self._original_path(meta)
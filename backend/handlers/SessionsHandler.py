@@ -1,16 +1,21 @@
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from fastapi import WebSocket
 import asyncio
 import backend.core.primitives as P
-from backend.utils.logging import log
+from backend.utils.logging import ws_log
 from backend.utils.utils import now_ms
+from backend.core.ClockSync import ClockFilter, DelayAggregate
+from backend.utils.metrics import TimedLock, BROADCAST
+from backend.utils.tracing import child_span
+from backend.core.SharedState import SharedState
 
 
 class Session:
-    __slots__ = ('meta', 'ws') 
+    __slots__ = ('meta', 'ws', 'clock') 
     def __init__(self, meta: P.SessionMetadata, ws: WebSocket):
         self.meta: P.SessionMetadata = meta
         self.ws: WebSocket = ws
+        self.clock: ClockFilter = ClockFilter()
 
 
 class SessionsHandler:
@@ -18,7 +23,9 @@ class SessionsHandler:
         self._active: Dict[str, Session] = {}
         self._staging: Dict[str, P.SessionMetadata] = {} # sessionId, meta
         self._ws_to_id: Dict[WebSocket, str] = {}
-        self._lock = asyncio.Lock()
+        self._delays: DelayAggregate = DelayAggregate()
+        self._lock = TimedLock("sessions")
+        self.shared: Optional[SharedState] = None # set when HTTP workers serve sessions
 
     async def updateMeta(self, new_meta: P.SessionMetadata) -> P.SessionMetadata | None:
         async with self._lock:
@@ -26,6 +33,8 @@ class SessionsHandler:
             if session:
                 update_data = new_meta.model_dump(exclude_unset=True)
                 session.meta = session.meta.model_copy(update=update_data)
+                if self.shared:
+                    self.shared.put_session(session.meta)
                 return session.meta
             return None
                 
@@ -35,6 +44,8 @@ class SessionsHandler:
             session = self._active.get(id)
             if session:
                 session.meta.name = name
+                if self.shared:
+                    self.shared.put_session(session.meta)
 
 
     async def getActiveCount(self) -> int:
@@ -83,6 +94,8 @@ class SessionsHandler:
 
             self._active[id] = Session(meta, session_ws)
             self._ws_to_id[session_ws] = id
+            if self.shared:
+                self.shared.put_session(meta)
             return meta
 
 
@@ -90,9 +103,12 @@ class SessionsHandler:
         ws = None
         async with self._lock:
             session = self._active.pop(id, None)
+            self._delays.remove(id)
             if session:
                 ws = session.ws
                 self._ws_to_id.pop(ws, None)
+                if self.shared:
+                    self.shared.drop_session(id)
             else:
                 self._staging.pop(id, None)
 
@@ -113,9 +129,10 @@ class SessionsHandler:
             return
 
         try:
-            await ws.send_json(payload.model_dump())
+            with child_span("ws.send_to_one", session=id, msgType=payload.msgType.value):
+                await ws.send_json(payload.model_dump())
             if payload.kind != P.WSKind.SYNC:
-                log.info(payload.model_dump())
+                ws_log.info("tx %s %s", id, payload)
         except Exception:
             await self.drop(id)
 
@@ -133,25 +150,78 @@ class SessionsHandler:
             except Exception:
                 dead.append(sid)
 
-        await asyncio.gather(*(send_one(sid, ws) for sid, ws in targets))
+        with BROADCAST.time():
+            await asyncio.gather(*(send_one(sid, ws) for sid, ws in targets))
 
         if dead:
             await asyncio.gather(*(self.drop(sid) for sid in dead))
 
-        log.info(f'BROADCASTING {payload}')
+        ws_log.info("broadcast %s", payload)
+
+    
+    # same as broadcast, but every session also gets the trigger time in its own clock
+    async def broadcast_timed(self, data: P.WSPayload, triggerTime: int) -> List[str]:
+        async with self._lock:
+            targets = [(sid, s.ws, s.clock.theta) for sid, s in self._active.items()]
+
+        payload = data.model_dump()
+        body = payload["body"]
+        dead = []
+
+        async def send_one(sid, ws, theta):
+            local = int(triggerTime - theta) if theta is not None else None
+            try:
+                await ws.send_json({**payload, "body": {**body, "localTriggerTime": local}})
+            except Exception:
+                dead.append(sid)
+
+        with BROADCAST.time():
+            await asyncio.gather(*(send_one(*t) for t in targets))
+
+        if dead:
+            await asyncio.gather(*(self.drop(sid) for sid in dead))
+
+        ws_log.info("broadcast %s", payload)
+        return [sid for sid, _, _ in targets if sid not in dead]
+
+
+    # (sessionId, lastSync, drift, jitter) for the sync scheduler
+    async def clock_states(self) -> List[Tuple[str, Optional[int], float, float]]:
+        async with self._lock:
+            return [
+                (sid, s.clock.updatedAt, s.clock.drift, s.clock.jitter)
+                for sid, s in self._active.items()
+            ]
+
+
+    async def get_theta(self, id: str) -> Optional[float]:
+        async with self._lock:
+            session = self._active.get(id)
+            return session.clock.theta if session else None
 
     
     async def update_sync(self,id: str, report: P.ClockSyncReport) -> P.SessionMetadata | None:
         async with self._lock:
             session = self._active.get(id)
             if session:
-                session.meta.theta = report.theta
+                at = now_ms()
+                session.clock.add(report.rtt, report.theta, at)
+                self._delays.update(id, session.clock.bound, at)
+                session.meta.theta = session.clock.theta
                 session.meta.lastRTT = report.rtt
-                session.meta.lastSync = now_ms()
+                session.meta.lastSync = at
+                if self.shared:
+                    self.shared.put_session(session.meta)
                 return session.meta
             return None
 
 
+    # smallest lead time that lets a broadcast reach every session before it fires
+    async def trigger_delay(self) -> int:
+        async with self._lock:
+            return self._delays.delay(len(self._active))
+
+
     def get_id(self, ws: WebSocket) -> Optional[str]:
         return self._ws_to_id.get(ws)
         
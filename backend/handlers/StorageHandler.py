@@ -0,0 +1,299 @@
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import os
+import time
+
+import psutil
+from pydub import AudioSegment
+
+import backend.core.primitives as P
+from backend.core.BlobStore import COMPACT
+from backend.core.Services import Services
+from backend.handlers.RecordingsHandler import RecordingsHandler
+from backend.utils.logging import log
+from backend.utils.metrics import COMPACTED_BYTES, EVICTED_BYTES, STORAGE_BYTES
+from backend.utils.utils import parse_size
+
+
+# Every PASS_SECONDS the storage manager measures storage/ per tier (below).
+# With VOCALINK_STORAGE_QUOTA set (bytes, or 500M, 20G...) it also keeps it
+# there, each pass:
+# 1. over the quota, it frees down to LOW_WATER of it: the transcode cache
+#    (backend/core/Transcodes.py) first, least recently served first, then
+#    renders no recording links, then the enhanced files of the least recently
+#    used recordings, which can be enhanced again
+# 2. blobs none of whose recordings was used for VOCALINK_COLD_HOURS (24) are
+#    transcoded to Opus (SUPPORTED_FORMATS[".ogg"]) by an ffmpeg at idle I/O
+#    and CPU priority, one at a time, and replace the original
+# 3. still over, the least recently used recordings lose their audio. Their
+#    metadata and transcript stay, original and enhanced go to NA
+# A recording counts as used when its audio is downloaded or a job reads it.
+# Nothing with a job running is touched. The walk and the deletes run in
+# threads, the transcode in its own process.
+TIERS = ("originals", "compact", "enhanced", "transcripts", "regions", "transcodes", "incoming", "other")
+DIR_TIERS = {
+    "original": "originals",
+    "enhanced": "enhanced",
+    "transcripts": "transcripts",
+    "regions": "regions",
+    "transcodes": "transcodes",
+    "spool": "incoming",
+    "live": "incoming",
+}
+PASS_SECONDS = 60
+LOW_WATER = 0.9 # of the quota, where a pass over it stops freeing
+
+
+def _setting(name: str, default: str, parse):
+    text = os.environ.get(name, default)
+    try:
+        return parse(text)
+    except ValueError:
+        log.warning(f"Bad {name}: {text!r}, using {default or 'none'}")
+        return parse(default)
+
+
+QUOTA = _setting("VOCALINK_STORAGE_QUOTA", "", parse_size)
+COLD_SECONDS = _setting("VOCALINK_COLD_HOURS", "24", float) * 3600
+
+
+def _tier(root: str, path: str) -> str:
+    top = os.path.relpath(path, root).split(os.sep)[0]
+    if top != "blobs":
+        return DIR_TIERS.get(top, "other")
+    name = os.path.basename(path)
+    if ".enhanced-" in name:
+        return "enhanced"
+    if name.endswith(".transcript.json"):
+        return "transcripts"
+    if name.endswith(".regions.json"):
+        return "regions"
+    if name.endswith(COMPACT):
+        return "compact"
+    return "originals" if "." not in name else "other"
+
+
+def _scan(root: str) -> Tuple[Dict[str, int], List[Tuple[float, str]], List[Tuple[float, str]]]:
+    """Bytes per tier, each file counted once however many links it has, the
+    renders no recording links and the done transcodes, (mtime, path)."""
+    usage = dict.fromkeys(TIERS, 0)
+    stale: List[Tuple[float, str]] = []
+    cached: List[Tuple[float, str]] = []
+    seen: Set[Tuple[int, int]] = set()
+    blobs = os.path.join(root, "blobs")
+    # blobs first, the links elsewhere then count in the blob's tier
+    for top in [blobs, root]:
+        for dir, dirs, files in os.walk(top):
+            if top == root and dir == root and "blobs" in dirs:
+                dirs.remove("blobs")
+            for name in files:
+                path = os.path.join(dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+                tier = _tier(root, path)
+                usage[tier] += st.st_size
+                if top == blobs and tier == "enhanced" and st.st_nlink == 1:
+                    stale.append((st.st_mtime, path))
+                elif tier == "transcodes" and not name.endswith(".part"):
+                    cached.append((st.st_mtime, path))
+    return usage, stale, cached
+
+
+def _lower_priority(pid: int):
+    """Idle I/O class and lowest CPU priority, recording and jobs go first."""
+    try:
+        proc = psutil.Process(pid)
+        if psutil.WINDOWS:
+            proc.nice(psutil.IDLE_PRIORITY_CLASS)
+            proc.ionice(psutil.IOPRIO_VERYLOW)
+        else:
+            proc.nice(19)
+            if psutil.LINUX:
+                proc.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (psutil.Error, OSError) as e:
+        log.warning(f"Could not lower the priority of transcode {pid}: {e}")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _drop(path: str) -> int:
+    """Removes path, returns the bytes that freed."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+
+class StorageHandler:
+    """Measures storage/ and keeps it under the quota, see above."""
+
+    def __init__(self, recordings: RecordingsHandler, services: Services):
+        self._recordings: RecordingsHandler = recordings
+        self._services: Services = services
+        self._task: Optional[asyncio.Task] = None
+        self._kept: Set[str] = set() # blobs whose transcode came out no smaller
+        self.usage: Dict[str, int] = dict.fromkeys(TIERS, 0)
+        self.measured: Optional[float] = None
+        self.evicted: Dict[str, int] = {"enhanced": 0, "originals": 0} # recordings, since start
+        self.compacted: int = 0 # blobs, since start
+
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    @property
+    def total(self) -> int:
+        return sum(self.usage.values())
+
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_pass()
+            except Exception as e:
+                log.error(f"Storage pass failed: {e!r}")
+            await asyncio.sleep(PASS_SECONDS)
+
+
+    async def _measure(self) -> Tuple[List[Tuple[float, str]], List[Tuple[float, str]]]:
+        self.usage, stale, cached = await asyncio.to_thread(_scan, self._recordings.root)
+        self.measured = time.time()
+        for tier, size in self.usage.items():
+            STORAGE_BYTES.set(size, tier)
+        return stale, cached
+
+
+    async def run_pass(self):
+        stale, cached = await self._measure()
+        if QUOTA is None:
+            return
+        excess = self.total - int(QUOTA * LOW_WATER) if self.total > QUOTA else 0
+        changed = excess > 0
+
+        for _, path in sorted(cached):
+            if excess <= 0:
+                break
+            freed = await asyncio.to_thread(_drop, path)
+            EVICTED_BYTES.inc(freed, "transcodes")
+            excess -= freed
+        for _, path in sorted(stale):
+            if excess <= 0:
+                break
+            freed = await self._recordings.drop_render(path)
+            EVICTED_BYTES.inc(freed, "enhanced")
+            excess -= freed
+        if excess > 0:
+            excess -= await self._evict("enhanced", excess)
+
+        for hash, path in await self._recordings.cold_blobs(time.time() - COLD_SECONDS):
+            if hash not in self._kept:
+                saved = await self._compact(hash, path)
+                excess -= saved
+                changed = changed or saved > 0
+
+        if excess > 0:
+            excess -= await self._evict("originals", excess)
+            if excess > 0:
+                log.warning(f"[STORAGE] {excess} bytes over the quota with nothing left to free")
+        if changed:
+            await self._measure()
+
+
+    async def _evict(self, tier: str, excess: int) -> int:
+        """Frees tier of the least recently used recordings until excess bytes are."""
+        evict = self._recordings.evict_enhanced if tier == "enhanced" else self._recordings.evict_original
+        total = 0
+        for meta in await self._recordings.by_last_use():
+            if total >= excess:
+                break
+            freed, changed = await evict(meta.rid)
+            if not changed:
+                continue
+            total += freed
+            self.evicted[tier] += 1
+            EVICTED_BYTES.inc(freed, tier)
+            log.info(f"[STORAGE] evicted the {tier} of {meta.rid}, {freed} bytes")
+            await self._services.notify_amend(changed)
+        return total
+
+
+    async def _compact(self, hash: str, path: str) -> int:
+        """Transcodes blob hash, returns the bytes that saved."""
+        temp = f"{self._recordings.blobs.path(hash, COMPACT)}.tmp"
+        try:
+            size = os.path.getsize(path)
+            transcoded = await self._transcode(path, temp) and os.path.getsize(temp)
+        except OSError as e:
+            log.error(f"[STORAGE] transcoding {path} failed: {e}")
+            transcoded = 0
+        if not transcoded or transcoded >= size:
+            # lossy already or failing, not worth another try
+            self._kept.add(hash)
+            await asyncio.to_thread(_remove, temp)
+            return 0
+
+        metas = await self._recordings.compact(hash, temp)
+        if not metas:
+            return 0
+        self.compacted += 1
+        COMPACTED_BYTES.inc(size - transcoded)
+        log.info(f"[STORAGE] transcoded cold blob {hash}, {size} -> {transcoded} bytes")
+        for meta in metas:
+            await self._services.notify_amend(meta)
+        return size - transcoded
+
+
+    async def _transcode(self, src: str, dst: str) -> bool:
+        config = P.SUPPORTED_FORMATS[COMPACT]
+        proc = await asyncio.create_subprocess_exec(
+            AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+            "-i", src, "-vn", "-c:a", config["codec"], "-b:a", config["bitrate"], "-f", config["format"], dst,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _lower_priority(proc.pid)
+        try:
+            _, err = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        if proc.returncode != 0:
+            log.error(f"[STORAGE] ffmpeg failed on {src}: {err.decode(errors='replace').strip()}")
+        return proc.returncode == 0
+
+
+    def report(self) -> Dict:
+        return {
+            "quota": QUOTA,
+            "lowWater": int(QUOTA * LOW_WATER) if QUOTA else None,
+            "coldHours": COLD_SECONDS / 3600,
+            "total": self.total,
+            "tiers": self.usage,
+            "measuredAgo": round(time.time() - self.measured, 1) if self.measured else None,
+            "evicted": self.evicted,
+            "compacted": self.compacted,
+        }
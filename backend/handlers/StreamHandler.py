@@ -0,0 +1,329 @@
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket
+import asyncio
+import os
+import struct
+import time
+import uuid
+
+import backend.core.primitives as P
+from backend.core.BlobStore import new_digest
+from backend.handlers.RecordingsHandler import RecordingsHandler, ALLOWED_EXTENSIONS
+from backend.handlers.SessionsHandler import SessionsHandler
+from backend.core.Services import Services
+from backend.core.LiveTranscriber import LiveTranscriber
+from backend.utils.logging import log
+from backend.utils.metrics import STREAMS, STREAM_BYTES, STREAM_CHUNKS, STREAM_TAIL
+import backend.utils.tracing as tracing
+
+
+# binary streaming channel for a recording in progress, all integers are big-endian
+# /ws/stream?id=<sessionId>&recName=<name> stages a new recording,
+# /ws/stream?id=<sessionId>&rid=<rid> resumes its stream after a reconnect
+# OPENED server -> session : [u8 type][16 bytes rid][u32 next], rid as uuid bytes
+# CHUNK  session -> server : [u8 type][u32 seq][payload], consecutive pieces of the encoded file
+# ACK    server -> session : [u8 type][u32 next], every chunk below next is on disk
+# END    session -> server : [u8 type][u32 count][u32 duration ms], sent after stop
+# DONE   server -> session : [u8 type][u32 count], the original is stored, no REC_STAGE or upload follows
+#
+# Chunks are appended in seq order, so the recorder must write a container that
+# can be appended to (ogg, adts, fragmented mp4, wav). A session may run WINDOW
+# chunks ahead of the last ACK, anything further is dropped and sent again
+# after the ACK says where the spool stands. Duplicates are dropped too.
+# A stream whose phone stays away PAUSED_SECONDS is given up: its spool and
+# live transcription go and its original is NA.
+FRAME_OPENED = 0x01
+FRAME_CHUNK = 0x02
+FRAME_ACK = 0x03
+FRAME_END = 0x04
+FRAME_DONE = 0x05
+
+OPENED = struct.Struct("!B16sI")
+CHUNK = struct.Struct("!BI") # header only, the payload follows
+ACK = struct.Struct("!BI")
+END = struct.Struct("!BII")
+DONE = struct.Struct("!BI")
+
+WINDOW = 64 # chunks
+MAX_CHUNK = 256 * 1024
+QUEUE_CHUNKS = 16 # in order chunks waiting for the disk, per stream
+WRITERS = 4 # spool writes in flight across all streams, leaves threads to the media jobs
+PAUSED_SECONDS = 10 * 60
+
+
+def _append(f: BinaryIO, chunks: List[bytes], digest):
+    data = b"".join(chunks)
+    f.write(data)
+    f.flush()
+    digest.update(data) # the blob's hash, so the spool is never read back
+
+
+class Stream:
+    __slots__ = ('rid', 'sessionId', 'path', 'file', 'digest', 'next', 'written', 'pending', 'queue', 'ws', 'sending', 'attached', 'failed', 'paused')
+
+    def __init__(self, rid: str, sessionId: str, path: str):
+        self.rid: str = rid
+        self.sessionId: str = sessionId
+        self.path: str = path
+        self.file: Optional[BinaryIO] = None
+        self.digest = new_digest() # of everything appended
+        self.next: int = 0 # first seq not accepted yet
+        self.written: int = 0 # first seq not on disk yet
+        self.pending: Dict[int, bytes] = {} # seq, out of order chunks
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+        self.ws: Optional[WebSocket] = None
+        self.sending = asyncio.Lock() # ACKs come from the writer, the rest from the reader
+        self.attached = asyncio.Lock() # held by the connection serving this stream
+        self.failed: bool = False
+        self.paused: float = 0.0 # when its connection went, 0 while one serves it
+
+
+class StreamHandler:
+    """Spools recordings while they are recorded, so after stop only the
+    tail is missing and the original is stored within a round trip.
+
+    Backpressure is layered: a stream's reader stops reading once QUEUE_CHUNKS
+    chunks wait for the disk, which fills the socket and stalls the phone, and
+    at most WRITERS spool writes run at once however many phones stream."""
+
+    def __init__(
+        self,
+        recordings: RecordingsHandler,
+        sessions: SessionsHandler,
+        services: Services,
+        live: LiveTranscriber
+    ):
+        self._recordings: RecordingsHandler = recordings
+        self._sessions: SessionsHandler = sessions
+        self._services: Services = services
+        self._live: LiveTranscriber = live
+        self._streams: Dict[str, Stream] = {} # rid, kept across reconnects until DONE
+        self._writers = asyncio.Semaphore(WRITERS)
+        self._tasks: Set[asyncio.Task] = set()
+
+
+    async def _send(self, stream: Stream, frame: bytes):
+        # a dead socket shows up on the reader's side, senders don't care
+        async with stream.sending:
+            try:
+                if stream.ws:
+                    await stream.ws.send_bytes(frame)
+            except Exception:
+                pass
+
+
+    async def _open(self, id: str, recName: str, rid: Optional[str]) -> Optional[Stream]:
+        session = await self._sessions.getMetaFromActive(id)
+        if not session:
+            return None
+
+        if rid:
+            stream = self._streams.get(rid)
+            if not stream or stream.sessionId != id:
+                return None
+        else:
+            if os.path.splitext(recName)[1] not in ALLOWED_EXTENSIONS:
+                return None
+            meta = await self._recordings.stage(
+                P.RecStageInfo(sessionId=id, recName=recName, duration=0, sizeBytes=0), session
+            )
+            path = await self._recordings.spool(meta.rid) if meta else None
+            if not path:
+                return None
+            stream = self._streams[meta.rid] = Stream(meta.rid, id, path)
+            await self._live.start(meta)
+            await self._services.notify_staged(meta)
+
+        # the spool is gone once the recording was deleted or uploaded the old way
+        if not await self._recordings.spool(stream.rid):
+            self._streams.pop(stream.rid, None)
+            await self._live.cancel(stream.rid)
+            return None
+        return stream
+
+
+    async def _write(self, stream: Stream):
+        while True:
+            chunks = [await stream.queue.get()]
+            while not stream.queue.empty():
+                chunks.append(stream.queue.get_nowait())
+            try:
+                if not stream.failed:
+                    async with self._writers:
+                        await asyncio.to_thread(_append, stream.file, chunks, stream.digest)
+                    stream.written += len(chunks)
+                    STREAM_BYTES.inc(sum(len(c) for c in chunks))
+                    await self._live.feed(stream.rid, chunks)
+            except Exception as e:
+                # the spool may hold part of a write now, it can't be resumed.
+                # Anything else too: a dead writer would leave _serve waiting on the queue
+                log.error(f"Spooling the stream of {stream.rid} failed: {e!r}")
+                stream.failed = True
+                if stream.ws:
+                    self._spawn(stream.ws.close(code=1011))
+            finally:
+                for _ in chunks:
+                    stream.queue.task_done()
+            if not stream.failed:
+                await self._send(stream, ACK.pack(FRAME_ACK, stream.written))
+
+
+    async def _accept(self, stream: Stream, seq: int, payload: bytes):
+        if seq < stream.next or seq in stream.pending:
+            STREAM_CHUNKS.inc(1, "duplicate")
+            await self._send(stream, ACK.pack(FRAME_ACK, stream.written))
+            return
+        if seq >= stream.next + WINDOW:
+            STREAM_CHUNKS.inc(1, "dropped")
+            await self._send(stream, ACK.pack(FRAME_ACK, stream.written))
+            return
+        if seq > stream.next:
+            STREAM_CHUNKS.inc(1, "reordered")
+            stream.pending[seq] = payload
+            return
+
+        STREAM_CHUNKS.inc(1, "appended")
+        await stream.queue.put(payload) # waits while the disk is behind
+        stream.next += 1
+        while stream.next in stream.pending:
+            await stream.queue.put(stream.pending.pop(stream.next))
+            stream.next += 1
+
+
+    async def _finish(self, stream: Stream, duration: float) -> Optional[P.RecMetadata]:
+        started = time.perf_counter()
+        # joins the trace of the stop that ended this recording, like REC_STAGE does
+        with tracing.resume(f"session:{stream.sessionId}", release=True), \
+             tracing.span("rec.stream_end", rid=stream.rid, chunks=stream.next):
+            tracing.bind(f"rec:{stream.rid}")
+            await stream.queue.join()
+            if stream.failed:
+                return None
+            await asyncio.to_thread(stream.file.close)
+            meta = await self._recordings.adopt(stream.rid, duration, stream.digest.hexdigest())
+        STREAM_TAIL.observe(time.perf_counter() - started)
+        return meta
+
+
+    async def serve(self, ws: WebSocket, id: str, recName: str = "", rid: Optional[str] = None):
+        stream = await self._open(id, recName, rid)
+        if not stream:
+            await ws.close(code=1008)
+            return
+
+        # a phone that reconnects may beat the server to noticing its old socket died
+        old = stream.ws
+        if old:
+            try:
+                await old.close()
+            except Exception:
+                pass
+        async with stream.attached:
+            if self._streams.get(stream.rid) is not stream:
+                await ws.close(code=1008)
+                return
+            await self._serve(stream, ws)
+
+
+    async def _serve(self, stream: Stream, ws: WebSocket):
+        stream.ws = ws
+        stream.paused = 0.0
+        stream.next = stream.written # whatever wasn't on disk is sent again
+        stream.file = await asyncio.to_thread(open, stream.path, "ab")
+        writer = asyncio.create_task(self._write(stream))
+        STREAMS.inc(1)
+
+        meta: Optional[P.RecMetadata] = None
+        end: Optional[Tuple[int, float]] = None # count, duration
+        finished = False
+        try:
+            await self._send(stream, OPENED.pack(FRAME_OPENED, uuid.UUID(stream.rid).bytes, stream.written))
+            while not stream.failed:
+                msg = await ws.receive()
+                data = msg.get("bytes")
+                if data is None:
+                    if msg["type"] == "websocket.disconnect":
+                        break
+                    continue
+
+                if len(data) > CHUNK.size and data[0] == FRAME_CHUNK:
+                    if len(data) - CHUNK.size > MAX_CHUNK:
+                        await ws.close(code=1009)
+                        break
+                    _, seq = CHUNK.unpack_from(data)
+                    await self._accept(stream, seq, data[CHUNK.size:])
+
+                elif len(data) == END.size and data[0] == FRAME_END:
+                    _, count, duration_ms = END.unpack(data)
+                    end = (count, duration_ms / 1000)
+
+                if end and stream.next >= end[0]:
+                    meta = await self._finish(stream, end[1])
+                    finished = True
+                    break
+
+        except Exception as e:
+            log.warning(f"Stream of [{stream.rid}] closed: {e}")
+        finally:
+            # in flight writes land before anyone resumes from stream.written
+            stream.pending.clear()
+            await stream.queue.join()
+            writer.cancel()
+            stream.ws = None
+            STREAMS.dec(1)
+
+        if not stream.file.closed:
+            await asyncio.to_thread(stream.file.close)
+        if finished or stream.failed:
+            self._streams.pop(stream.rid, None)
+        if not finished:
+            if stream.failed:
+                await self._live.cancel(stream.rid)
+                await asyncio.to_thread(self._discard, stream.path)
+            else:
+                # the phone may come back with &rid=
+                stream.paused = time.time()
+                self._spawn(self._expire(stream, stream.paused))
+            return
+
+        if meta is None:
+            # deleted or uploaded the old way meanwhile, or the spool broke
+            await self._live.cancel(stream.rid)
+            await asyncio.to_thread(self._discard, stream.path)
+            return
+        if meta.original == P.RecStates.OK:
+            try:
+                await ws.send_bytes(DONE.pack(FRAME_DONE, end[0]))
+            except Exception:
+                pass
+            self._spawn(self._services.streamed(meta))
+            self._spawn(self._live.finish(meta))
+        else:
+            await self._live.cancel(stream.rid)
+            await self._services.notify_amend(meta)
+
+
+    async def _expire(self, stream: Stream, paused: float):
+        await asyncio.sleep(PAUSED_SECONDS)
+        # resumed meanwhile, or done with
+        if stream.paused != paused or stream.attached.locked() or self._streams.get(stream.rid) is not stream:
+            return
+        self._streams.pop(stream.rid)
+        log.warning(f"Stream of [{stream.rid}] wasn't resumed in {PAUSED_SECONDS}s, giving it up")
+        await self._live.cancel(stream.rid)
+        await asyncio.to_thread(self._discard, stream.path)
+        await self._recordings.set_original(stream.rid, P.RecStates.NA)
+        await self._services.notify_amend(await self._recordings.get_meta(stream.rid))
+
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
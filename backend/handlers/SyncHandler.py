@@ -0,0 +1,91 @@
+from typing import Dict, Optional, Callable, Awaitable, Set
+from fastapi import WebSocket
+import asyncio
+import struct
+
+import backend.core.primitives as P
+from backend.utils.logging import sync_log
+from backend.utils.utils import now_ms
+
+
+# binary sync channel (/ws/sync?id=<sessionId>), all integers are big-endian ms
+# TIK    session -> server : [u8 type][i64 t1]
+# TOK    server -> session : [u8 type][i64 t1][i64 t2][i64 t3]
+# REPORT session -> server : [u8 type][f64 theta][f64 rtt]
+# REQUEST server -> session : [u8 type][u8 rounds], asks for a sync round now
+FRAME_TIK = 0x01
+FRAME_TOK = 0x02
+FRAME_REPORT = 0x03
+FRAME_REQUEST = 0x04
+
+TIK = struct.Struct("!Bq")
+TOK = struct.Struct("!Bqqq")
+REPORT = struct.Struct("!Bdd")
+REQUEST = struct.Struct("!BB")
+
+ReportCallback = Callable[[str, P.ClockSyncReport], Awaitable[None]]
+
+
+class SyncHandler:
+    def __init__(self, on_report: ReportCallback):
+        self._on_report: ReportCallback = on_report
+        self._channels: Dict[str, WebSocket] = {} # sessionId, sync ws
+        self._tasks: Set[asyncio.Task] = set()
+
+
+    def channel(self, id: str) -> Optional[WebSocket]:
+        return self._channels.get(id)
+
+
+    # returns False when the session has no sync channel open
+    async def request(self, id: str, rounds: int) -> bool:
+        ws = self._channels.get(id)
+        if not ws:
+            return False
+        try:
+            await ws.send_bytes(REQUEST.pack(FRAME_REQUEST, rounds))
+            return True
+        except Exception:
+            return False
+
+
+    async def drop(self, id: str):
+        ws = self._channels.pop(id, None)
+        if ws:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+
+
+    async def serve(self, id: str, ws: WebSocket):
+        # nothing on the TIK path may await a lock, validate a model or log,
+        # otherwise t2/t3 absorb our own processing time
+        self._channels[id] = ws
+        try:
+            while True:
+                msg = await ws.receive()
+                t2 = now_ms()
+                data = msg.get("bytes")
+                if data is None:
+                    if msg["type"] == "websocket.disconnect":
+                        break
+                    continue
+
+                if len(data) == TIK.size and data[0] == FRAME_TIK:
+                    _, t1 = TIK.unpack(data)
+                    await ws.send_bytes(TOK.pack(FRAME_TOK, t1, t2, now_ms()))
+
+                elif len(data) == REPORT.size and data[0] == FRAME_REPORT:
+                    _, theta, rtt = REPORT.unpack(data)
+                    task = asyncio.create_task(
+                        self._on_report(id, P.ClockSyncReport(theta=theta, rtt=rtt))
+                    )
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+        except Exception as e:
+            sync_log.warning(f"Sync channel of [{id}] closed: {e}")
+        finally:
+            if self._channels.get(id) is ws:
+                del self._channels[id]
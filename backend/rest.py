@@ -0,0 +1,278 @@
+"""HTTP workers, serve recording downloads, uploads and listings next to the server.
+
+    python -m uvicorn backend.rest:api --port 6212 --workers 4
+
+app.py starts them with --http-workers=N and the server then mirrors its
+recordings and sessions into storage/state.db, which these read. The server
+keeps the WebSockets and stays the only process that changes state, uploads
+are handed to it over the channel described in backend/handlers/HttpWorkersHandler.py.
+Run it from the repo root like the server.
+"""
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header, Query, Response, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+import backend.core.primitives as P
+from backend.core.SharedState import SharedState
+from backend.core.BlobStore import new_digest
+from backend.core.Transcodes import TranscodeCache, FORMAT_QUERY, BITRATE_QUERY
+from backend.core.Clips import clip_response, START_QUERY, END_QUERY
+from backend.core.Exports import Export
+from backend.utils.logging import log
+
+
+STATE_PATH = os.path.join("storage", "state.db")
+COPY_BYTES = 1024 * 1024
+
+
+class Channel:
+    """This worker's connection to the server, see HttpWorkersHandler."""
+
+    def __init__(self, port: int = P.CHANNEL_PORT):
+        self.port: int = port
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connecting = asyncio.Lock()
+
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connecting:
+            if self._writer and not self._writer.is_closing():
+                return self._writer
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(json.dumps({
+                "type": "hello",
+                "pid": os.getpid(),
+                "key": os.environ.get("VOCALINK_MEDIA_KEY", "")
+            }).encode() + b"\n")
+            await writer.drain()
+            self._writer = writer
+            self._reader = asyncio.create_task(self._read(reader))
+            return writer
+
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                msg = json.loads(line)
+                future = self._pending.pop(msg["id"], None)
+                if future and not future.done():
+                    future.set_result(msg["ok"])
+        finally:
+            # the server went away, whatever it didn't answer failed
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("server channel closed"))
+            self._pending.clear()
+            if self._writer:
+                self._writer.close()
+
+
+    async def tell(self, msg: Dict):
+        """Sends msg without waiting for an answer, the server gives none."""
+        writer = await self._connect()
+        writer.write(json.dumps(msg).encode() + b"\n")
+        await writer.drain()
+
+
+    async def send(self, msg: Dict) -> bool:
+        writer = await self._connect()
+        msg["id"] = next(self._ids)
+        future = self._pending[msg["id"]] = asyncio.get_running_loop().create_future()
+        writer.write(json.dumps(msg).encode() + b"\n")
+        await writer.drain()
+        return await future
+
+
+state: Optional[SharedState] = None
+channel: Optional[Channel] = None
+transcodes: Optional[TranscodeCache] = None
+
+
+def get_state() -> SharedState:
+    global state
+    if state is None:
+        try:
+            state = SharedState(STATE_PATH)
+        except sqlite3.OperationalError:
+            # the server creates it on start, without --http-workers it never does
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No shared state")
+    return state
+
+
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    global channel, transcodes
+    channel = Channel()
+    transcodes = TranscodeCache()
+    log.info(f"HTTP worker {os.getpid()} serving recordings from {STATE_PATH}")
+    yield
+    if state:
+        state.close()
+
+
+api = FastAPI(lifespan=lifespan)
+api.add_middleware(
+    CORSMiddleware,  # ty:ignore[invalid-argument-type]
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def _copy(file, path: str) -> Tuple[int, str]:
+    """Writes the upload to path, returns its size and sha256."""
+    digest = new_digest()
+    size = 0
+    with open(path, "wb") as buffer:
+        while chunk := file.read(COPY_BYTES):
+            buffer.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@api.get("/sessions", response_model=None)
+async def list_sessions():
+    return Response(get_state().sessions_json(), media_type="application/json")
+
+
+@api.get("/recordings", response_model=None)
+async def get_all_recordings():
+    return Response(get_state().recordings_json(), media_type="application/json")
+
+
+async def _path(rid: str, kind: str) -> str:
+    found = get_state().recording(rid)
+    if not found:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+    meta, paths = found
+    if not paths[kind] or getattr(meta, kind) != P.RecStates.OK:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+    if kind != "transcript":
+        try:
+            await channel.tell({"type": "used", "rid": rid})
+        except (OSError, ConnectionError) as e:
+            log.warning(f"Could not report the download of {rid}: {e}")
+    return paths[kind]
+
+
+async def _download(rid: str, kind: str, format: Optional[str] = None, bitrate: Optional[int] = None):
+    path = await _path(rid, kind)
+    if kind == "transcript":
+        return FileResponse(
+            path=path,
+            media_type="application/json",
+            filename=os.path.basename(path)
+        )
+    return await transcodes.response(path, rid, format, bitrate)
+
+
+@api.get("/recordings/{rid}/original")
+async def get_recording(rid: str, format: Optional[str] = FORMAT_QUERY, bitrate: Optional[int] = BITRATE_QUERY):
+    return await _download(rid, "original", format, bitrate)
+
+
+@api.get("/recordings/{rid}/enhanced")
+async def get_enhanced_recording(rid: str, format: Optional[str] = FORMAT_QUERY, bitrate: Optional[int] = BITRATE_QUERY):
+    return await _download(rid, "enhanced", format, bitrate)
+
+
+@api.get("/recordings/{rid}/clip")
+async def get_clip(rid: str, start: float = START_QUERY, end: float = END_QUERY, enhanced: bool = False):
+    return await clip_response(await _path(rid, "enhanced" if enhanced else "original"), rid, start, end)
+
+
+@api.get("/recordings/{rid}/transcript")
+async def get_transcript_json(rid: str):
+    return await _download(rid, "transcript")
+
+
+async def _export(name: str, found: List[Tuple[P.RecMetadata, Dict[str, Optional[str]]]], range: Optional[str], if_range: Optional[str]):
+    if not found:
+        raise HTTPException(status_code=404, detail="No recordings to export")
+    export = Export(name)
+    for meta, paths in found:
+        try:
+            await channel.tell({"type": "used", "rid": meta.rid})
+        except (OSError, ConnectionError) as e:
+            log.warning(f"Could not report the export of {meta.rid}: {e}")
+        export.add(meta, paths)
+    await export.plan()
+    return export.response(range, if_range)
+
+
+@api.get("/export")
+async def export_session(
+    sessionId: str = Query(...),
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    return await _export(sessionId, get_state().session_recordings(sessionId), range, if_range)
+
+
+@api.post("/export")
+async def export_recordings(
+    req: P.ExportRequest,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    found = [get_state().recording(rid) for rid in req.rids]
+    if None in found:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+    return await _export("recordings", found, range, if_range)
+
+
+@api.post("/recordings/{rid}")
+async def save_recording(rid: str, file: UploadFile = File(...)):
+    found = get_state().recording(rid)
+    if not found:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+    meta, paths = found
+    if meta.original != P.RecStates.WORKING:
+        raise HTTPException(status_code=500, detail="Audio storage failed")
+
+    # next to the original so the server can move it in place, an unsupported
+    # extension leaves no path and the server marks the recording failed
+    temp_path = f"{paths['original']}.{os.getpid()}.tmp" if paths["original"] else ""
+    start = time.time_ns()
+    try:
+        size, hash = await asyncio.to_thread(_copy, file.file, temp_path) if temp_path else (0, "")
+        stored = await channel.send({
+            "type": "uploaded",
+            "rid": rid,
+            "path": temp_path,
+            "size": size,
+            "sha256": hash,
+            "start": start,
+            "end": time.time_ns()
+        })
+    except (OSError, ConnectionError) as e:
+        log.error(f"Upload of {rid} failed: {e}")
+        stored = False
+    finally:
+        await file.close()
+
+    if not stored:
+        if temp_path:
+            await asyncio.to_thread(_remove, temp_path)
+        raise HTTPException(status_code=500, detail="Audio storage failed")
+    return {"status": "ok", "rid": rid}
@@ -1,24 +1,38 @@
-from fastapi import FastAPI, WebSocket, HTTPException, BackgroundTasks, Body
-from fastapi import  UploadFile, File, Response, status, Query
+from fastapi import FastAPI, WebSocket, HTTPException, BackgroundTasks, Body, Request
+from fastapi import  UploadFile, File, Form, Response, status, Query
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.responses import PlainTextResponse
+from fastapi import Header
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
 from pydantic import ValidationError
-from typing import List
+from typing import List, Optional
 import json
 import uuid
+import secrets
+import asyncio
 import qrcode
 import io
 import os
+import shutil
 
-from backend.handlers.AppState import AppState, send_error
+from backend.handlers.AppState import AppState, ACTION_MAP, send_error
+from backend.handlers.MediaHandler import MediaJobError
 import backend.core.primitives as P
-from backend.utils.logging import log
+from backend.utils.logging import log, session_log
+from backend.utils.utils import now_ms
 from backend.handlers.RecordingsHandler import RecordingTypes
+from backend.core.Transcodes import FORMAT_QUERY, BITRATE_QUERY
+from backend.core.Clips import clip_response, START_QUERY, END_QUERY
+from backend.core.Exports import Export
 import backend.utils.cypher as cypher
+import backend.utils.profiler as profiler
+import backend.utils.tracing as tracing
+import backend.utils.capture as capture
+from backend.utils.metrics import REGISTRY, WS_HANDLER
 
 
 app = AppState() # source of truth
@@ -26,7 +40,9 @@ app = AppState() # source of truth
 
 @asynccontextmanager
 async def lifespan(api: FastAPI):
-    await app.start_mdns()
+    if capture.capture:
+        log.info(f"[CAPTURE] recording control traffic to {capture.capture.path}")
+    await app.startup()
     yield
     await app.shutdown()
 
@@ -45,24 +61,29 @@ api.add_middleware(
 @api.websocket("/ws/control")
 async def orchistrate_messages(ws: WebSocket):
     await ws.accept()
+    if capture.capture:
+        capture.capture.attach(ws, capture.CONTROL)
     try:
         while True:
+            text = await ws.receive_text()
+            rx = now_ms()
             try:
-                raw = P.WSPayload.model_validate(await ws.receive_json())
+                raw = P.WSPayload.model_validate_json(text)
             except ValidationError as e:
                 log.error(e)
                 continue
 
-            if raw.kind == P.WSKind.ACTION:
-                await app.handle_actions(raw, ws)
-            elif raw.kind == P.WSKind.EVENT:
-                await app.handle_events(raw, ws)
-            elif raw.kind == P.WSKind.SYNC:
-                await app.handle_sync(raw, ws)
-            elif raw.kind == P.WSKind.ERROR:
-                pass # todo
-            else:
-                await send_error(ws, P.WSErrors.INVALID_KIND)
+            with WS_HANDLER.time(raw.kind.value, raw.msgType.value):
+                if raw.kind == P.WSKind.ACTION:
+                    await app.handle_actions(raw, ws)
+                elif raw.kind == P.WSKind.EVENT:
+                    await app.handle_events(raw, ws)
+                elif raw.kind == P.WSKind.SYNC:
+                    await app.handle_sync(raw, ws, rx)
+                elif raw.kind == P.WSKind.ERROR:
+                    pass # todo
+                else:
+                    await send_error(ws, P.WSErrors.INVALID_KIND)
                 
     except Exception:
         try:
@@ -70,6 +91,44 @@ async def orchistrate_messages(ws: WebSocket):
         except Exception:
             pass
     await app.handle_disconnect(ws)
+    if capture.capture:
+        capture.capture.detach(ws)
+
+
+
+# low latency clock sync, see backend/handlers/SyncHandler.py for the frame layout
+@api.websocket("/ws/sync")
+async def clock_sync(ws: WebSocket, id: str = Query(...)):
+    await ws.accept()
+    if not await app.sessions.is_active(id):
+        await ws.close(code=1008)
+        return
+    if capture.capture:
+        capture.capture.attach(ws, capture.SYNC)
+    await app.sync.serve(id, ws)
+    try:
+        await ws.close()
+    except Exception:
+        pass
+    if capture.capture:
+        capture.capture.detach(ws)
+
+
+
+# recordings streamed while they are recorded, see backend/handlers/StreamHandler.py for the frame layout
+@api.websocket("/ws/stream")
+async def stream_recording(
+    ws: WebSocket,
+    id: str = Query(...),
+    recName: str = Query(""),
+    rid: Optional[str] = Query(None),
+):
+    await ws.accept()
+    await app.streams.serve(ws, id, recName, rid)
+    try:
+        await ws.close()
+    except Exception:
+        pass
 
 
 
@@ -77,7 +136,9 @@ async def orchistrate_messages(ws: WebSocket):
 async def stage_session(req: P.SessionMetadata):
     req.id = str(uuid.uuid4())
     await app.sessions.stage(req)
-    log.info(req.model_dump())
+    session_log.info("staged %s", req)
+    if capture.capture:
+        capture.capture.stage(req.model_dump())
     return req.model_dump()
 
 
@@ -87,6 +148,207 @@ async def list_sessions():
 
 
 
+def local_only(request: Request):
+    if not request.client or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+
+# prometheus text format, only served to the machine running the server
+@api.get("/metrics")
+async def get_metrics(request: Request):
+    local_only(request)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# call sites that blocked the event loop, needs VOCALINK_WATCHDOG=1
+@api.get("/debug/stalls")
+async def get_stalls(request: Request):
+    local_only(request)
+    if not app.watchdog:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Watchdog disabled")
+    return app.watchdog.report()
+
+
+# connected media workers, what each is running and how far it got
+@api.get("/debug/workers")
+async def get_workers(request: Request):
+    local_only(request)
+    return app.media.status()
+
+
+# the other servers of the federation, their clock offset, load and when they last answered
+@api.get("/debug/peers")
+async def get_peers(request: Request):
+    local_only(request)
+    if not app.peers:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Federation disabled")
+    return app.peers.report()
+
+
+# bytes per storage tier, the quota and what was freed to stay under it
+@api.get("/debug/storage")
+async def get_storage(request: Request):
+    local_only(request)
+    return app.storage.report()
+
+
+# same gate as /dashboard: the key handed to the connected dashboard
+def require_dashboard_key(key: Optional[str]) -> bool:
+    if not app.dashboard.key:
+        return False
+    if not key or not secrets.compare_digest(key, app.dashboard.key):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return True
+
+
+def profile_response(profile: profiler.Profile, name: str, format: str):
+    if format == "speedscope":
+        return JSONResponse(
+            profile.speedscope(name),
+            headers={"Content-Disposition": f'attachment; filename="{name}.speedscope.json"'}
+        )
+    return PlainTextResponse(
+        profile.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="{name}.collapsed.txt"'}
+    )
+
+
+@api.get("/debug/profile")
+async def profile_server(
+    seconds: float = Query(10, gt=0, le=profiler.MAX_SECONDS),
+    hz: int = Query(profiler.DEFAULT_HZ, ge=1, le=1000),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+    key: Optional[str] = Header(None, alias="X-Dashboard-Key"),
+):
+    if not require_dashboard_key(key):
+        return Response(status_code=204)
+
+    profile = await asyncio.to_thread(profiler.profile_process, seconds, hz)
+    return profile_response(profile, f"vocalink-{int(profile.started)}", format)
+
+
+# runs one enhance or transcribe job for rid and samples only the media worker running it
+@api.post("/debug/profile/job/{rid}")
+async def profile_job(
+    rid: str,
+    job: str = Query(..., pattern="^(enhance|transcribe)$"),
+    props: int = Query(P.EnhanceProps.AMPLIFY | P.EnhanceProps.REDUCE_NOISE | P.EnhanceProps.STUDIO_FILTER),
+    hz: int = Query(profiler.DEFAULT_HZ, ge=1, le=1000),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+    key: Optional[str] = Header(None, alias="X-Dashboard-Key"),
+):
+    if not require_dashboard_key(key):
+        return Response(status_code=204)
+
+    meta = await app.recordings.get_meta(rid)
+    if not meta or not await app.recordings.is_uploaded(rid):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if getattr(meta, "enhanced" if job == "enhance" else "transcript") == P.RecStates.WORKING:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{job} already in progress")
+
+    profiler.arm_job(rid, hz)
+    try:
+        if job == "enhance":
+            await app.recordings.set_enhanced(rid, P.RecStates.WORKING)
+            await app.services.notify_amend(meta)
+            await app.services.enhance(rid, props)
+        else:
+            await app.recordings.set_transcript(rid, P.RecStates.WORKING)
+            await app.services.notify_amend(meta)
+            await app.services.transcribe(rid)
+    finally:
+        profile = profiler.collect_job(rid)
+
+    # the job failed, or ran where nothing sampled it (a peer, a reused result)
+    if profile is None or not profile.samples:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"No samples of the {job}")
+    return profile_response(profile, f"{job}-{rid}", format)
+
+
+# recent traces, newest first, and the spans of one trace
+@api.get("/debug/traces")
+async def get_traces(key: Optional[str] = Header(None, alias="X-Dashboard-Key")):
+    if not require_dashboard_key(key):
+        return Response(status_code=204)
+    return tracing.traces()
+
+
+@api.get("/debug/traces/{traceId}")
+async def get_trace(traceId: str, key: Optional[str] = Header(None, alias="X-Dashboard-Key")):
+    if not require_dashboard_key(key):
+        return Response(status_code=204)
+    spans = tracing.trace(traceId)
+    if not spans:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return spans
+
+
+# servers of a federation talk to each other here, see backend/handlers/PeersHandler.py
+def require_federation_key(key: Optional[str]):
+    if not app.peers:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Federation disabled")
+    if not app.peers.accepts(key):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+
+@api.get("/federation/node", response_model=P.NodeStatus)
+async def get_node(key: Optional[str] = Header(None, alias="X-Federation-Key")):
+    require_federation_key(key)
+    return await app.node_status()
+
+
+@api.post("/federation/action")
+async def federated_action(req: P.FederatedAction, key: Optional[str] = Header(None, alias="X-Federation-Key")):
+    require_federation_key(key)
+    if req.action not in ACTION_MAP:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not an action for all sessions")
+
+    target = P.WSActionTarget(id=P.BROADCAST, triggerTime=req.triggerTime)
+    ids = await app.broadcast_action(req.action, target, forwarded=True)
+    return {"sessions": len(ids)}
+
+
+@api.post("/federation/jobs/{job}")
+async def federated_job(
+    job: str,
+    rid: str = Form(...),
+    args: str = Form("[]"),
+    original: UploadFile = File(...),
+    regions: Optional[UploadFile] = File(None),
+    key: Optional[str] = Header(None, alias="X-Federation-Key"),
+):
+    require_federation_key(key)
+    if job not in ("transcribe", "enhance"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    try:
+        result, dir, output = await app.peers.run_job(job, rid, json.loads(args), original, regions)
+    except (MediaJobError, OSError, ValueError) as e:
+        log.error(f"[FEDERATION] {job} of {rid} for a peer failed: {e}")
+        raise HTTPException(status_code=500, detail=f"{job} failed")
+
+    if output is None:
+        await asyncio.to_thread(shutil.rmtree, dir, True)
+        return result
+    return FileResponse(
+        path=output,
+        headers={"X-Job-Result": json.dumps(result)},
+        background=BackgroundTask(shutil.rmtree, dir, True)
+    )
+
+
+# recordings of this server and of every federated one, each with where to download them
+@api.get("/federation/recordings", response_model=List[P.NodeCatalog])
+async def get_catalog():
+    return await app.catalog()
+
+
+@api.get("/sync/skew", response_model=P.SkewReport)
+async def get_sync_skew():
+    return app.skew.report()
+
+
+
 @api.get("/dashboard")
 async def getServerInfo():
     serverInfo = await app.server_info()
@@ -163,46 +425,85 @@ async def trigger_merge(req: P.MergeRequest, bg: BackgroundTasks):
     return Response(status_code=status.HTTP_202_ACCEPTED)
 
 
+async def _export(name: str, metas: List[P.RecMetadata], range: Optional[str], if_range: Optional[str]):
+    if not metas:
+        raise HTTPException(status_code=404, detail="No recordings to export")
+    export = Export(name)
+    for meta in metas:
+        app.recordings.touch(meta.rid)
+        export.add(meta, app.recordings.paths(meta))
+    await export.plan()
+    return export.response(range, if_range)
+
+
+@api.get("/export")
+async def export_session(
+    sessionId: str = Query(...),
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    metas = [meta for meta in await app.recordings.get_all_metas() if meta.sessionId == sessionId]
+    return await _export(sessionId, metas, range, if_range)
+
+
+@api.post("/export")
+async def export_recordings(
+    req: P.ExportRequest,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    metas = [await app.recordings.get_meta(rid) for rid in req.rids]
+    if None in metas:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+    return await _export("recordings", metas, range, if_range)
+
+
 @api.post("/recordings/{rid}")
-async def save_recording(rid: str, file: UploadFile = File(...)):
+async def save_recording(rid: str, bg: BackgroundTasks, file: UploadFile = File(...)):
     if not await app.recordings.exist(rid):
         raise HTTPException(status_code=404, detail="Recording ID not found")
 
-    updated_meta = await app.recordings.save(rid, file)
+    with tracing.resume(f"rec:{rid}"), tracing.span("rec.upload", rid=rid):
+        updated_meta = await app.recordings.save(rid, file)
 
-    if not updated_meta or updated_meta.original != P.RecStates.OK:
-        raise HTTPException(status_code=500, detail="Audio storage failed")
+        if not updated_meta or updated_meta.original != P.RecStates.OK:
+            raise HTTPException(status_code=500, detail="Audio storage failed")
 
-    await app.services.notify_amend(updated_meta)
+        await app.services.notify_amend(updated_meta)
+    bg.add_task(app.services.analyze, rid)
     return {"status": "ok", "rid": rid}
 
 
 @api.get("/recordings/{rid}/original")
-async def get_recording(rid: str):
+async def get_recording(rid: str, format: Optional[str] = FORMAT_QUERY, bitrate: Optional[int] = BITRATE_QUERY):
     path = await app.recordings.path(rid, RecordingTypes.ORIGINAL)
     if not path or not await app.recordings.is_uploaded(rid):
         raise HTTPException(status_code=404, detail="Recording ID not found")
 
-    filename = os.path.basename(path)
-    return FileResponse(
-        path=path,
-        media_type="audio/mpeg",
-        filename=filename
-    )
+    return await app.transcodes.response(path, rid, format, bitrate)
     
 
 @api.get("/recordings/{rid}/enhanced")
-async def get_enhanced_recording(rid: str):
+async def get_enhanced_recording(rid: str, format: Optional[str] = FORMAT_QUERY, bitrate: Optional[int] = BITRATE_QUERY):
     path = await app.recordings.path(rid, RecordingTypes.ENHANCED)
     if not path or not await app.recordings.is_enhanced(rid):
         raise HTTPException(status_code=404, detail="Recording ID not found")
 
-    filename = os.path.basename(path)
-    return FileResponse(
-        path=path,
-        media_type="audio/mpeg",
-        filename=filename
-    )
+    return await app.transcodes.response(path, rid, format, bitrate)
+
+
+@api.get("/recordings/{rid}/clip")
+async def get_clip(rid: str, start: float = START_QUERY, end: float = END_QUERY, enhanced: bool = False):
+    if enhanced:
+        path = await app.recordings.path(rid, RecordingTypes.ENHANCED)
+        ready = path and await app.recordings.is_enhanced(rid)
+    else:
+        path = await app.recordings.path(rid, RecordingTypes.ORIGINAL)
+        ready = path and await app.recordings.is_uploaded(rid)
+    if not ready:
+        raise HTTPException(status_code=404, detail="Recording ID not found")
+
+    return await clip_response(path, rid, start, end)
 
 
 @api.get("/recordings/{rid}/transcript")
@@ -224,6 +525,8 @@ async def delete_recording(rid: str):
     success = await app.recordings.delete(rid)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    # a recording deleted while it streams
+    await app.live.cancel(rid)
      
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -237,12 +540,13 @@ async def trigger_transcription(rid: str, bg: BackgroundTasks):
     if await app.recordings.is_transcribed(rid):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT)
 
-    await app.recordings.set_transcript(rid, P.RecStates.WORKING)
-    await app.dashboard.notify(P.WSPayload(
-                             kind=P.WSKind.EVENT,
-                             msgType=P.WSEvents.REC_AMEND,
-                             body=meta
-                         ))
+    with tracing.resume(f"rec:{rid}"), tracing.span("rec.transcribe_requested", rid=rid):
+        await app.recordings.set_transcript(rid, P.RecStates.WORKING)
+        await app.dashboard.notify(P.WSPayload(
+                                 kind=P.WSKind.EVENT,
+                                 msgType=P.WSEvents.REC_AMEND,
+                                 body=meta
+                             ))
     bg.add_task(app.services.transcribe, rid)
 
     return Response(status_code=status.HTTP_202_ACCEPTED)
@@ -264,13 +568,14 @@ async def trigger_enhance(
             detail="Enhancement already in progress"
         )
 
-    log.info('Enhancement level: ' + str(props))
-    await app.recordings.set_enhanced(rid, P.RecStates.WORKING)
-    await app.dashboard.notify(P.WSPayload(
-                             kind=P.WSKind.EVENT,
-                             msgType=P.WSEvents.REC_AMEND,
-                             body=meta
-                         ))
+    log.info("Enhancement level: %s", props)
+    with tracing.resume(f"rec:{rid}"), tracing.span("rec.enhance_requested", rid=rid, props=props):
+        await app.recordings.set_enhanced(rid, P.RecStates.WORKING)
+        await app.dashboard.notify(P.WSPayload(
+                                 kind=P.WSKind.EVENT,
+                                 msgType=P.WSEvents.REC_AMEND,
+                                 body=meta
+                             ))
 
     bg.add_task(app.services.enhance, rid, props)
 
@@ -1,39 +1,122 @@
 import os
+import threading
+import time
 import numpy as np
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
 from pydub import AudioSegment, effects
 from pydub.effects import high_pass_filter
 import noisereduce as nr
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
 import backend.core.primitives as P
 from backend.utils.logging import log
+from backend.utils.metrics import AUDIO_STAGE
+from backend.utils.tracing import child_span
+from backend.utils.noiseProfiles import NoiseEstimate, NoiseProfileCache
+from backend.utils import loudness, speechRegions
+from backend.utils.speechRegions import Compaction, Region
 
-SUPPORTED_FORMATS = {
-    ".m4a": {"format": "mp4", "codec": "aac", "bitrate": "192k"},
-    ".mp3": {"format": "mp3", "codec": "libmp3lame", "bitrate": "192k"},
-    ".ogg": {"format": "ogg", "codec": "libopus", "bitrate": "128k"},
-    ".wav": {"format": "wav"}
-}
+SUPPORTED_FORMATS = P.SUPPORTED_FORMATS
+
+TRUE_PEAK_CEILING = -1.0 # dBTP, EBU R128
+MAX_GAIN = 15.0
+WHISPER_RATE = 16000
+COMPACT_BELOW = 0.9 # speech ratio above which cutting out silence isn't worth it
+FADE_SECONDS = 0.01
+PROBE_SECONDS = 2 # of silence gated to learn how much the gate takes off it
 
 model_size = "small"
-log.info(f"Loading Whisper model ({model_size}) on cpu...")
-model = WhisperModel(model_size, device='cpu', compute_type='int8')
+_model: Optional[WhisperModel] = None
+_batched: Optional[BatchedInferencePipeline] = None
+_model_lock = threading.Lock()
+
+
+# loaded on first use so importing the toolkit (enhance, merge, benchmarks) stays cheap
+def load_model() -> WhisperModel:
+    global _model
+    with _model_lock:
+        if _model is None:
+            log.info(f"Loading Whisper model ({model_size}) on cpu...")
+            _model = WhisperModel(model_size, device='cpu', compute_type='int8')
+    return _model
+
+
+def load_batched() -> BatchedInferencePipeline:
+    global _batched
+    model = load_model()
+    with _model_lock:
+        if _batched is None:
+            _batched = BatchedInferencePipeline(model)
+    return _batched
+
+
+class StageListener:
+    """Hears the stages of the jobs run in this process, the media worker
+    puts one here that reports them to the server."""
+
+    def started(self, stage: str):
+        pass
+
+    def progressed(self, stage: str, done: float):
+        pass
+
+    def finished(self, stage: str, start: int, end: int):
+        pass
+
+
+listener = StageListener()
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    start = time.time_ns()
+    listener.started(name)
+    with AUDIO_STAGE.time(name), child_span(f"audio.{name}"):
+        yield
+    listener.finished(name, start, time.time_ns())
+
 
 class AudioToolkit:
     def __init__(self, props: P.ServerConf = P.ServerConf()):
         self.props = props
+        self.noise_profiles = NoiseProfileCache()
         self.sync_params()
 
     def sync_params(self):
         self.noise_strength = self.props.noiseStrength
-        self.target_dbfs = self.props.amplitudeStrength
+        self.target_lufs = self.props.loudnessTarget
         self.bass_boost = self.props.filterBassBoost
         self.air_boost = self.props.airBoost
         self.comp_thresh = self.props.compressorThreshold
         self.comp_ratio = self.props.compressorRatio
 
-    def _reduce_noise(self, audio: AudioSegment) -> AudioSegment:
+    def speech_regions(self, mono: np.ndarray, sr: int, regions_path: Optional[str] = None) -> List[Region]:
+        """Speech regions cached at regions_path, detected and cached on first use."""
+        regions = speechRegions.load(regions_path) if regions_path else None
+        if regions is None:
+            with _stage("vad"):
+                regions = speechRegions.detect(mono, sr)
+            if regions_path:
+                speechRegions.save(regions_path, regions, len(mono) / sr)
+        return regions
+
+
+    def _compaction(self, mono: np.ndarray, sr: int, regions_path: Optional[str]) -> Optional[Compaction]:
+        regions = self.speech_regions(mono, sr, regions_path)
+        if speechRegions.speech_ratio(regions, len(mono) / sr) >= COMPACT_BELOW:
+            return None
+        return Compaction(regions)
+
+
+    def _reduce_noise(
+        self,
+        audio: AudioSegment,
+        profile_keys: Sequence[str] = (),
+        adaptive: bool = True,
+        regions_path: Optional[str] = None
+    ) -> AudioSegment:
         channels = audio.channels
         sr = audio.frame_rate
         samples = np.array(audio.get_array_of_samples()).astype(np.float32)
@@ -41,16 +124,62 @@ class AudioToolkit:
     
         if channels > 1:
             samples = samples.reshape((-1, channels)).T
+        mono = samples.mean(axis=0) if channels > 1 else samples
 
-        reduced = nr.reduce_noise(
-            y=samples, 
-            sr=sr, 
-            prop_decrease=self.noise_strength, 
-            stationary=False,        
-            n_fft=2048,             
-            time_mask_smooth_ms=64, 
-            n_jobs=-1               
-        )
+        # stationary gating against a known noise floor is far cheaper than the
+        # non-stationary mode, which re-learns the noise over the whole file.
+        # The floor comes from a cached profile of this session/device when it
+        # still fits, else from this recording's own non-speech frames.
+        noise = None
+        if adaptive:
+            estimate = NoiseEstimate(mono, sr)
+            profile = self.noise_profiles.find(profile_keys, estimate)
+            if profile is None:
+                profile = self.noise_profiles.learn(profile_keys, estimate) if profile_keys else None
+                noise = profile.noise if profile else (estimate.noise if estimate.usable else None)
+            else:
+                noise = profile.noise
+
+        if noise is not None:
+            gate = lambda y: nr.reduce_noise(
+                y=y,
+                sr=sr,
+                y_noise=noise,
+                prop_decrease=self.noise_strength,
+                stationary=True,
+                n_fft=2048,
+                time_mask_smooth_ms=64,
+                n_jobs=1
+            )
+            # only speech goes through the gate. Silence is noise alone, so it
+            # gets what the gate does to a bit of it: a flat attenuation
+            compaction = self._compaction(mono, sr, regions_path)
+            if compaction:
+                start, end = speechRegions.longest_gap(compaction.regions, len(mono) / sr)
+                middle = (start + end) / 2 # furthest from any speech
+                probe = samples[..., int(max(start, middle - PROBE_SECONDS / 2) * sr):int(min(end, middle + PROBE_SECONDS / 2) * sr)]
+                if probe.shape[-1] < PROBE_SECONDS * sr / 4:
+                    probe = noise
+                silence_gain = np.sqrt(np.mean(gate(probe) ** 2) / max(np.mean(probe ** 2), 1e-12))
+                joined = compaction.compact(samples, sr)
+                reduced = compaction.expand(
+                    gate(joined) if joined.shape[-1] else joined,
+                    samples * silence_gain,
+                    sr,
+                    int(FADE_SECONDS * sr)
+                )
+            else:
+                reduced = gate(samples)
+        else:
+            reduced = nr.reduce_noise(
+                y=samples, 
+                sr=sr, 
+                prop_decrease=self.noise_strength, 
+                stationary=False,        
+                n_fft=2048,             
+                time_mask_smooth_ms=64, 
+                n_jobs=-1               
+            )
 
         if channels > 1:
             reduced = reduced.T.flatten()
@@ -84,68 +213,186 @@ class AudioToolkit:
         )
 
 
-    def _amplify(self, audio: AudioSegment) -> AudioSegment:
-        if audio.dBFS == float("-inf"):
-            return audio
+    def _loudness_gain(self, stats: P.RecStats) -> float:
+        # to the loudness target, true peaks stay under the ceiling
+        if stats.lufs is None:
+            return 0.0
+        gain = max(min(self.target_lufs - stats.lufs, MAX_GAIN), -MAX_GAIN)
+        return min(gain, TRUE_PEAK_CEILING - stats.truePeak)
 
-        gain_needed = self.target_dbfs - audio.dBFS
-        gain_needed = max(min(gain_needed, 15.0), -15.0) 
-        audio = audio.apply_gain(gain_needed)
 
-        if audio.max_dBFS > -0.5:
-            audio = audio.apply_gain(-0.5 - audio.max_dBFS)
+    def _amplify(self, audio: AudioSegment, stats: Optional[P.RecStats] = None) -> AudioSegment:
+        if stats is None:
+            stats = loudness.analyze(audio)
+        gain = self._loudness_gain(stats)
+        return audio.apply_gain(gain) if gain else audio
 
-        return audio
+
+    def analyze(self, path: str, regions_path: Optional[str] = None) -> P.RecStats:
+        """Loudness stats of the recording, and its speech regions cached at
+        regions_path, from one decode."""
+        with _stage("decode"):
+            audio = AudioSegment.from_file(path)
+        with _stage("analyze"):
+            stats = loudness.analyze(audio)
+        if regions_path:
+            array = audio.get_array_of_samples()
+            samples = np.frombuffer(array, dtype=array.typecode).reshape(-1, audio.channels)
+            mono = samples.mean(axis=1, dtype=np.float32) / (1 << (8 * audio.sample_width - 1))
+            self.speech_regions(mono, audio.frame_rate, regions_path)
+        return stats
 
 
     def _export(self, audio: AudioSegment, path: str):
         ext = os.path.splitext(path)[1].lower()
         config = SUPPORTED_FORMATS.get(ext, {"format": "wav"})
-        audio.export(path, **config)
+        # moved into place once whole, a render is reused as soon as it exists
+        temp = f"{path}.tmp"
+        with _stage("export"):
+            try:
+                audio.export(temp, **config)
+                os.replace(temp, path)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
 
 
-    def enhance(self, input_path: str, output_path: str, props: int) -> Tuple[float, int]:
+    def enhance(
+        self,
+        input_path: str,
+        output_path: str,
+        props: int,
+        profile_keys: Sequence[str] = (),
+        stats: Optional[P.RecStats] = None,
+        regions_path: Optional[str] = None
+    ) -> Tuple[float, int]:
         if not os.path.exists(input_path):
             raise FileNotFoundError(input_path)
 
-        audio = AudioSegment.from_file(input_path)
+        with _stage("decode"):
+            audio = AudioSegment.from_file(input_path)
+
         if props & P.EnhanceProps.REDUCE_NOISE:
-            audio = self._reduce_noise(audio)
+            with _stage("reduce_noise"):
+                audio = self._reduce_noise(audio, profile_keys, regions_path=regions_path)
        
         if props & P.EnhanceProps.STUDIO_FILTER:
-            audio = self._apply_studio_filter(audio)
+            with _stage("studio_filter"):
+                audio = self._apply_studio_filter(audio)
 
         if props & P.EnhanceProps.AMPLIFY:
-            audio = self._amplify(audio)
+            # stats of the original only hold while nothing before changed the level
+            if props & (P.EnhanceProps.REDUCE_NOISE | P.EnhanceProps.STUDIO_FILTER):
+                stats = None
+            with _stage("amplify"):
+                audio = self._amplify(audio, stats)
 
         self._export(audio, output_path)
         return len(audio) / 1000, os.path.getsize(output_path)
 
 
-    def transcribe(self, path: str, rid: str) -> P.TranscriptResult:
-        segments, info = model.transcribe(path, beam_size=5, vad_filter=True)
+    def transcribe(self, path: str, rid: str, regions_path: Optional[str] = None) -> P.TranscriptResult:
+        with _stage("decode"):
+            audio = decode_audio(path, sampling_rate=WHISPER_RATE)
+        duration = len(audio) / WHISPER_RATE
+
+        # Whisper only hears the speech regions, joined, and its timestamps are
+        # mapped back. Its own VAD still runs, now over speech time only
+        compaction = self._compaction(audio, WHISPER_RATE, regions_path)
+        if compaction:
+            audio = compaction.compact(audio, WHISPER_RATE)
+        to_original = compaction.to_original if compaction else (lambda t: t)
+        if not len(audio):
+            return P.TranscriptResult(rid=rid, language="", duration=duration, segments=[])
+
+        with _stage("transcribe"):
+            # segments is lazy, decoding happens while iterating
+            segments, info = load_model().transcribe(audio, beam_size=5, vad_filter=True)
         
-        results = []
-        for s in segments:
-            results.append(P.TranscriptSegment(
-                                       start=round(s.start, 3),
-                                       end=round(s.end, 3),
-                                       text=s.text.strip()
-                                   ))
+            results = []
+            for s in segments:
+                results.append(P.TranscriptSegment(
+                                           start=round(to_original(s.start), 3),
+                                           end=round(to_original(s.end), 3),
+                                           text=s.text.strip()
+                                       ))
+                listener.progressed("transcribe", min(s.end * WHISPER_RATE / len(audio), 1.0))
             
         return P.TranscriptResult(
                                   rid=rid,
                                   language=info.language,
-                                  duration=info.duration,
+                                  duration=duration,
                                   segments=results
                               )
 
 
-    def merge(self, inputs:List[str], output:str, mode:str = "overlap")->Tuple[float, int]:
-        audios = [AudioSegment.from_file(p) for p in inputs if os.path.exists(p)]
-        if not audios:
+    def has_speech(self, audio: np.ndarray) -> bool:
+        """Whether Silero VAD, the one Whisper's vad_filter runs, hears speech in 16kHz audio."""
+        with _stage("vad"):
+            return bool(get_speech_timestamps(audio, VadOptions()))
+
+
+    def detect_language(self, audio: np.ndarray) -> str:
+        with _stage("language"):
+            language, _, _ = load_model().detect_language(audio)
+        return language
+
+
+    def transcribe_windows(self, windows: Sequence[np.ndarray], language: str) -> List[List[P.TranscriptSegment]]:
+        """Transcribes windows of 16kHz audio in one language, up to 30s each, as
+        one batch through the shared model. Segment times are relative to their window."""
+        offsets = np.cumsum([0] + [len(w) for w in windows]) / WHISPER_RATE
+        clips = [{"start": float(offsets[i]), "end": float(offsets[i + 1])} for i in range(len(windows))]
+        results: List[List[P.TranscriptSegment]] = [[] for _ in windows]
+
+        with _stage("transcribe_batch"):
+            # greedy, a live pass has to be done before the next audio is in
+            segments, _ = load_batched().transcribe(
+                np.concatenate(windows),
+                language=language,
+                clip_timestamps=clips,
+                without_timestamps=False,
+                batch_size=len(windows),
+                beam_size=1
+            )
+            for s in segments:
+                text = s.text.strip()
+                if not text:
+                    continue
+                i = int(np.searchsorted(offsets, (s.start + s.end) / 2, side="right")) - 1
+                i = min(max(i, 0), len(windows) - 1)
+                results[i].append(P.TranscriptSegment(
+                                           start=round(max(s.start - offsets[i], 0.0), 3),
+                                           end=round(min(s.end, offsets[i + 1]) - offsets[i], 3),
+                                           text=text
+                                       ))
+        return results
+
+
+    def merge(
+        self,
+        inputs: List[str],
+        output: str,
+        mode: str = "overlap",
+        stats: Sequence[Optional[P.RecStats]] = ()
+    ) -> Tuple[float, int, P.RecStats]:
+        """Merges inputs, each brought to the loudness target first using
+        its stats where known, and returns the stats of the result too."""
+        stats = list(stats) + [None] * (len(inputs) - len(stats))
+        with _stage("decode"):
+            pairs = [(AudioSegment.from_file(p), s) for p, s in zip(inputs, stats) if os.path.exists(p)]
+        if not pairs:
             raise ValueError("No valid audio files found.")
 
+        # overlapping phones hear the same voices, leave room for their peaks to add up
+        headroom = 0.0 if mode == "concat" else 20 * np.log10(len(pairs))
+        with _stage("normalize"):
+            audios = []
+            for audio, s in pairs:
+                gain = self._loudness_gain(s or loudness.analyze(audio)) - headroom
+                audios.append(audio.apply_gain(gain) if gain else audio)
+
         if mode == "concat":
             combined = sum(audios)
         else:
@@ -154,6 +401,12 @@ class AudioToolkit:
             for a in audios:
                 combined = combined.overlay(a)
 
-        combined = effects.normalize(combined)
+        with _stage("normalize"):
+            # measure the sum once, it is stored as the merged recording's stats
+            merged_stats = loudness.analyze(combined)
+            gain = self._loudness_gain(merged_stats)
+            if gain:
+                combined = combined.apply_gain(gain)
+                merged_stats = loudness.with_gain(merged_stats, gain)
         self._export(combined, output)
-        return len(combined) / 1000, os.path.getsize(output)
+        return len(combined) / 1000, os.path.getsize(output), merged_stats
@@ -0,0 +1,146 @@
+from typing import Dict, Iterator, Optional, Tuple
+from fastapi import WebSocket
+import atexit
+import gzip
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+
+# capture mode, e.g. VOCALINK_CAPTURE=logs/capture.bin.gz, replay with tools/replay.py
+CAPTURE_FILE = os.environ.get("VOCALINK_CAPTURE")
+
+# gzip stream of: magic, then records of
+# [u8 event][u8 channel][i64 us since capture start][u32 conn][u32 length][payload]
+MAGIC = b"VLCAP1\n"
+RECORD = struct.Struct("!BBqII")
+
+OPEN = 0 # payload: {"path": ..., "query": ...}
+IN = 1
+OUT = 2
+CLOSE = 3
+STAGE = 4 # POST /sessions, payload: the staged SessionMetadata
+
+CONTROL = 0 # JSON text frames
+SYNC = 1 # binary frames
+HTTP = 2
+
+Record = Tuple[int, int, int, int, bytes] # event, channel, us, conn, payload
+
+
+class Capture:
+    """Appends control-plane traffic to a compact binary log.
+
+    Recording only timestamps and enqueues, a writer thread compresses and
+    writes, so handlers never wait for the disk."""
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._started: int = time.perf_counter_ns()
+        self._conns = itertools.count(1)
+        self._records: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write, name="capture", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+
+    def _put(self, event: int, channel: int, conn: int, payload: bytes):
+        us = (time.perf_counter_ns() - self._started) // 1000
+        self._records.put((event, channel, us, conn, payload))
+
+
+    def _write(self):
+        with gzip.open(self.path, "wb", compresslevel=6) as f:
+            f.write(MAGIC)
+            while True:
+                record = self._records.get()
+                if record is None:
+                    break
+                event, channel, us, conn, payload = record
+                f.write(RECORD.pack(event, channel, us, conn, len(payload)))
+                f.write(payload)
+                if self._records.empty():
+                    f.flush()
+
+
+    def close(self):
+        if self._writer.is_alive():
+            self._records.put(None)
+            self._writer.join()
+
+
+    def stage(self, meta: Dict):
+        self._put(STAGE, HTTP, 0, json.dumps(meta).encode())
+
+
+    def attach(self, ws: WebSocket, channel: int):
+        """Records everything received and sent on ws from now on."""
+        conn = next(self._conns)
+        self._put(OPEN, channel, conn, json.dumps({
+            "path": ws.url.path,
+            "query": ws.url.query,
+        }).encode())
+
+        if channel == CONTROL:
+            receive_text, send_json = ws.receive_text, ws.send_json
+
+            async def recording_receive_text() -> str:
+                text = await receive_text()
+                self._put(IN, channel, conn, text.encode())
+                return text
+
+            async def recording_send_json(data, mode: str = "text"):
+                await send_json(data, mode)
+                self._put(OUT, channel, conn, json.dumps(data, separators=(",", ":")).encode())
+
+            ws.receive_text = recording_receive_text
+            ws.send_json = recording_send_json
+
+        else:
+            receive, send_bytes = ws.receive, ws.send_bytes
+
+            async def recording_receive():
+                msg = await receive()
+                data = msg.get("bytes")
+                if data is not None:
+                    self._put(IN, channel, conn, data)
+                return msg
+
+            async def recording_send_bytes(data: bytes):
+                await send_bytes(data)
+                self._put(OUT, channel, conn, data)
+
+            ws.receive = recording_receive
+            ws.send_bytes = recording_send_bytes
+
+        ws.scope["vocalink.capture"] = (conn, channel)
+
+
+    def detach(self, ws: WebSocket):
+        attached = ws.scope.pop("vocalink.capture", None)
+        if attached:
+            conn, channel = attached
+            self._put(CLOSE, channel, conn, b"")
+
+
+def read(path: str) -> Iterator[Record]:
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            try:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                event, channel, us, conn, length = RECORD.unpack(head)
+                payload = f.read(length)
+            except EOFError:
+                return # the server is still writing it, or was killed
+            yield event, channel, us, conn, payload
+
+
+capture: Optional[Capture] = Capture(CAPTURE_FILE) if CAPTURE_FILE else None
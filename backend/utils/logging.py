@@ -1,13 +1,84 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+from enum import Enum
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
+from typing import Dict
 
 LOG_PATH = Path("logs")
 LOG_PATH.mkdir(exist_ok=True)
 
-LOG_FILE = LOG_PATH / "server.log"
+# media workers log next to the server, see backend/worker.py
+LOG_FILE = LOG_PATH / os.environ.get("VOCALINK_LOG_FILE", "server.log")
 LOG_FILE.write_text("")
 
+# per category overrides, e.g. VOCALINK_LOG="sync=DEBUG,session=WARNING"
+CATEGORY_LEVELS: Dict[str, int] = {
+    "ws": logging.INFO,
+    "session": logging.INFO,
+    "sync": logging.INFO,
+}
+
+# fraction of INFO/DEBUG records kept for high rate categories,
+# e.g. VOCALINK_LOG_SAMPLE="session=1.0"
+SAMPLING: Dict[str, float] = {
+    "session": 0.2,
+    "sync": 0.1,
+}
+
+
+def _parse_env(name: str) -> Dict[str, str]:
+    pairs = {}
+    for item in os.environ.get(name, "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "cat": record.name.split(".", 1)[1] if "." in record.name else "app",
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+# %-args the writer thread can read later and still see what was logged
+IMMUTABLE = (str, int, float, bytes, Enum, type(None))
+
+
+class DeferredQueueHandler(QueueHandler):
+    # records only get here once level and sampling let them through, so
+    # disabled messages never render. The rest are queued as they are and
+    # the writer thread renders the message, the JSON and tracebacks. A
+    # message with mutable %-args (a payload about to be changed) is
+    # rendered here, the writer would show what they became.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not all(isinstance(arg, IMMUTABLE) for arg in (args.values() if isinstance(args, dict) else args)):
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
 def setup_logger() -> logging.Logger:
     logger = logging.getLogger("app")
     logger.setLevel(logging.INFO)
@@ -21,16 +92,41 @@ def setup_logger() -> logging.Logger:
         backupCount=5,
         encoding="utf-8"
     )
+    handler.setFormatter(JsonLinesFormatter())
 
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] %(message)s",
-        "%Y-%m-%d %H:%M:%S"
-    )
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.propagate = False
 
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    levels = _parse_env("VOCALINK_LOG")
+    rates = _parse_env("VOCALINK_LOG_SAMPLE")
+    for category, level in CATEGORY_LEVELS.items():
+        child = logging.getLogger(f"app.{category}")
+        try:
+            child.setLevel(levels.get(category, logging.getLevelName(level)).upper())
+        except ValueError:
+            logger.warning(f"Bad VOCALINK_LOG level for {category}: {levels[category]!r}, using {logging.getLevelName(level)}")
+            child.setLevel(level)
+        rate = SAMPLING.get(category, 1.0)
+        try:
+            rate = min(max(float(rates.get(category, rate)), 0.0), 1.0)
+        except ValueError:
+            logger.warning(f"Bad VOCALINK_LOG_SAMPLE rate for {category}: {rates[category]!r}, using {rate}")
+        if rate < 1.0:
+            child.addFilter(SampleFilter(rate))
 
     return logger
 
 
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f"app.{category}")
+
+
 log: logging.Logger = setup_logger()
+ws_log: logging.Logger = get_logger("ws")
+session_log: logging.Logger = get_logger("session")
+sync_log: logging.Logger = get_logger("sync")
@@ -0,0 +1,136 @@
+from typing import Optional
+import numpy as np
+from scipy.signal import firwin, resample_poly, sosfilt
+from pydub import AudioSegment
+
+import backend.core.primitives as P
+
+
+CHUNK_SECONDS = 10 # audio is converted to float one chunk at a time
+STEP_SECONDS = 0.1 # BS.1770 gating blocks are 4 steps long with 75% overlap
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+SILENCE_LUFS = -50.0 # momentary loudness below this counts as silence
+CLIP_LEVEL = 0.999 # of full scale
+OVERSAMPLE = 4 # true peak, as BS.1770 asks for at 48kHz
+FLOOR_DB = -120.0 # stands in for -inf, which JSON can't carry
+PAD = 32 # frames of context for the oversampling filter, so window edges don't ring
+BLOCK = 512 # frames per sample peak when looking for true peak candidates
+WINDOW_BLOCKS = 1024
+TRUE_PEAK_MARGIN_DB = 3.0 # blocks this far below the sample peak can't hold the true peak
+
+
+# same low pass resample_poly designs itself, made once instead of per window
+_UPSAMPLE_FIR = firwin(20 * OVERSAMPLE + 1, 1 / OVERSAMPLE, window=("kaiser", 5.0))
+
+
+def _k_weighting(sr: int) -> np.ndarray:
+    """BS.1770 pre-filter (high shelf, then RLB high pass) as second-order sections for any sample rate."""
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sr)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = np.array([vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k]) / a0
+    shelf_a = np.array([1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sr)
+    a0 = 1 + k / q + k * k
+    hp_b = np.array([1.0, -2.0, 1.0])
+    hp_a = np.array([1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return np.array([np.concatenate([shelf_b, shelf_a]), np.concatenate([hp_b, hp_a])])
+
+
+def _db(power: float) -> float:
+    return max(FLOOR_DB, 10 * np.log10(power)) if power > 0 else FLOOR_DB
+
+
+def _true_peak(samples: np.ndarray, full_scale: float, block_peaks: np.ndarray) -> float:
+    """Oversampled peak, looking only around blocks whose sample peak is close
+    enough to the loudest one to hide a higher peak between samples."""
+    sample_peak = float(block_peaks.max()) if len(block_peaks) else 0.0
+    if sample_peak == 0:
+        return 0.0
+    hot = np.flatnonzero(block_peaks >= sample_peak * 10 ** (-TRUE_PEAK_MARGIN_DB / 20))
+    peak = sample_peak
+    for run in np.split(hot, np.flatnonzero(np.diff(hot) != 1) + 1):
+        # noise-like audio is hot everywhere, keep the windows chunk sized
+        for part in np.array_split(run, -(-len(run) // WINDOW_BLOCKS)):
+            start, end = part[0] * BLOCK, min((part[-1] + 1) * BLOCK, len(samples))
+            lead = min(start, PAD)
+            window = samples[start - lead:end + PAD].T.astype(np.float64, order="C") / full_scale
+            upsampled = resample_poly(window, OVERSAMPLE, 1, axis=-1, window=_UPSAMPLE_FIR)
+            peak = max(peak, float(np.max(np.abs(upsampled[:, lead * OVERSAMPLE:(lead + end - start) * OVERSAMPLE]))))
+    return peak
+
+
+def analyze(audio: AudioSegment) -> P.RecStats:
+    """Integrated loudness (EBU R128 / BS.1770-4), true peak, RMS, clipping and silence
+    of audio, converted to float a chunk at a time."""
+    sr, channels = audio.frame_rate, audio.channels
+    full_scale = float(1 << (8 * audio.sample_width - 1))
+    array = audio.get_array_of_samples()
+    samples = np.frombuffer(array, dtype=array.typecode).reshape(-1, channels)
+
+    sos = _k_weighting(sr)
+    zi = np.zeros((2, channels, 2))
+
+    step = int(STEP_SECONDS * sr)
+    steps = [] # summed K-weighted energy per 100ms step, all channels weighted 1.0
+    peaks = [] # sample peak per BLOCK frames
+    carry = np.zeros(0)
+    square_sum = 0.0
+    clipped = 0
+
+    size = CHUNK_SECONDS * sr // BLOCK * BLOCK
+    for start in range(0, len(samples), size):
+        # channels first, so every reduction below runs over contiguous rows
+        chunk = samples[start:start + size].T.astype(np.float64, order="C") / full_scale
+        square_sum += float(np.sum(chunk * chunk))
+        magnitude = np.abs(chunk)
+        clipped += int(np.count_nonzero(magnitude >= CLIP_LEVEL))
+        level = np.max(magnitude, axis=0)
+        level = np.pad(level, (0, -len(level) % BLOCK))
+        peaks.append(level.reshape(-1, BLOCK).max(axis=1))
+
+        weighted, zi = sosfilt(sos, chunk, axis=-1, zi=zi)
+        power = np.concatenate([carry, np.sum(weighted * weighted, axis=0)])
+        whole = len(power) // step * step
+        steps.append(power[:whole].reshape(-1, step).sum(axis=1))
+        carry = power[whole:]
+
+    energy = np.concatenate(steps) if steps else np.zeros(0)
+    if len(energy) >= 4:
+        blocks = np.convolve(energy, np.ones(4), mode="valid") / (4 * step)
+    else:
+        blocks = np.zeros(0)
+
+    with np.errstate(divide="ignore"):
+        momentary = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[momentary > ABSOLUTE_GATE]
+    lufs: Optional[float] = None
+    if len(gated):
+        relative = -0.691 + 10 * np.log10(np.mean(gated)) + RELATIVE_GATE
+        gated = blocks[(momentary > ABSOLUTE_GATE) & (momentary > relative)]
+        lufs = round(-0.691 + 10 * np.log10(np.mean(gated)), 2)
+
+    peak = _true_peak(samples, full_scale, np.concatenate(peaks) if peaks else np.zeros(0))
+    total = samples.size
+    return P.RecStats(
+        lufs=lufs,
+        truePeak=round(_db(peak * peak), 2),
+        rms=round(_db(square_sum / total if total else 0.0), 2),
+        clipping=round(clipped / total, 6) if total else 0.0,
+        silence=round(float(np.mean(momentary < SILENCE_LUFS)), 4) if len(blocks) else 1.0,
+    )
+
+
+def with_gain(stats: P.RecStats, gain: float) -> P.RecStats:
+    """Stats of the same audio after apply_gain(gain), without measuring it again.
+    Clipping and silence are kept as measured."""
+    return stats.model_copy(update={
+        "lufs": None if stats.lufs is None else round(stats.lufs + gain, 2),
+        "truePeak": round(stats.truePeak + gain, 2),
+        "rms": round(stats.rms + gain, 2),
+    })
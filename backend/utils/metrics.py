@@ -0,0 +1,195 @@
+from typing import Dict, List, Tuple, Iterator
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from bisect import bisect_left
+import asyncio
+import threading
+import time
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+JOB_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+Labels = Tuple[str, ...]
+
+
+def _labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._lock = threading.Lock() # audio stages report from worker threads
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Its exposition lines, one per series."""
+
+    def render(self) -> str:
+        head = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(head + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, amount: float = 1, *labels: str):
+        self.inc(-amount, *labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._series: Dict[Labels, List[float]] = {} # per bucket counts + [+Inf, sum]
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for labels, series in items:
+            total = 0
+            for le, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                bucket = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+WS_HANDLER = REGISTRY.register(Histogram(
+    "vocalink_ws_handler_seconds", "Time spent handling one /ws/control message", ("kind", "msgType")))
+LOOP_LAG = REGISTRY.register(Histogram(
+    "vocalink_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task"))
+BROADCAST = REGISTRY.register(Histogram(
+    "vocalink_broadcast_seconds", "Fan-out duration of a broadcast to all sessions"))
+AUDIO_STAGE = REGISTRY.register(Histogram(
+    "vocalink_audio_stage_seconds", "AudioToolkit processing stages", ("stage",), JOB_BUCKETS))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "vocalink_upload_bytes_total", "Bytes received through recording uploads"))
+UPLOAD_SECONDS = REGISTRY.register(Histogram(
+    "vocalink_upload_seconds", "Duration of one recording upload", (), JOB_BUCKETS))
+STREAMS = REGISTRY.register(Gauge(
+    "vocalink_streams", "Recordings streaming in while they are recorded"))
+STREAM_BYTES = REGISTRY.register(Counter(
+    "vocalink_stream_bytes_total", "Bytes written to recording spools by live streams"))
+STREAM_CHUNKS = REGISTRY.register(Counter(
+    "vocalink_stream_chunks_total", "Stream chunks by what happened to them", ("result",)))
+STREAM_TAIL = REGISTRY.register(Histogram(
+    "vocalink_stream_tail_seconds", "From a stream's end frame to its original being stored"))
+LIVE_LAG = REGISTRY.register(Histogram(
+    "vocalink_live_transcript_lag_seconds", "Streamed audio not committed to its live transcript yet, after each pass", (), JOB_BUCKETS))
+MEDIA_WORKERS = REGISTRY.register(Gauge(
+    "vocalink_media_workers", "Media worker processes connected to the server"))
+HTTP_WORKERS = REGISTRY.register(Gauge(
+    "vocalink_http_workers", "HTTP worker processes connected to the server"))
+PEERS = REGISTRY.register(Gauge(
+    "vocalink_peers", "Federated servers answering this server"))
+ROUTED_JOBS = REGISTRY.register(Counter(
+    "vocalink_routed_jobs_total", "Media jobs run by a federated server, by how they ended", ("job", "result")))
+DEDUP_BYTES = REGISTRY.register(Counter(
+    "vocalink_dedup_bytes_total", "Bytes of originals not stored again, the same audio was"))
+REUSED = REGISTRY.register(Counter(
+    "vocalink_reused_results_total", "Media jobs skipped, their result for the same audio existed", ("job",)))
+STORAGE_BYTES = REGISTRY.register(Gauge(
+    "vocalink_storage_bytes", "Bytes under storage/ per tier, as of the last storage pass", ("tier",)))
+EVICTED_BYTES = REGISTRY.register(Counter(
+    "vocalink_storage_evicted_bytes_total", "Bytes freed to get under the storage quota, per tier", ("tier",)))
+COMPACTED_BYTES = REGISTRY.register(Counter(
+    "vocalink_storage_compacted_bytes_total", "Bytes saved transcoding cold originals"))
+MEDIA_LOST = REGISTRY.register(Counter(
+    "vocalink_media_jobs_lost_total", "Media jobs whose worker went away while running them"))
+JOBS = REGISTRY.register(Gauge(
+    "vocalink_jobs", "Background media jobs queued or running", ("job",)))
+LOCK_WAIT = REGISTRY.register(Histogram(
+    "vocalink_lock_wait_seconds", "Time spent waiting for a handler lock", ("lock",)))
+
+
+class TimedLock(asyncio.Lock):
+    """asyncio.Lock that reports how long acquirers waited."""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self._name = name
+
+    async def acquire(self) -> bool:
+        start = time.perf_counter()
+        await super().acquire()
+        LOCK_WAIT.observe(time.perf_counter() - start, self._name)
+        return True
+
+
+async def watch_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
@@ -0,0 +1,100 @@
+from typing import Optional, Sequence
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+
+FRAME = 2048 # samples per analysis frame, same as the n_fft we denoise with
+QUIET_MARGIN_DB = 6.0 # frames this close to the quietest 10% count as noise only
+MIN_NOISE_SECONDS = 1.0 # less non-speech than this is not enough to learn a profile
+MAX_NOISE_SECONDS = 10.0 # noisereduce only looks at the first chunk of y_noise anyway
+MATCH_DB = 6.0 # mean spectral distance up to which a cached profile still fits
+MAX_PROFILES = 256
+
+
+def quiet_frames(mono: np.ndarray) -> np.ndarray:
+    """Boolean mask over FRAME sized frames that hold no speech."""
+    frames = mono[: len(mono) // FRAME * FRAME].reshape(-1, FRAME)
+    if not len(frames):
+        return np.zeros(0, dtype=bool)
+    rms_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    return rms_db <= np.percentile(rms_db, 10) + QUIET_MARGIN_DB
+
+
+def spectrum_db(noise: np.ndarray) -> np.ndarray:
+    frames = noise[: len(noise) // FRAME * FRAME].reshape(-1, FRAME) * np.hanning(FRAME)
+    power = np.mean(np.abs(np.fft.rfft(frames, axis=1)) ** 2, axis=0)
+    return 10 * np.log10(power + 1e-12)
+
+
+class NoiseProfile:
+    __slots__ = ('noise', 'spectrum', 'sr', 'updatedAt', 'hits')
+
+    def __init__(self, noise: np.ndarray, sr: int):
+        self.noise: np.ndarray = noise
+        self.spectrum: np.ndarray = spectrum_db(noise)
+        self.sr: int = sr
+        self.updatedAt: float = time.time()
+        self.hits: int = 0
+
+    def matches(self, spectrum: np.ndarray, sr: int) -> bool:
+        if sr != self.sr or spectrum.shape != self.spectrum.shape:
+            return False
+        # skip DC/rumble, the studio filter cuts it anyway
+        return float(np.mean(np.abs(spectrum[4:] - self.spectrum[4:]))) <= MATCH_DB
+
+
+class NoiseEstimate:
+    """Noise-only audio found in one recording."""
+
+    def __init__(self, mono: np.ndarray, sr: int):
+        mask = quiet_frames(mono)
+        frames = mono[: len(mask) * FRAME].reshape(-1, FRAME)[mask]
+        self.sr: int = sr
+        self.noise: np.ndarray = frames.reshape(-1)[: int(MAX_NOISE_SECONDS * sr)]
+        self.seconds: float = len(frames) * FRAME / sr
+        self.spectrum: Optional[np.ndarray] = spectrum_db(self.noise) if len(frames) else None
+
+    @property
+    def usable(self) -> bool:
+        return self.seconds >= MIN_NOISE_SECONDS
+
+
+class NoiseProfileCache:
+    """Noise floors learned per session and per device, shared by jobs running in threads."""
+
+    def __init__(self, size: int = MAX_PROFILES):
+        self._size = size
+        self._profiles: "OrderedDict[str, NoiseProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def find(self, keys: Sequence[str], estimate: NoiseEstimate) -> Optional[NoiseProfile]:
+        """First cached profile under keys that fits the recording. Recordings
+        without enough non-speech to compare against trust the profile."""
+        with self._lock:
+            for key in keys:
+                profile = self._profiles.get(key)
+                if profile is None:
+                    continue
+                if estimate.spectrum is None or not estimate.usable or profile.matches(estimate.spectrum, estimate.sr):
+                    self._profiles.move_to_end(key)
+                    profile.hits += 1
+                    return profile
+        return None
+
+
+    def learn(self, keys: Sequence[str], estimate: NoiseEstimate) -> Optional[NoiseProfile]:
+        if not estimate.usable:
+            return None
+        profile = NoiseProfile(estimate.noise, estimate.sr)
+        with self._lock:
+            for key in keys:
+                self._profiles[key] = profile
+                self._profiles.move_to_end(key)
+            while len(self._profiles) > self._size:
+                self._profiles.popitem(last=False)
+        return profile
+
@@ -0,0 +1,176 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple, TypeVar
+from collections import Counter
+from contextlib import contextmanager
+import os
+import sys
+import threading
+import time
+
+
+DEFAULT_HZ = 100
+MAX_SECONDS = 120
+
+Stack = Tuple[str, ...]
+T = TypeVar("T")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class Profile:
+    """Aggregated stack samples, outermost frame first, thread name as the root."""
+
+    def __init__(self, hz: int):
+        self.hz: int = hz
+        self.samples: Counter = Counter()
+        self.started: float = time.time()
+        self.duration: float = 0.0
+
+
+    def collapsed(self) -> str:
+        # flamegraph.pl / speedscope / inferno "collapsed stack" format
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.items()) + "\n"
+
+
+    def speedscope(self, name: str) -> Dict:
+        frames: List[Dict] = []
+        index: Dict[str, int] = {}
+        by_thread: Dict[str, Tuple[List[List[int]], List[int]]] = {}
+
+        for stack, count in self.samples.items():
+            thread, calls = stack[0], stack[1:]
+            ids = []
+            for call in calls:
+                if call not in index:
+                    index[call] = len(frames)
+                    frames.append({"name": call})
+                ids.append(index[call])
+            stacks, weights = by_thread.setdefault(thread, ([], []))
+            stacks.append(ids)
+            weights.append(count)
+
+        unit = 1 / self.hz
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "vocal-link-dashboard",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights) * unit,
+                    "samples": stacks,
+                    "weights": [w * unit for w in weights],
+                }
+                for thread, (stacks, weights) in by_thread.items()
+            ],
+        }
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of every thread (or only the given ones) at a fixed rate."""
+
+    def __init__(self, profile: Profile, only: Optional[Set[int]] = None):
+        super().__init__(name="profiler", daemon=True)
+        self.profile: Profile = profile
+        self.only: Optional[Set[int]] = only
+        self._halt = threading.Event()
+
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid, frame in sys._current_frames().items():
+            if tid == me or (self.only is not None and tid not in self.only):
+                continue
+            calls = []
+            while frame is not None:
+                calls.append(_frame_name(frame))
+                frame = frame.f_back
+            calls.append(names.get(tid, str(tid)))
+            self.profile.samples[tuple(reversed(calls))] += 1
+
+
+    def run(self):
+        interval = 1 / self.profile.hz
+        started = time.perf_counter()
+        while not self._halt.wait(interval):
+            self._sample()
+        self.profile.duration = time.perf_counter() - started
+
+
+    def halt(self) -> Profile:
+        self._halt.set()
+        if self.is_alive():
+            self.join()
+        return self.profile
+
+
+# blocking, run it through asyncio.to_thread
+def profile_process(seconds: float, hz: int = DEFAULT_HZ) -> Profile:
+    sampler = Sampler(Profile(hz))
+    sampler.start()
+    time.sleep(min(seconds, MAX_SECONDS))
+    return sampler.halt()
+
+
+_jobs: Dict[str, Sampler] = {} # rid, sampler waiting for the job's thread
+_jobs_lock = threading.Lock()
+
+
+def arm_job(rid: str, hz: int = DEFAULT_HZ):
+    with _jobs_lock:
+        _jobs[rid] = Sampler(Profile(hz), only=set())
+
+
+def collect_job(rid: str) -> Optional[Profile]:
+    with _jobs_lock:
+        sampler = _jobs.pop(rid, None)
+    return sampler.halt() if sampler else None
+
+
+def job_hz(rid: str) -> Optional[int]:
+    """Sampling rate of the profile armed for rid, if any."""
+    with _jobs_lock:
+        sampler = _jobs.get(rid)
+    return sampler.profile.hz if sampler else None
+
+
+def add_job_samples(rid: str, samples: List[Tuple[Stack, int]], duration: float):
+    """Adds samples of rid's job taken in a media worker to its armed profile."""
+    with _jobs_lock:
+        sampler = _jobs.get(rid)
+    if sampler is None:
+        return
+    for stack, count in samples:
+        sampler.profile.samples[tuple(stack)] += count
+    sampler.profile.duration += duration
+
+
+@contextmanager
+def job(rid: str):
+    with _jobs_lock:
+        sampler = _jobs.get(rid)
+    if sampler is None or sampler.only is None:
+        yield
+        return
+
+    tid = threading.get_ident()
+    sampler.only.add(tid)
+    if not sampler.is_alive():
+        sampler.start()
+    try:
+        yield
+    finally:
+        sampler.only.discard(tid)
+
+
+# worker thread entry point for media jobs, samples it when a profile was armed for rid
+def run_job(rid: str, fn: Callable[..., T], *args) -> T:
+    with job(rid):
+        return fn(*args)
@@ -0,0 +1,133 @@
+from typing import List, Optional, Tuple
+from bisect import bisect_right
+import json
+import os
+
+import numpy as np
+
+
+Region = Tuple[float, float] # start, end in seconds
+
+FRAME_SECONDS = 0.03
+FLOOR_PERCENTILE = 10 # the quietest frames tell the noise floor
+MARGIN_DB = 10.0 # speech stands this far above the floor
+TAIL_MARGIN_DB = 4.0 # and its quiet edges this far, next to speech only
+MIN_CONTRAST_DB = 15.0 # loudest frames to floor, below it speech and noise can't be told apart
+SILENCE_DB = -55.0 # frames this quiet never do
+MIN_SPEECH_SECONDS = 0.06 # less loud than this is a click or a bump
+PAD_SECONDS = 0.3 # kept around speech so word edges survive
+MIN_GAP_SECONDS = 0.6 # shorter pauses stay in
+JOIN_GAP_SECONDS = 0.3 # silence left between regions once they are joined
+
+
+def detect(mono: np.ndarray, sr: int) -> List[Region]:
+    """Speech regions of a mono float signal from frame energy against its noise floor."""
+    frame = max(1, int(FRAME_SECONDS * sr))
+    count = len(mono) // frame
+    duration = len(mono) / sr
+    if not count:
+        return []
+
+    frames = mono[:count * frame].reshape(count, frame)
+    level = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    floor, peak = np.percentile(level, [FLOOR_PERCENTILE, 99])
+    if peak - floor < MIN_CONTRAST_DB and peak > SILENCE_DB:
+        return [(0.0, round(duration, 3))] # too noisy to cut anything out safely
+    loud = level > max(floor + MARGIN_DB, SILENCE_DB)
+    active = level > max(floor + TAIL_MARGIN_DB, SILENCE_DB)
+
+    # runs of active frames as [start, end) frame indexes, kept when loud somewhere
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0])))).reshape(-1, 2)
+    loud_frames = np.concatenate(([0], np.cumsum(loud)))
+    min_loud = MIN_SPEECH_SECONDS / FRAME_SECONDS
+
+    regions: List[Region] = []
+    for first, last in edges:
+        if loud_frames[last] - loud_frames[first] < min_loud:
+            continue
+        start, end = first * frame / sr, last * frame / sr
+        start, end = max(0.0, start - PAD_SECONDS), min(duration, end + PAD_SECONDS)
+        if regions and start - regions[-1][1] < MIN_GAP_SECONDS:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return [(round(s, 3), round(e, 3)) for s, e in regions]
+
+
+def speech_ratio(regions: List[Region], duration: float) -> float:
+    return sum(e - s for s, e in regions) / duration if duration > 0 else 0.0
+
+
+def longest_gap(regions: List[Region], duration: float) -> Region:
+    edges = [0.0] + [t for r in regions for t in r] + [duration]
+    gaps = [(edges[i], edges[i + 1]) for i in range(0, len(edges), 2)]
+    return max(gaps, key=lambda g: g[1] - g[0])
+
+
+def load(path: str) -> Optional[List[Region]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [(s, e) for s, e in json.load(f)["regions"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save(path: str, regions: List[Region], duration: float):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"duration": round(duration, 3), "regions": regions}, f)
+    os.replace(temp_path, path)
+
+
+class Compaction:
+    """Speech regions cut out of a recording and joined with short gaps, and
+    the way back from the joined timeline to the original one."""
+
+    def __init__(self, regions: List[Region]):
+        self.regions: List[Region] = regions
+        self.starts: List[float] = [] # where every region begins in the joined audio
+        at = 0.0
+        for s, e in regions:
+            self.starts.append(at)
+            at += e - s + JOIN_GAP_SECONDS
+
+
+    def _spans(self, sr: int) -> List[Tuple[int, int]]:
+        return [(int(s * sr), int(e * sr)) for s, e in self.regions]
+
+
+    def compact(self, samples: np.ndarray, sr: int) -> np.ndarray:
+        """Joined speech of samples, time on the last axis."""
+        gap = np.zeros(samples.shape[:-1] + (int(JOIN_GAP_SECONDS * sr),), dtype=samples.dtype)
+        pieces = []
+        for a, b in self._spans(sr):
+            pieces += [samples[..., a:b], gap]
+        return np.concatenate(pieces, axis=-1) if pieces else samples[..., :0]
+
+
+    def expand(self, joined: np.ndarray, into: np.ndarray, sr: int, fade: int = 0) -> np.ndarray:
+        """Puts the regions of joined, as made by compact, back over into,
+        fading between the two over fade samples at every edge."""
+        gap = int(JOIN_GAP_SECONDS * sr)
+        at = 0
+        for a, b in self._spans(sr):
+            piece = joined[..., at:at + b - a]
+            n = min(fade, (b - a) // 2)
+            if n:
+                ramp = np.linspace(0, 1, n, dtype=piece.dtype)
+                piece = piece.copy()
+                piece[..., :n] = piece[..., :n] * ramp + into[..., a:a + n] * ramp[::-1]
+                piece[..., -n:] = piece[..., -n:] * ramp[::-1] + into[..., b - n:b] * ramp
+            into[..., a:b] = piece
+            at += b - a + gap
+        return into
+
+
+    def to_original(self, t: float) -> float:
+        i = max(0, bisect_right(self.starts, t) - 1)
+        if i >= len(self.regions):
+            return t
+        s, e = self.regions[i]
+        return s + min(t - self.starts[i], e - s)
@@ -0,0 +1,171 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+
+
+BUFFER_SPANS = 4096
+MAX_BINDINGS = 1024
+# optional JSON lines exporter, e.g. VOCALINK_TRACE_FILE=logs/traces.jsonl
+TRACE_FILE = os.environ.get("VOCALINK_TRACE_FILE")
+
+
+class Span:
+    __slots__ = ('traceId', 'spanId', 'parentId', 'name', 'start', 'end', 'attrs', 'error')
+
+    def __init__(self, name: str, traceId: str, parentId: Optional[str], attrs: Dict):
+        self.traceId: str = traceId
+        self.spanId: str = secrets.token_hex(8)
+        self.parentId: Optional[str] = parentId
+        self.name: str = name
+        self.start: int = time.time_ns()
+        self.end: Optional[int] = None
+        self.attrs: Dict = attrs
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return {
+            "traceId": self.traceId,
+            "spanId": self.spanId,
+            "parentId": self.parentId,
+            "name": self.name,
+            "startMs": self.start / 1e6,
+            "durationMs": ((self.end or time.time_ns()) - self.start) / 1e6,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+_current: ContextVar[Optional[Tuple[str, str]]] = ContextVar("span", default=None) # (traceId, spanId)
+_finished: deque = deque(maxlen=BUFFER_SPANS)
+_bindings: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_lock = threading.Lock()
+_export: Optional[queue.SimpleQueue] = None
+
+
+def _writer(q: queue.SimpleQueue, path: str):
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            f.write(q.get() + "\n")
+            if q.empty():
+                f.flush()
+
+
+if TRACE_FILE:
+    _export = queue.SimpleQueue()
+    threading.Thread(target=_writer, args=(_export, TRACE_FILE), name="trace-export", daemon=True).start()
+
+
+def _finish(s: Span):
+    if s.end is None:
+        s.end = time.time_ns()
+    with _lock:
+        _finished.append(s)
+    if _export is not None:
+        _export.put(json.dumps(s.as_dict(), default=str))
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Starts a span under the current one, or a new trace when there is none."""
+    parent = _current.get()
+    s = Span(name, parent[0] if parent else secrets.token_hex(16), parent[1] if parent else None, attrs)
+    token = _current.set((s.traceId, s.spanId))
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        _finish(s)
+
+
+@contextmanager
+def child_span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Like span() but does nothing outside of a trace, for hot paths."""
+    if _current.get() is None:
+        yield None
+        return
+    with span(name, **attrs) as s:
+        yield s
+
+
+def current() -> Optional[Tuple[str, str]]:
+    """The current (traceId, spanId), for record() once the work is done elsewhere."""
+    return _current.get()
+
+
+def record(parent: Optional[Tuple[str, str]], name: str, start: int, end: int, **attrs):
+    """Adds a finished span under parent, for work timed by another process."""
+    if parent is None:
+        return
+    s = Span(name, parent[0], parent[1], attrs)
+    s.start = start
+    s.end = end
+    _finish(s)
+
+
+def bind(key: str):
+    """Remembers the current span under key so later work on the same
+    session or recording joins this trace, see resume()."""
+    ctx = _current.get()
+    if ctx is None:
+        return
+    with _lock:
+        _bindings[key] = ctx
+        _bindings.move_to_end(key)
+        while len(_bindings) > MAX_BINDINGS:
+            _bindings.popitem(last=False)
+
+
+@contextmanager
+def resume(key: str, release: bool = False) -> Iterator[None]:
+    """Continues the trace bound to key, release drops the binding."""
+    with _lock:
+        ctx = _bindings.pop(key, None) if release else _bindings.get(key)
+    if ctx is None or _current.get() is not None:
+        yield
+        return
+    token = _current.set(ctx)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def traces() -> List[Dict]:
+    with _lock:
+        spans = list(_finished)
+    grouped: Dict[str, List[Span]] = {}
+    for s in spans:
+        grouped.setdefault(s.traceId, []).append(s)
+
+    summary = []
+    for traceId, items in grouped.items():
+        start = min(s.start for s in items)
+        end = max(s.end or s.start for s in items)
+        root = min(items, key=lambda s: s.start)
+        summary.append({
+            "traceId": traceId,
+            "root": root.name,
+            "startMs": start / 1e6,
+            "durationMs": (end - start) / 1e6,
+            "spans": len(items),
+            "errors": sum(1 for s in items if s.error),
+        })
+    summary.sort(key=lambda t: t["startMs"], reverse=True)
+    return summary
+
+
+def trace(traceId: str) -> List[Dict]:
+    with _lock:
+        spans = [s for s in _finished if s.traceId == traceId]
+    spans.sort(key=lambda s: s.start)
+    return [s.as_dict() for s in spans]
@@ -20,3 +20,12 @@ def get_random_name(file_path="backend/utils/server_names.txt") -> str:
 
 def now_ms():
     return time.time_ns() // 1_000_000
+
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+def parse_size(text: str):
+    """Bytes in "1048576", "500M" or "20G", None for an empty string."""
+    text = text.strip().upper().removesuffix("B")
+    if not text:
+        return None
+    return int(float(text[:-1]) * SIZE_UNITS[text[-1]]) if text[-1] in SIZE_UNITS else int(text)
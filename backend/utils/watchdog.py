@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+from backend.utils.logging import log
+
+
+# watchdog mode, e.g. VOCALINK_WATCHDOG=1 VOCALINK_WATCHDOG_MS=100
+ENABLED = os.environ.get("VOCALINK_WATCHDOG", "") not in ("", "0")
+THRESHOLD_MS = int(os.environ.get("VOCALINK_WATCHDOG_MS", "100"))
+HEARTBEAT_S = 0.02
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StallSite:
+    __slots__ = ('site', 'count', 'total', 'worst', 'stack')
+
+    def __init__(self, site: str, stack: List[str]):
+        self.site: str = site
+        self.count: int = 0
+        self.total: float = 0.0
+        self.worst: float = 0.0
+        self.stack: List[str] = stack
+
+    def as_dict(self) -> Dict:
+        return {
+            "site": self.site,
+            "count": self.count,
+            "totalMs": round(self.total * 1000, 1),
+            "worstMs": round(self.worst * 1000, 1),
+            "stack": self.stack,
+        }
+
+
+def _call_site(stack: traceback.StackSummary) -> str:
+    # innermost frame of our own code, that is the line to fix
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(PROJECT_ROOT) and "site-packages" not in path:
+            return f"{os.path.relpath(path, PROJECT_ROOT)}:{frame.lineno} {frame.name}"
+    frame = stack[-1]
+    return f"{frame.filename}:{frame.lineno} {frame.name}"
+
+
+class LoopWatchdog:
+    """Notices when the event loop stops ticking and records what it was doing.
+
+    A heartbeat task stamps the time every HEARTBEAT_S. A monitor thread checks
+    the stamp and, once it is older than the threshold, grabs the loop thread's
+    current stack. Stalls are aggregated per call site."""
+
+    def __init__(self, threshold_ms: int = THRESHOLD_MS):
+        self.threshold: float = threshold_ms / 1000
+        self._beat: float = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._sites: Dict[str, StallSite] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._running: bool = False
+
+
+    def start(self):
+        if self._task:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._running = True
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True).start()
+        log.info(f"[WATCHDOG] watching the event loop, threshold {int(self.threshold * 1000)}ms")
+
+
+    def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(HEARTBEAT_S)
+
+
+    def _capture(self) -> Optional[StallSite]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        site = _call_site(stack)
+        with self._lock:
+            entry = self._sites.get(site)
+            if entry is None:
+                entry = self._sites[site] = StallSite(site, traceback.format_list(stack[-12:]))
+            entry.count += 1
+        return entry
+
+
+    def _monitor(self):
+        while self._running:
+            time.sleep(self.threshold / 4)
+            beat = self._beat
+            if time.monotonic() - beat < self.threshold:
+                continue
+
+            entry = self._capture()
+            # wait for the loop to come back to measure the whole stall
+            while self._running and self._beat == beat:
+                time.sleep(HEARTBEAT_S)
+            stalled = max(0.0, self._beat - beat - HEARTBEAT_S)
+
+            if entry:
+                with self._lock:
+                    entry.total += stalled
+                    entry.worst = max(entry.worst, stalled)
+                log.warning(f"[WATCHDOG] event loop blocked {stalled * 1000:.0f}ms at {entry.site}")
+
+
+    def report(self) -> List[Dict]:
+        with self._lock:
+            sites = sorted(self._sites.values(), key=lambda s: s.total, reverse=True)
+            return [s.as_dict() for s in sites]
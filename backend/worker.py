@@ -0,0 +1,192 @@
+"""Media worker, runs AudioToolkit jobs for the server in a process of its own.
+
+    python -m backend.worker [--host 127.0.0.1] [--port 6211]
+
+app.py starts these next to the server and starts them again when they exit.
+Job paths are relative to the repo root, run it from there like the server.
+The protocol is described in backend/handlers/MediaHandler.py.
+"""
+import os
+
+# backend.utils.logging starts its file on import, server.log is the server's
+os.environ.setdefault("VOCALINK_LOG_FILE", "media.log")
+
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+import numpy as np
+
+import backend.core.primitives as P
+import backend.utils.audioToolkit as audioToolkit
+import backend.utils.profiler as profiler
+from backend.utils.audioToolkit import AudioToolkit, load_model
+from backend.utils.logging import log
+
+
+RETRY_SECONDS = 0.5
+GIVE_UP_SECONDS = 60 # without a server to serve, app.py starts a fresh worker anyway
+
+
+def _transcribe(audio: AudioToolkit, path: str, rid: str, regions_path: Optional[str]) -> Dict:
+    return audio.transcribe(path, rid, regions_path).model_dump()
+
+
+def _analyze(audio: AudioToolkit, path: str, regions_path: Optional[str]) -> Dict:
+    return audio.analyze(path, regions_path).model_dump()
+
+
+def _enhance(
+    audio: AudioToolkit,
+    input_path: str,
+    output_path: str,
+    props: int,
+    profile_keys: List[str],
+    stats: Optional[Dict],
+    regions_path: Optional[str]
+) -> Tuple[float, int]:
+    stats = P.RecStats.model_validate(stats) if stats else None
+    return audio.enhance(input_path, output_path, props, profile_keys, stats, regions_path)
+
+
+def _merge(audio: AudioToolkit, inputs: List[str], output: str, mode: str, stats: List[Optional[Dict]]) -> List:
+    duration, size, merged = audio.merge(
+        inputs, output, mode, [P.RecStats.model_validate(s) if s else None for s in stats]
+    )
+    return [duration, size, merged.model_dump()]
+
+
+def _read_window(path: str, start: int, length: int) -> np.ndarray:
+    with open(path, "rb") as f:
+        f.seek(start * 2)
+        data = f.read(length * 2)
+    return np.frombuffer(data, dtype=np.int16, count=len(data) // 2).astype(np.float32) / 32768
+
+
+def _live(audio: AudioToolkit, windows: List[Tuple[str, int, int, Optional[str]]]) -> Dict:
+    # windows without speech never reach the model, the rest are batched per language
+    pcm = [_read_window(path, start, length) for path, start, length, _ in windows]
+    segments: List[Optional[List[Dict]]] = [None] * len(windows)
+    languages: List[Optional[str]] = []
+    groups: Dict[str, List[int]] = {}
+    for i, (window, (_, _, _, language)) in enumerate(zip(pcm, windows)):
+        if len(window) and audio.has_speech(window):
+            language = language or audio.detect_language(window)
+            groups.setdefault(language, []).append(i)
+        languages.append(language)
+
+    for language, indexes in groups.items():
+        for i, found in zip(indexes, audio.transcribe_windows([pcm[i] for i in indexes], language)):
+            segments[i] = [s.model_dump() for s in found]
+    return {"segments": segments, "languages": languages}
+
+
+JOBS: Dict[str, Callable[..., Any]] = {
+    "transcribe": _transcribe,
+    "analyze": _analyze,
+    "enhance": _enhance,
+    "merge": _merge,
+    "live": _live,
+}
+
+
+class Reporter(audioToolkit.StageListener):
+    """Sends the stages of the running job to the server."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream: BinaryIO = stream
+        self.job: Optional[int] = None
+
+    def send(self, msg: Dict):
+        self.stream.write(json.dumps(msg).encode() + b"\n")
+        self.stream.flush()
+
+    def started(self, stage: str):
+        if self.job is not None:
+            self.send({"type": "stage", "id": self.job, "stage": stage, "start": time.time_ns(), "end": None})
+
+    def progressed(self, stage: str, done: float):
+        if self.job is not None:
+            self.send({"type": "progress", "id": self.job, "stage": stage, "done": round(done, 3)})
+
+    def finished(self, stage: str, start: int, end: int):
+        if self.job is not None:
+            self.send({"type": "stage", "id": self.job, "stage": stage, "start": start, "end": end})
+
+
+def _run(audio: AudioToolkit, reporter: Reporter, msg: Dict):
+    if msg["conf"] != audio.props.model_dump():
+        audio.props = P.ServerConf.model_validate(msg["conf"])
+        audio.sync_params()
+
+    rid, hz = msg["rid"], msg.get("profile")
+    reporter.job = msg["id"]
+    if hz:
+        profiler.arm_job(rid, hz)
+    try:
+        result = profiler.run_job(rid, JOBS[msg["job"]], audio, *msg["args"])
+        reply = {"type": "result", "id": msg["id"], "result": result, "profile": None}
+    except Exception as e:
+        log.error(f"Media job {msg['job']} for {rid} failed: {e}")
+        reply = {"type": "error", "id": msg["id"], "error": f"{type(e).__name__}: {e}"}
+    finally:
+        reporter.job = None
+
+    profile = profiler.collect_job(rid) if hz else None
+    if profile and reply["type"] == "result":
+        reply["profile"] = {
+            "samples": [[list(stack), count] for stack, count in profile.samples.items()],
+            "duration": profile.duration,
+        }
+    reporter.send(reply)
+
+
+def serve(sock: socket.socket, audio: AudioToolkit):
+    with sock.makefile("rwb") as stream:
+        reporter = Reporter(stream)
+        audioToolkit.listener = reporter
+        reporter.send({"type": "hello", "pid": os.getpid(), "key": os.environ.get("VOCALINK_MEDIA_KEY", "")})
+        for line in stream:
+            msg = json.loads(line)
+            if msg.get("type") == "job":
+                _run(audio, reporter, msg)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run media jobs for a VocalLink server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=P.MEDIA_PORT)
+    args = parser.parse_args()
+
+    # the model loads while the first cheap jobs (analyze) already run
+    threading.Thread(target=load_model, name="model-warmup", daemon=True).start()
+    audio = AudioToolkit()
+
+    served = time.monotonic()
+    while True:
+        try:
+            sock = socket.create_connection((args.host, args.port))
+        except OSError:
+            if time.monotonic() - served > GIVE_UP_SECONDS:
+                log.warning(f"No server at {args.host}:{args.port}, media worker {os.getpid()} exits.")
+                return 1
+            time.sleep(RETRY_SECONDS)
+            continue
+
+        log.info(f"Media worker {os.getpid()} serving {args.host}:{args.port}")
+        connected = time.monotonic()
+        try:
+            with sock:
+                serve(sock, audio)
+        except (OSError, ValueError) as e:
+            log.warning(f"Media worker {os.getpid()} lost the server: {e}")
+        if time.monotonic() - connected > RETRY_SECONDS:
+            served = time.monotonic() # a server that turns us away at once doesn't count
+        time.sleep(RETRY_SECONDS)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
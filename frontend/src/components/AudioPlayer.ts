@@ -2,10 +2,17 @@ import { RecMetadata, RecStates } from "../models/primitives.js";
 import { circleButton } from "./circleButton.js";
 import { button } from "./button.js";
 import { formatDuration } from "../utils/formatting.js";
-import { URL } from "../models/constants.js";
+import { server } from "../network/serverInfo.js";
 import { downloadFile } from "../utils/downloadFile.js";
 import { modalDialog } from "./modalDialog.js";
 
+// on slow or metered links, audition a small opus preview instead of the stored file
+function previewQuery(): string {
+  const connection = (navigator as any).connection;
+  const slow = connection && (connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType));
+  return slow ? '?format=opus&bitrate=48' : '';
+}
+
 export enum AudioMode {
   ORIGINAL,
   ENHANCED
@@ -184,9 +191,9 @@ export class AudioPlayer {
     const prevTime = this.audio.currentTime;
 
     if (mode === AudioMode.ENHANCED && this.meta.enhanced === RecStates.OK) {
-      this.audio.src = `${URL}/recordings/${this.meta.rid}/enhanced`;
+      this.audio.src = `${server.filesURL}/recordings/${this.meta.rid}/enhanced${previewQuery()}`;
     } else if (mode === AudioMode.ORIGINAL && this.meta.original === RecStates.OK) {
-      this.audio.src = `${URL}/recordings/${this.meta.rid}/original`;
+      this.audio.src = `${server.filesURL}/recordings/${this.meta.rid}/original${previewQuery()}`;
     }
     
     if (wasPlaying) {
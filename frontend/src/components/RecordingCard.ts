@@ -9,10 +9,16 @@ import { AudioPlayer } from "./AudioPlayer.js";
 import { EnhancePanel } from "./EnhancePanel.js";
 import { modalDialog } from "./modalDialog.js";
 import { URL } from "../models/constants.js";
+import { server } from "../network/serverInfo.js";
 import { TranscriptionSection } from "./TranscriptSection.js";
 import { MutableTextBox } from "./MutableTextBox.js";
 import { downloadFile } from "../utils/downloadFile.js";
 
+// flags from the loudness analysis the server runs after upload
+const CLIPPING_RATIO = 0.001;
+const SILENT_RATIO = 0.9;
+const QUIET_LUFS = -35;
+
 export class RecordingCard {
   public element = document.createElement('section');
   private meta: RecMetadata; 
@@ -91,6 +97,11 @@ export class RecordingCard {
       <div class="detail-row"><span>Transcript:</span>${this.meta.transcript}</div>
       <div class="detail-row"><span>Enhanced:</span>${this.meta.enhanced}</div>
       <div class="detail-row"><span>Original:</span>${this.meta.original}</div>
+      ${this.meta.stats ? `
+      <div class="detail-row"><span>Loudness:</span>${this.meta.stats.lufs ?? '-'} LUFS</div>
+      <div class="detail-row"><span>True peak:</span>${this.meta.stats.truePeak} dBTP</div>
+      <div class="detail-row"><span>Clipping:</span>${(this.meta.stats.clipping * 100).toFixed(2)}%</div>
+      <div class="detail-row"><span>Silence:</span>${Math.round(this.meta.stats.silence * 100)}%</div>` : ''}
     `;
     return pane;
   }
@@ -168,14 +179,14 @@ export class RecordingCard {
     if (OK(original)) {
       options.push({
         label: 'Original',
-        handler: () => downloadFile(`${URL}/recordings/${rid}/original`, recName)
+        handler: () => downloadFile(`${server.filesURL}/recordings/${rid}/original`, recName)
       });
     }
 
     if (OK(enhanced)) {
       options.push({
         label: 'Enhanced',
-        handler: () => downloadFile(`${URL}/recordings/${rid}/enhanced`, recName)
+        handler: () => downloadFile(`${server.filesURL}/recordings/${rid}/enhanced`, recName)
       });
     }
 
@@ -222,6 +233,15 @@ export class RecordingCard {
     if (this.meta.merged) {
       badges.push(Badge({label: 'merged', color: BadgeColors.VIOLET}));
     }
+    const stats = this.meta.stats;
+    if (stats && stats.clipping > CLIPPING_RATIO) {
+      badges.push(Badge({label: 'clipping', color: BadgeColors.RED}));
+    }
+    if (stats && stats.silence > SILENT_RATIO) {
+      badges.push(Badge({label: 'silent', color: BadgeColors.AMBER}));
+    } else if (stats && (stats.lufs == null || stats.lufs < QUIET_LUFS)) {
+      badges.push(Badge({label: 'quiet', color: BadgeColors.AMBER}));
+    }
     return badges;
   }
 
@@ -238,6 +258,7 @@ export class RecordingCard {
     this.meta.enhanced = newMeta.enhanced;
     this.meta.transcript = newMeta.transcript;
     this.meta.merged = newMeta.merged;
+    this.meta.stats = newMeta.stats;
 
     if (this.meta.original == RecStates.OK) {
       this.element.classList.remove('loading');
@@ -1,6 +1,7 @@
-import { RecMetadata, RecStates, TranscriptResult } from "../models/primitives.js";
+import { RecMetadata, RecStates, TranscriptResult, TranscriptUpdate } from "../models/primitives.js";
 import { button } from "./button.js";
 import { URL } from "../models/constants.js";
+import { server } from "../network/serverInfo.js";
 import { modalDialog } from "./modalDialog.js";
 
 export class TranscriptionSection {
@@ -11,6 +12,7 @@ export class TranscriptionSection {
   private scrollContainer?: HTMLDivElement;
   private segmentElements: HTMLSpanElement[] = [];
   private transcriptData?: TranscriptResult;
+  private pendingElement?: HTMLSpanElement; // tail of a live transcript
   
   private activeIndex: number = -1;
   private isUserScrolling: boolean = false;
@@ -34,6 +36,7 @@ export class TranscriptionSection {
 
   public render(): void {
     this.element.replaceChildren();
+    this.pendingElement = undefined;
     this.element.classList.toggle('loading', this.meta.transcript === RecStates.WORKING);
     const header = document.createElement('div');
 
@@ -75,7 +78,7 @@ export class TranscriptionSection {
     if (!this.scrollContainer) return;
 
     try {
-      const response = await fetch(`${URL}/recordings/${this.meta.rid}/transcript`);
+      const response = await fetch(`${server.filesURL}/recordings/${this.meta.rid}/transcript`);
       if (!response.ok) throw new Error("Failed to load transcript");
       
       this.transcriptData = await response.json();
@@ -106,6 +109,29 @@ export class TranscriptionSection {
     }
   }
 
+  // segments of a streamed recording while it is transcribed live
+  public live(update: TranscriptUpdate): void {
+    if (this.meta.transcript !== RecStates.WORKING || !this.scrollContainer) return;
+
+    if (!this.pendingElement) {
+      this.scrollContainer.replaceChildren();
+      this.pendingElement = document.createElement('span');
+      this.pendingElement.className = 'sentence muted';
+    }
+    for (const seg of update.segments) {
+      const span = document.createElement('span');
+      span.className = 'sentence';
+      span.innerText = seg.text + " ";
+      this.scrollContainer.appendChild(span);
+    }
+    this.pendingElement.innerText = update.pending;
+    this.scrollContainer.appendChild(this.pendingElement);
+
+    if (!this.isUserScrolling) {
+      this.scrollContainer.scrollTo({ top: this.scrollContainer.scrollHeight, behavior: 'smooth' });
+    }
+  }
+
   // --- External API for AudioPlayer --- //
   public updateTime(currentTime: number): void {
     if (!this.transcriptData || this.segmentElements.length === 0) return;
@@ -41,6 +41,7 @@ export enum WSEvents {
   REC_STAGE = "rec_stage",
   REC_STAGED = "rec_staged",
   REC_AMEND = "rec_amend",
+  REC_TRANSCRIPT = "rec_transcript",
 }
 
 export enum WSActions {
@@ -62,6 +63,7 @@ export enum WSClockSync {
   TIK = "tik",
   TOK = "tok",
   SYNC_REPORT = "sync_report",
+  SYNC_REQUEST = "sync_request",
 }
 
 export enum SessionStates {
@@ -81,7 +83,7 @@ export interface ServerConf {
   fmts: string[];
   fmtActive: number;
   noiseStrength: number;
-  amplitudeStrength: number;
+  loudnessTarget: number; // LUFS
   filterBassBoost: number;
   airBoost: number;
   compressorThreshold: number;
@@ -108,6 +110,7 @@ export interface ServerInfo {
   ip: string;
   version: string;
   activeSessions: number;
+  httpPort: number | null;
   conf: ServerConf;
 }
 
@@ -117,6 +120,14 @@ export enum RecStates {
   WORKING = "working",
 }
 
+export interface RecStats {
+  lufs?: number | null;
+  truePeak: number;
+  rms: number;
+  clipping: number;
+  silence: number;
+}
+
 export interface RecMetadata {
   rid: string;
   recName: string;
@@ -130,6 +141,7 @@ export interface RecMetadata {
   enhanced: RecStates;
   transcript: RecStates;
   merged?: string[] | null;
+  stats?: RecStats | null;
 }
 
 // ============================================
@@ -147,10 +159,12 @@ export interface Rename {
 export interface WSActionTarget {
   id: string;
   triggerTime?: number | null;
+  localTriggerTime?: number | null;
 }
 
 export interface WSEventTarget {
   id: string;
+  at?: number | null;
 }
 
 export interface StateReport {
@@ -169,6 +183,10 @@ export interface ClockSyncTok {
   t3: number;
 }
 
+export interface ClockSyncRequest {
+  rounds: number;
+}
+
 export interface ClockSyncReport {
   theta: number;
   rtt: number;
@@ -202,6 +220,7 @@ export type WSBodyTypes =
   | RecStageInfo
   | MergeRequest
   | RestAuth
+  | TranscriptUpdate
   | null;
 
 export type WSMsgTypes = WSActions | WSEvents | WSClockSync | WSErrors;
@@ -244,6 +263,12 @@ export interface TranscriptResult {
   segments: TranscriptSegment[];
 }
 
+export interface TranscriptUpdate {
+  rid: string;
+  segments: TranscriptSegment[]; // newly committed
+  pending: string; // tentative, replaced by the next update
+}
+
 // ============================================
 // ============== PAYLOAD BUILDERS ============
 // ============================================
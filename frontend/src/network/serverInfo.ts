@@ -15,6 +15,12 @@ class ServerStateManager {
     return this._info?.conf ?? null;
   }
 
+  // recordings come from the server's HTTP workers when it runs them
+  get filesURL(): string {
+    const port = this._info?.httpPort;
+    return port ? URL.replace(/:\d+$/, `:${port}`) : URL;
+  }
+
   public assignKey(key: string): void {
     this.key = key;
   }
@@ -1,4 +1,4 @@
-import { WSKind, WSEvents, WSPayload, SessionMetadata, WSEventTarget, StateReport, RecMetadata, RestAuth} from '../models/primitives.js';
+import { WSKind, WSEvents, WSPayload, SessionMetadata, WSEventTarget, StateReport, RecMetadata, RestAuth, TranscriptUpdate} from '../models/primitives.js';
 import { SessionCard } from '../components/SessionCard.js';
 import { Dashboard } from '../views/dashboard.js';
 import { Recordings } from '../views/recordings.js';
@@ -122,6 +122,11 @@ async function handleEvents({payload, refresh}: Props) {
       break;
     }
 
+    case WSEvents.REC_TRANSCRIPT: {
+      Recordings.liveTranscript(payload.body as TranscriptUpdate);
+      break;
+    }
+
 
     case WSEvents.SUCCESS: case WSEvents.FAIL:
       console.log("Session result:", payload.msgType, payload.body);
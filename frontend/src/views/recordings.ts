@@ -1,4 +1,4 @@
-import {RecMetadata } from '../models/primitives.js'
+import {RecMetadata, TranscriptUpdate } from '../models/primitives.js'
 import { RecordingCard } from '../components/RecordingCard.js';
 import { button } from '../components/button.js';
 import { checkbox } from '../components/checkbox.js';
@@ -205,6 +205,10 @@ class RecordingsView {
         this.render();
     }
 
+    public liveTranscript(update: TranscriptUpdate) {
+        this.cards.get(update.rid)?.transcriptPanel.live(update);
+    }
+
     public setDefaultName(meta: RecMetadata) {
         const card = this.cards.get(meta.rid);
         if (card) {
@@ -2,9 +2,15 @@ import { RecStates } from "../models/primitives.js";
 import { circleButton } from "./circleButton.js";
 import { button } from "./button.js";
 import { formatDuration } from "../utils/formatting.js";
-import { URL } from "../models/constants.js";
+import { server } from "../network/serverInfo.js";
 import { downloadFile } from "../utils/downloadFile.js";
 import { modalDialog } from "./modalDialog.js";
+// on slow or metered links, audition a small opus preview instead of the stored file
+function previewQuery() {
+    const connection = navigator.connection;
+    const slow = connection && (connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType));
+    return slow ? '?format=opus&bitrate=48' : '';
+}
 export var AudioMode;
 (function (AudioMode) {
     AudioMode[AudioMode["ORIGINAL"] = 0] = "ORIGINAL";
@@ -141,10 +147,10 @@ export class AudioPlayer {
         const wasPlaying = this.isPlaying;
         const prevTime = this.audio.currentTime;
         if (mode === AudioMode.ENHANCED && this.meta.enhanced === RecStates.OK) {
-            this.audio.src = `${URL}/recordings/${this.meta.rid}/enhanced`;
+            this.audio.src = `${server.filesURL}/recordings/${this.meta.rid}/enhanced${previewQuery()}`;
         }
         else if (mode === AudioMode.ORIGINAL && this.meta.original === RecStates.OK) {
-            this.audio.src = `${URL}/recordings/${this.meta.rid}/original`;
+            this.audio.src = `${server.filesURL}/recordings/${this.meta.rid}/original${previewQuery()}`;
         }
         if (wasPlaying) {
             this.audio.addEventListener('loadedmetadata', () => {
@@ -1,6 +1,7 @@
 import { RecStates } from "../models/primitives.js";
 import { button } from "./button.js";
 import { URL } from "../models/constants.js";
+import { server } from "../network/serverInfo.js";
 import { modalDialog } from "./modalDialog.js";
 export class TranscriptionSection {
     element = document.createElement('div');
@@ -9,6 +10,7 @@ export class TranscriptionSection {
     scrollContainer;
     segmentElements = [];
     transcriptData;
+    pendingElement;
     activeIndex = -1;
     isUserScrolling = false;
     scrollTimeout;
@@ -27,6 +29,7 @@ export class TranscriptionSection {
     }
     render() {
         this.element.replaceChildren();
+        this.pendingElement = undefined;
         this.element.classList.toggle('loading', this.meta.transcript === RecStates.WORKING);
         const header = document.createElement('div');
         header.className = 'transcription-header';
@@ -55,7 +58,7 @@ export class TranscriptionSection {
         if (!this.scrollContainer)
             return;
         try {
-            const response = await fetch(`${URL}/recordings/${this.meta.rid}/transcript`);
+            const response = await fetch(`${server.filesURL}/recordings/${this.meta.rid}/transcript`);
             if (!response.ok)
                 throw new Error("Failed to load transcript");
             this.transcriptData = await response.json();
@@ -82,6 +85,26 @@ export class TranscriptionSection {
             this.scrollContainer.innerHTML = `<span class="sentence muted">Failed to load transcription data.</span>`;
         }
     }
+    live(update) {
+        if (this.meta.transcript !== RecStates.WORKING || !this.scrollContainer)
+            return;
+        if (!this.pendingElement) {
+            this.scrollContainer.replaceChildren();
+            this.pendingElement = document.createElement('span');
+            this.pendingElement.className = 'sentence muted';
+        }
+        for (const seg of update.segments) {
+            const span = document.createElement('span');
+            span.className = 'sentence';
+            span.innerText = seg.text + " ";
+            this.scrollContainer.appendChild(span);
+        }
+        this.pendingElement.innerText = update.pending;
+        this.scrollContainer.appendChild(this.pendingElement);
+        if (!this.isUserScrolling) {
+            this.scrollContainer.scrollTo({ top: this.scrollContainer.scrollHeight, behavior: 'smooth' });
+        }
+    }
     updateTime(currentTime) {
         if (!this.transcriptData || this.segmentElements.length === 0)
             return;
@@ -37,6 +37,7 @@ export var WSEvents;
     WSEvents["REC_STAGE"] = "rec_stage";
     WSEvents["REC_STAGED"] = "rec_staged";
     WSEvents["REC_AMEND"] = "rec_amend";
+    WSEvents["REC_TRANSCRIPT"] = "rec_transcript";
 })(WSEvents || (WSEvents = {}));
 export var WSActions;
 (function (WSActions) {
@@ -58,6 +59,7 @@ export var WSClockSync;
     WSClockSync["TIK"] = "tik";
     WSClockSync["TOK"] = "tok";
     WSClockSync["SYNC_REPORT"] = "sync_report";
+    WSClockSync["SYNC_REQUEST"] = "sync_request";
 })(WSClockSync || (WSClockSync = {}));
 export var SessionStates;
 (function (SessionStates) {
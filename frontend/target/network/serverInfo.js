@@ -9,6 +9,11 @@ class ServerStateManager {
     get conf() {
         return this._info?.conf ?? null;
     }
+    // recordings come from the server's HTTP workers when it runs them
+    get filesURL() {
+        const port = this._info?.httpPort;
+        return port ? URL.replace(/:\d+$/, `:${port}`) : URL;
+    }
     assignKey(key) {
         this.key = key;
     }
@@ -103,6 +103,10 @@ async function handleEvents({ payload, refresh }) {
             log.info(`Recording amended.`);
             break;
         }
+        case WSEvents.REC_TRANSCRIPT: {
+            Recordings.liveTranscript(payload.body);
+            break;
+        }
         case WSEvents.SUCCESS:
         case WSEvents.FAIL:
             console.log("Session result:", payload.msgType, payload.body);
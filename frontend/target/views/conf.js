@@ -48,14 +48,14 @@ class ConfView {
             onchange: (val) => { server.updateConf({ noiseStrength: val }); }
         });
         rows.push(createConfRow({ label: 'Noise reduction strength', element: noiseSlider }));
-        const amplitudeSlider = Slider({
+        const loudnessSlider = Slider({
             min: -24,
             max: -12,
             step: 1,
-            initialValue: server.conf?.amplitudeStrength ?? -18,
-            onchange: (val) => { server.updateConf({ amplitudeStrength: val }); }
+            initialValue: server.conf?.loudnessTarget ?? -18,
+            onchange: (val) => { server.updateConf({ loudnessTarget: val }); }
         });
-        rows.push(createConfRow({ label: 'Amplitude boost strength', element: amplitudeSlider }));
+        rows.push(createConfRow({ label: 'Loudness target (LUFS)', element: loudnessSlider }));
         const bassBoostSlider = Slider({
             min: 0,
             max: 12,
@@ -178,6 +178,9 @@ class RecordingsView {
         }
         this.render();
     }
+    liveTranscript(update) {
+        this.cards.get(update.rid)?.transcriptPanel.live(update);
+    }
     setDefaultName(meta) {
         const card = this.cards.get(meta.rid);
         if (card) {
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend is imported from the repo root, like app.py runs it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+from backend.core.ClockSync import DelayAggregate, MAX_SYNC_AGE
+
+
+def test_grow():
+    agg = DelayAggregate()
+    agg.update("a", 100, 0)
+    agg.update("b", 300, 0)
+    assert agg.max_bound(0) == 300
+    agg.update("a", 500, 0)
+    assert agg.max_bound(0) == 500
+
+
+def test_shrinking_max_falls_back_to_the_next():
+    agg = DelayAggregate()
+    agg.update("a", 500, 0)
+    agg.update("b", 300, 0)
+    assert agg.max_bound(0) == 500
+    agg.update("a", 50, 0)
+    assert agg.max_bound(0) == 300
+
+
+def test_shrinking_max_that_stays_largest():
+    agg = DelayAggregate()
+    agg.update("a", 500, 0)
+    agg.update("b", 300, 0)
+    agg.update("a", 400, 0)
+    assert agg.max_bound(0) == 400
+
+
+def test_remove():
+    agg = DelayAggregate()
+    agg.update("a", 500, 0)
+    agg.update("b", 300, 0)
+    agg.remove("a")
+    assert agg.max_bound(0) == 300
+    agg.remove("b")
+    assert agg.max_bound(0) is None
+
+
+def test_expired_bounds_are_ignored():
+    agg = DelayAggregate()
+    agg.update("a", 500, 0)
+    agg.update("b", 300, 5_000)
+    assert agg.max_bound(MAX_SYNC_AGE) == 500
+    assert agg.max_bound(MAX_SYNC_AGE + 1) == 300
+    assert agg.max_bound(5_000 + MAX_SYNC_AGE + 1) is None
@@ -0,0 +1,133 @@
+import asyncio
+
+import backend.core.primitives as P
+from backend.core.LiveTranscriber import Live, LiveTranscriber, MARGIN, MAX_RETRIES, MAX_WINDOW, WHISPER_RATE
+
+
+class FakeServices:
+    def __init__(self):
+        self.updates = []
+
+    async def notify_transcript(self, update: P.TranscriptUpdate):
+        self.updates.append(update)
+
+
+class FakeMedia:
+    """Fails the first `failures` passes, then finds two segments per window."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.passes = []
+
+    async def live(self, windows):
+        self.passes.append(windows)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("worker lost")
+        segments = [[seg(0.0, 1.0, "hi"), seg(1.0, 2.0, "there")] for _ in windows]
+        return segments, ["en"] * len(windows)
+
+
+def seg(start, end, text="x"):
+    return P.TranscriptSegment(start=start, end=end, text=text)
+
+
+def live(tmp_path, rid="r", received=0):
+    pcm = open(tmp_path / f"{rid}.pcm", "wb")
+    stream = Live(rid, None, pcm)
+    stream.size = received * 2
+    return stream
+
+
+def transcriber(media=None):
+    return LiveTranscriber(None, media, FakeServices())
+
+
+def test_commit_without_speech_keeps_the_margin(tmp_path):
+    t, stream = transcriber(), live(tmp_path, received=10 * WHISPER_RATE)
+    asyncio.run(t._commit(stream, 10 * WHISPER_RATE, []))
+    assert stream.committed == 10 * WHISPER_RATE - MARGIN
+    assert stream.segments == []
+
+
+def test_commit_keeps_settled_segments(tmp_path):
+    t, stream = transcriber(), live(tmp_path, received=10 * WHISPER_RATE)
+    stream.committed = WHISPER_RATE
+    segments = [seg(0, 3), seg(3, 7.5), seg(7.5, 9)]
+    asyncio.run(t._commit(stream, 9 * WHISPER_RATE, segments))
+    # the edge is at 7s, the second segment ends past it
+    assert [(s.start, s.end) for s in stream.segments] == [(1, 4)]
+    assert stream.committed == 4 * WHISPER_RATE
+    assert t._services.updates[-1].pending == "x x"
+
+
+def test_commit_final_keeps_everything(tmp_path):
+    t, stream = transcriber(), live(tmp_path, received=5 * WHISPER_RATE)
+    stream.final = True
+    asyncio.run(t._commit(stream, 5 * WHISPER_RATE, [seg(0, 2), seg(2, 4.9)]))
+    assert len(stream.segments) == 2
+    assert stream.committed == 5 * WHISPER_RATE
+
+
+def test_commit_moves_a_full_window_on(tmp_path):
+    t, stream = transcriber(), live(tmp_path, received=2 * MAX_WINDOW)
+    asyncio.run(t._commit(stream, MAX_WINDOW, [seg(0, MAX_WINDOW / WHISPER_RATE)]))
+    assert len(stream.segments) == 1
+    assert stream.committed == MAX_WINDOW
+
+
+async def _run_until(t: LiveTranscriber, done):
+    worker = asyncio.create_task(t._work())
+    try:
+        for _ in range(200):
+            if done():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("timed out")
+    finally:
+        worker.cancel()
+
+
+def test_failed_pass_commits_nothing_and_retries(tmp_path):
+    media = FakeMedia(failures=1)
+    t, stream = transcriber(media), live(tmp_path, received=5 * WHISPER_RATE)
+
+    async def main():
+        t._enqueue(stream)
+        await _run_until(t, lambda: len(media.passes) == 2 and not stream.queued)
+
+    asyncio.run(main())
+    # both passes started from the same sample, the failure committed no silence
+    assert [w[0][1] for w in media.passes] == [0, 0]
+    assert [s.text for s in stream.segments] == ["hi"]
+    assert stream.committed == WHISPER_RATE
+    assert stream.retries == 0 and not stream.failed
+
+
+def test_failing_batch_is_split(tmp_path):
+    media = FakeMedia(failures=1)
+    t = transcriber(media)
+    a, b = live(tmp_path, "a", 5 * WHISPER_RATE), live(tmp_path, "b", 5 * WHISPER_RATE)
+
+    async def main():
+        t._enqueue(a)
+        t._enqueue(b)
+        await _run_until(t, lambda: not a.queued and not b.queued)
+
+    asyncio.run(main())
+    assert [len(p) for p in media.passes] == [2, 1, 1]
+
+
+def test_gives_up_after_max_retries(tmp_path):
+    media = FakeMedia(failures=100)
+    t, stream = transcriber(media), live(tmp_path, received=5 * WHISPER_RATE)
+    stream.final = True
+
+    async def main():
+        t._enqueue(stream)
+        await _run_until(t, stream.finished.is_set)
+
+    asyncio.run(main())
+    assert stream.failed
+    assert len(media.passes) == MAX_RETRIES + 1
+    assert stream.committed == 0
@@ -0,0 +1,22 @@
+import logging
+import queue
+
+import backend.core.primitives as P
+from backend.utils.logging import DeferredQueueHandler
+
+
+def record(msg, *args) -> logging.LogRecord:
+    return logging.LogRecord("app.ws", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_immutable_args_are_left_to_the_writer():
+    queued = DeferredQueueHandler(queue.SimpleQueue()).prepare(record("tx %s %d %s", "id", 3, P.WSKind.ACTION))
+    assert queued.args == ("id", 3, P.WSKind.ACTION)
+
+
+def test_mutable_args_are_rendered_on_enqueue():
+    target = P.WSActionTarget(id="s1")
+    queued = DeferredQueueHandler(queue.SimpleQueue()).prepare(record("rx %s", target))
+    # what broadcast_action does next
+    target.triggerTime = 123
+    assert queued.getMessage() == "rx id='s1' triggerTime=None localTriggerTime=None"
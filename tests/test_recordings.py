@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+import backend.core.primitives as P
+from backend.handlers.RecordingsHandler import RecordingsHandler
+
+
+class FakeMedia:
+    """Renders slowly, the first `failures` renders fail half written."""
+
+    def __init__(self, failures: int = 0):
+        self.conf = P.ServerConf()
+        self.failures = failures
+        self.renders = []
+
+    async def enhance(self, rid, input_path, output_path, props, profile_keys, stats, regions_path):
+        self.renders.append(rid)
+        with open(output_path, "wb") as f:
+            f.write(b"half")
+            await asyncio.sleep(0.05)
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("worker lost")
+            f.write(b" and the rest")
+        return 1.0, 17
+
+
+def handler(tmp_path, media: FakeMedia, rids=("a", "b")) -> RecordingsHandler:
+    recordings = RecordingsHandler(media, str(tmp_path / "storage"))
+    for rid in rids:
+        meta = P.RecMetadata(rid=rid, recName=f"{rid}.wav", sessionId="s", speaker="x", device="d",
+                             duration=1, sizeBytes=4, createdAt=0, original=P.RecStates.OK)
+        recordings._recordings[rid] = meta
+        temp = tmp_path / f"{rid}.upload"
+        temp.write_bytes(b"same audio")
+        recordings._store_blob(rid, "ab" * 32, str(temp), recordings._original_path(meta))
+    return recordings
+
+
+def enhanced(recordings: RecordingsHandler, rid: str) -> bytes:
+    with open(recordings._enhanced_path(recordings._recordings[rid]), "rb") as f:
+        return f.read()
+
+
+def test_a_render_in_progress_is_waited_for_not_linked(tmp_path):
+    media = FakeMedia()
+    recordings = handler(tmp_path, media)
+
+    async def run():
+        return await asyncio.gather(recordings._enhance("a", 3), recordings._enhance("b", 3))
+    a, b = asyncio.run(run())
+
+    assert media.renders == ["a"]
+    assert a.enhanced == b.enhanced == P.RecStates.OK
+    assert enhanced(recordings, "b") == b"half and the rest"
+    assert not recordings._renders
+
+
+def test_a_failed_render_is_rendered_again_by_the_waiter(tmp_path):
+    media = FakeMedia(failures=1)
+    recordings = handler(tmp_path, media)
+
+    async def run():
+        return await asyncio.gather(recordings._enhance("a", 3), recordings._enhance("b", 3))
+    a, b = asyncio.run(run())
+
+    assert media.renders == ["a", "b"]
+    assert a.enhanced == P.RecStates.NA
+    assert b.enhanced == P.RecStates.OK
+    assert enhanced(recordings, "b") == b"half and the rest"
+    # b rendered for itself alone, no shared render is left behind
+    assert not [name for name in os.listdir(os.path.dirname(recordings.blobs.path("ab" * 32)))
+                if ".enhanced-" in name]
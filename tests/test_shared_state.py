@@ -0,0 +1,40 @@
+import backend.core.primitives as P
+from backend.core.SharedState import SharedState
+
+
+def _meta(rid: str, name: str = "take") -> P.RecMetadata:
+    return P.RecMetadata(rid=rid, recName=f"{name}.m4a", sessionId="s1", speaker="a", device="d",
+                         duration=1, sizeBytes=10, createdAt=0)
+
+
+def test_queued_writes_land_in_order_by_close(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer = SharedState(path, writer=True)
+    meta = _meta("r1")
+    writer.put_recording(meta, {"original": "/o/r1.m4a"})
+    # serialized when queued, not when written
+    meta.recName = "changed.m4a"
+    writer.put_recording(_meta("r2"), {})
+    writer.drop_recording("r2")
+    writer.put_session(P.SessionMetadata(id="s1", name="n", ip="1.2.3.4", device="d"))
+    writer.close()
+
+    reader = SharedState(path)
+    found, paths = reader.recording("r1")
+    assert found.recName == "take.m4a"
+    assert paths["original"] == "/o/r1.m4a"
+    assert reader.recording("r2") is None
+    assert '"id":"s1"' in reader.sessions_json()
+    reader.close()
+
+
+def test_a_failed_write_loses_only_itself(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer = SharedState(path, writer=True)
+    writer._writes.put(("INSERT INTO nowhere VALUES (1)", ()))
+    writer.put_recording(_meta("r1"), {})
+    writer.close()
+
+    reader = SharedState(path)
+    assert reader.recording("r1") is not None
+    reader.close()
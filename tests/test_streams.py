@@ -0,0 +1,105 @@
+import asyncio
+
+import backend.core.primitives as P
+import backend.handlers.StreamHandler as S
+from backend.handlers.StreamHandler import Stream, StreamHandler
+
+
+class FakeRecordings:
+    def __init__(self, spool=None):
+        self.spooled = spool
+        self.originals = {}
+
+    async def spool(self, rid):
+        return self.spooled
+
+    async def set_original(self, rid, state):
+        self.originals[rid] = state
+
+    async def get_meta(self, rid):
+        return None
+
+
+class FakeSessions:
+    async def getMetaFromActive(self, id):
+        return object()
+
+
+class FakeLive:
+    def __init__(self):
+        self.cancelled = []
+
+    async def cancel(self, rid):
+        self.cancelled.append(rid)
+
+
+class FakeServices:
+    async def notify_amend(self, meta):
+        pass
+
+
+def handler(recordings: FakeRecordings, live: FakeLive) -> StreamHandler:
+    return StreamHandler(recordings, FakeSessions(), FakeServices(), live)
+
+
+def paused(streams: StreamHandler, tmp_path, rid="r") -> Stream:
+    spool = tmp_path / f"{rid}.part"
+    spool.write_bytes(b"chunks")
+    stream = streams._streams[rid] = Stream(rid, "s", str(spool))
+    return stream
+
+
+def test_a_stream_left_paused_is_given_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(S, "PAUSED_SECONDS", 0)
+    recordings, live = FakeRecordings(), FakeLive()
+    streams = handler(recordings, live)
+    stream = paused(streams, tmp_path)
+    stream.paused = 1.0
+
+    asyncio.run(streams._expire(stream, 1.0))
+    assert not streams._streams
+    assert live.cancelled == ["r"]
+    assert recordings.originals == {"r": P.RecStates.NA}
+    assert not (tmp_path / "r.part").exists()
+
+
+def test_a_resumed_stream_is_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(S, "PAUSED_SECONDS", 0)
+    recordings, live = FakeRecordings(), FakeLive()
+    streams = handler(recordings, live)
+    stream = paused(streams, tmp_path)
+    stream.paused = 2.0 # paused again since, that pause has its own expiry
+
+    asyncio.run(streams._expire(stream, 1.0))
+    assert streams._streams == {"r": stream}
+    assert not live.cancelled
+    assert (tmp_path / "r.part").exists()
+
+
+def test_resuming_a_stream_whose_spool_went_cancels_it(tmp_path):
+    recordings, live = FakeRecordings(spool=None), FakeLive()
+    streams = handler(recordings, live)
+    paused(streams, tmp_path)
+
+    assert asyncio.run(streams._open("s", "", "r")) is None
+    assert not streams._streams
+    assert live.cancelled == ["r"]
+
+
+def test_a_failing_live_feed_fails_the_stream_not_the_writer(tmp_path):
+    class BrokenLive(FakeLive):
+        async def feed(self, rid, chunks):
+            raise RuntimeError("decoder gone")
+
+    streams = handler(FakeRecordings(), BrokenLive())
+    stream = paused(streams, tmp_path)
+
+    async def run():
+        stream.file = open(stream.path, "ab")
+        writer = asyncio.create_task(streams._write(stream))
+        await stream.queue.put(b"more")
+        await asyncio.wait_for(stream.queue.join(), 1)
+        writer.cancel()
+        stream.file.close()
+    asyncio.run(run())
+    assert stream.failed
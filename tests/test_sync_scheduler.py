@@ -0,0 +1,42 @@
+import asyncio
+
+import backend.core.SyncScheduler as S
+from backend.core.SyncScheduler import SyncScheduler
+
+
+class FakeSessions:
+    def __init__(self, last_sync: int):
+        self.last_sync = last_sync
+
+    async def clock_states(self):
+        return [("s1", self.last_sync, 0.0, 0.0)]
+
+
+def planned(scheduler: SyncScheduler) -> int:
+    """Runs two ticks, the first one only discovers the session."""
+    asyncio.run(scheduler._tick())
+    scheduler._seen.clear()
+    asyncio.run(scheduler._tick())
+    return scheduler._due["s1"] - scheduler._sessions.last_sync
+
+
+def test_an_idle_group_backs_off():
+    scheduler = SyncScheduler(FakeSessions(S.now_ms()), None)
+    assert planned(scheduler) > S.ARMED_INTERVAL * (1 + S.SPREAD)
+
+
+def test_a_recording_session_keeps_estimates_fresh():
+    scheduler = SyncScheduler(FakeSessions(S.now_ms()), None)
+    scheduler.recording("s1", True)
+    assert planned(scheduler) <= S.ARMED_INTERVAL * (1 + S.SPREAD)
+
+
+def test_a_staged_action_arms_until_acknowledged_or_past():
+    scheduler = SyncScheduler(FakeSessions(S.now_ms()), None)
+    scheduler.staged(["s1"], S.now_ms() + 500)
+    assert scheduler._is_armed(S.now_ms())
+    scheduler.recording("s1", False)
+    assert not scheduler._is_armed(S.now_ms())
+
+    scheduler.staged(["s1"], S.now_ms() - S.MAX_SYNC_AGE)
+    assert not scheduler._is_armed(S.now_ms())
@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from pydub import AudioSegment
+
+from backend.core.Transcodes import TranscodeCache
+
+
+def _respond(cache: TranscodeCache, src: str, format, bitrate):
+    async def run():
+        try:
+            return await cache.response(src, "take", format, bitrate)
+        finally:
+            # the encode ends on its own, raising nothing
+            for task in list(cache._encoding.values()):
+                assert await task is None
+    return asyncio.run(run())
+
+
+def test_missing_encoder_fails_cleanly(tmp_path, monkeypatch):
+    monkeypatch.setattr(AudioSegment, "converter", str(tmp_path / "no-ffmpeg"))
+    src = tmp_path / "take.wav"
+    src.write_bytes(b"RIFF")
+    cache = TranscodeCache(str(tmp_path))
+
+    with pytest.raises(HTTPException) as e:
+        _respond(cache, str(src), "opus", None)
+    assert e.value.status_code == 500
+    assert os.listdir(cache.dir) == []
+
+
+def test_unknown_stored_format_is_refused_before_encoding(tmp_path):
+    src = tmp_path / "take.flac"
+    src.write_bytes(b"fLaC")
+    cache = TranscodeCache(str(tmp_path))
+
+    with pytest.raises(HTTPException) as e:
+        _respond(cache, str(src), None, 64)
+    assert e.value.status_code == 400
+    assert os.listdir(cache.dir) == []
@@ -0,0 +1,22 @@
+import pytest
+
+from backend.utils.utils import parse_size
+
+
+@pytest.mark.parametrize("text, size", [
+    ("", None),
+    ("  ", None),
+    ("1048576", 1048576),
+    ("500M", 500 * 1024 ** 2),
+    ("500mb", 500 * 1024 ** 2),
+    ("1.5G", int(1.5 * 1024 ** 3)),
+    (" 20G ", 20 * 1024 ** 3),
+])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize("text", ["lots", "5X", "M", "1.5"])
+def test_parse_size_rejects(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
@@ -0,0 +1,462 @@
+"""Benchmarks for AudioToolkit on deterministic synthetic audio.
+
+Fixtures are speech-like (voiced syllables over a quiet noise floor) or
+pure noise, generated from a fixed seed and cached, then encoded with the
+same ffmpeg settings the toolkit exports with. Every case runs in a fresh
+process so peak RSS belongs to that case alone. Denoise cases also report
+the SNR against the clean speech before and after noise reduction.
+
+    python -m tools.audiobench run --out bench.json
+    python -m tools.audiobench run --quick --only enhance --out quick.json
+    python -m tools.audiobench run --durations 60 --only denoise --out denoise.json
+    python -m tools.audiobench compare base.json bench.json
+
+Run it from the repository root.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 10
+SEED = 1234
+FORMATS = ("wav", "m4a", "ogg")
+DURATIONS = (60, 600, 3600)
+KINDS = ("speech", "noise")
+NOISE_LEVELS = {"clean": 0.0, "speech": 0.01, "noisy": 0.05, "sparse": 0.01, "sparse-clean": 0.0} # noise floor under the speech kinds
+SPARSE_BLOCKS = (2, 10) # sparse kinds talk in 2 of every 10 blocks, a phone left running in a break
+DENOISE_MODES = ("nonstationary", "profile-cold", "profile-warm")
+FIXTURE_VERSION = 2
+MERGE_INPUTS = (2, 4, 8, 16)
+MERGE_MODES = ("overlap", "concat")
+ENHANCE_PROPS = {"amplify": 1, "reduce_noise": 2, "studio_filter": 4} # mirrors P.EnhanceProps
+
+# compare flags a case when it got this much slower or bigger, and by more than the floor
+THRESHOLD = 0.10
+FLOORS = {"wall": 0.05, "cpu": 0.05, "peakRssMB": 5.0}
+SNR_DROP_DB = 0.5 # denoise cases: flag when output SNR drops by more than this
+
+
+def fixture_dir() -> str:
+    return os.environ.get("VOCALINK_BENCH_FIXTURES", os.path.join(tempfile.gettempdir(), "vocalink-bench"))
+
+
+# ---- synthetic signals, generated block by block so an hour never sits in memory
+
+
+def _speech_block(rng: np.random.Generator, n: int, state: Dict) -> np.ndarray:
+    # syllables of a few voiced harmonics shaped by two moving formants,
+    # separated by short gaps and longer phrase pauses
+    out = np.zeros(n)
+    i = 0
+    while i < n:
+        if state["gap"] > 0:
+            take = min(state["gap"], n - i)
+            state["gap"] -= take
+            i += take
+            continue
+
+        length = int(rng.uniform(0.12, 0.3) * SAMPLE_RATE)
+        length = min(length, n - i)
+        t = np.arange(length) / SAMPLE_RATE
+        f0 = state["f0"] * (1 + 0.08 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+        f1, f2 = rng.uniform(300, 900), rng.uniform(900, 2500)
+
+        voiced = np.zeros(length)
+        for h in range(1, 11):
+            freq = state["f0"] * h
+            gain = np.exp(-((freq - f1) / 200) ** 2) + 0.6 * np.exp(-((freq - f2) / 300) ** 2) + 0.05
+            voiced += gain * np.sin(h * phase)
+        envelope = np.sin(np.pi * np.arange(length) / max(length, 1)) ** 2
+        out[i:i + length] = 0.25 * voiced * envelope / 3
+
+        i += length
+        state["f0"] = float(np.clip(state["f0"] + rng.normal(0, 8), 90, 240))
+        phrase_end = rng.random() < 0.12
+        state["gap"] = int((rng.uniform(0.4, 1.2) if phrase_end else rng.uniform(0.03, 0.12)) * SAMPLE_RATE)
+    return out
+
+
+def _noise_block(rng: np.random.Generator, n: int, start: int, level: float) -> np.ndarray:
+    # pinkish noise (white noise with a 1/sqrt(f) spectrum) plus mains hum
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    freqs = np.fft.rfftfreq(n, 1 / SAMPLE_RATE)
+    spectrum[1:] /= np.sqrt(freqs[1:] / freqs[1])
+    pink = np.fft.irfft(spectrum, n)
+    pink *= level / (np.std(pink) or 1)
+    t = (start + np.arange(n)) / SAMPLE_RATE
+    return pink + 0.3 * level * np.sin(2 * np.pi * 50 * t)
+
+
+def _blocks(kind: str, seconds: int, channels: int) -> Iterator[np.ndarray]:
+    # separate generators, so "clean" is exactly the speech inside "speech" and "noisy"
+    speech_rng = np.random.default_rng(SEED)
+    noise_rng = np.random.default_rng(SEED + 1)
+    states = [{"f0": 120.0 + 60 * c, "gap": 0} for c in range(channels)]
+    total = seconds * SAMPLE_RATE
+    for start in range(0, total, BLOCK_SECONDS * SAMPLE_RATE):
+        n = min(BLOCK_SECONDS * SAMPLE_RATE, total - start)
+        block = []
+        for c in range(channels):
+            if kind == "noise":
+                block.append(_noise_block(noise_rng, n, start, 0.1))
+                continue
+            signal = _speech_block(speech_rng, n, states[c])
+            if kind.startswith("sparse") and start // (BLOCK_SECONDS * SAMPLE_RATE) % SPARSE_BLOCKS[1] >= SPARSE_BLOCKS[0]:
+                signal[:] = 0
+            if NOISE_LEVELS[kind]:
+                signal += _noise_block(noise_rng, n, start, NOISE_LEVELS[kind])
+            block.append(signal)
+        yield np.clip(np.stack(block, axis=1), -1, 1)
+
+
+def fixture(kind: str, seconds: int, channels: int, fmt: str) -> str:
+    """Path of the fixture, generated and encoded on first use."""
+    os.makedirs(fixture_dir(), exist_ok=True)
+    name = f"{kind}-{seconds}s-{channels}ch-v{FIXTURE_VERSION}"
+    wav = os.path.join(fixture_dir(), f"{name}.wav")
+    if not os.path.exists(wav):
+        tmp = wav + ".tmp"
+        with wave.open(tmp, "wb") as w:
+            w.setnchannels(channels)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            for block in _blocks(kind, seconds, channels):
+                w.writeframes((block * 32767).astype("<i2").tobytes())
+        os.replace(tmp, wav)
+
+    if fmt == "wav":
+        return wav
+
+    from pydub import AudioSegment
+    from backend.utils.audioToolkit import SUPPORTED_FORMATS
+
+    path = os.path.join(fixture_dir(), f"{name}.{fmt}")
+    if not os.path.exists(path):
+        config = SUPPORTED_FORMATS[f".{fmt}"]
+        tmp = f"{path}.tmp.{fmt}"
+        subprocess.run(
+            [AudioSegment.converter, "-y", "-loglevel", "error", "-i", wav,
+             "-c:a", config["codec"], "-b:a", config["bitrate"], "-f", config["format"], tmp],
+            check=True,
+        )
+        os.replace(tmp, path)
+    return path
+
+
+# ---- cases
+
+
+def plan(args: argparse.Namespace) -> List[Dict]:
+    cases = []
+    for kind, seconds, channels, fmt in itertools.product(args.kinds, args.durations, args.channels, args.formats):
+        for r in range(len(ENHANCE_PROPS) + 1):
+            for combo in itertools.combinations(ENHANCE_PROPS, r):
+                props = sum(ENHANCE_PROPS[c] for c in combo)
+                label = "+".join(combo) or "passthrough"
+                cases.append({
+                    "case": f"enhance/{label}/{kind}/{seconds}s/{channels}ch/{fmt}",
+                    "op": "enhance", "props": props,
+                    "inputs": [(kind, seconds, channels, fmt)], "audioSeconds": seconds,
+                })
+        cases.append({
+            "case": f"analyze/{kind}/{seconds}s/{channels}ch/{fmt}",
+            "op": "analyze",
+            "inputs": [(kind, seconds, channels, fmt)], "audioSeconds": seconds,
+        })
+
+    for mode, count, fmt in itertools.product(MERGE_MODES, args.merge_inputs, args.formats):
+        seconds = args.merge_seconds
+        cases.append({
+            "case": f"merge/{mode}/{count}x{seconds}s/{fmt}",
+            "op": "merge", "mode": mode,
+            "inputs": [("speech", seconds, 1, fmt)] * count,
+            "audioSeconds": seconds * (count if mode == "concat" else 1),
+        })
+
+    for mode, seconds in itertools.product(DENOISE_MODES, args.durations):
+        # noisy input, clean reference, and for the warm case an earlier
+        # recording of the same room to learn the profile from
+        inputs = [("noisy", seconds, 1, "wav"), ("clean", seconds, 1, "wav")]
+        if mode == "profile-warm":
+            inputs.append(("noisy", BLOCK_SECONDS, 1, "wav"))
+        cases.append({
+            "case": f"denoise/{mode}/{seconds}s",
+            "op": "denoise", "mode": mode,
+            "inputs": inputs, "audioSeconds": seconds,
+        })
+        if mode == "profile-cold":
+            # mostly silence, only the speech regions should go through the gate
+            cases.append({
+                "case": f"denoise/{mode}/sparse/{seconds}s",
+                "op": "denoise", "mode": mode,
+                "inputs": [("sparse", seconds, 1, "wav"), ("sparse-clean", seconds, 1, "wav")],
+                "audioSeconds": seconds,
+            })
+
+    for seconds, fmt in itertools.product(args.durations, args.formats):
+        cases.append({
+            "case": f"transcribe/{seconds}s/1ch/{fmt}",
+            "op": "transcribe",
+            "inputs": [("speech", seconds, 1, fmt)], "audioSeconds": seconds,
+        })
+    for seconds in args.durations:
+        cases.append({
+            "case": f"transcribe/sparse/{seconds}s/1ch/wav",
+            "op": "transcribe",
+            "inputs": [("sparse", seconds, 1, "wav")], "audioSeconds": seconds,
+        })
+
+    if args.only:
+        pattern = re.compile(args.only)
+        cases = [c for c in cases if pattern.search(c["case"])]
+    return cases
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 2**20
+
+
+def _snr_db(clean: np.ndarray, signal: np.ndarray) -> float:
+    n = min(len(clean), len(signal))
+    error = np.sum((signal[:n] - clean[:n]) ** 2)
+    return float(10 * np.log10(np.sum(clean[:n] ** 2) / max(error, 1e-12)))
+
+
+def _cpu_seconds() -> float:
+    # ffmpeg runs as a child of the case, count it too
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _run_case(case: Dict, paths: List[str], conn):
+    # child process entry point
+    try:
+        from backend.utils.audioToolkit import AudioToolkit, load_model
+        from pydub import AudioSegment
+
+        def pcm(audio: AudioSegment) -> np.ndarray:
+            return np.array(audio.get_array_of_samples(), dtype=np.float64) / 32768
+
+        toolkit = AudioToolkit()
+        out_dir = tempfile.mkdtemp(prefix="vocalink-bench-")
+        ext = os.path.splitext(paths[0])[1]
+        output = os.path.join(out_dir, f"out{ext}")
+        extra = {}
+
+        if case["op"] == "transcribe":
+            started = time.perf_counter()
+            load_model()
+            extra["loadSeconds"] = time.perf_counter() - started
+
+        if case["op"] == "denoise":
+            noisy = AudioSegment.from_file(paths[0])
+            keys = () if case["mode"] == "nonstationary" else ("bench",)
+            if case["mode"] == "profile-warm":
+                toolkit._reduce_noise(AudioSegment.from_file(paths[2]), keys)
+
+        baseline = _peak_rss_mb()
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        if case["op"] == "enhance":
+            toolkit.enhance(paths[0], output, case["props"])
+        elif case["op"] == "merge":
+            toolkit.merge(paths, output, case["mode"])
+        elif case["op"] == "analyze":
+            extra["lufs"] = toolkit.analyze(paths[0]).lufs
+        elif case["op"] == "denoise":
+            denoised = toolkit._reduce_noise(noisy, keys, adaptive=case["mode"] != "nonstationary")
+        else:
+            extra["segments"] = len(toolkit.transcribe(paths[0], "bench").segments)
+        wall, cpu = time.perf_counter() - wall, _cpu_seconds() - cpu
+
+        if case["op"] == "denoise":
+            clean = pcm(AudioSegment.from_file(paths[1]))
+            extra["snrIn"] = _snr_db(clean, pcm(noisy))
+            extra["snrOut"] = _snr_db(clean, pcm(denoised))
+
+        if os.path.exists(output):
+            extra["outputBytes"] = os.path.getsize(output)
+            os.remove(output)
+        os.rmdir(out_dir)
+
+        conn.send({
+            "wall": wall,
+            "cpu": cpu,
+            "peakRssMB": _peak_rss_mb(),
+            "baselineRssMB": baseline,
+            **extra,
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_case(case: Dict, paths: List[str]) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(case, paths, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": f"worker exited with {proc.exitcode}"}
+    proc.join()
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args: argparse.Namespace):
+    from backend.utils.audioToolkit import model_size
+
+    cases = plan(args)
+    print(f"[*] {len(cases)} cases, fixtures in {fixture_dir()}")
+    results = []
+    for n, case in enumerate(cases, 1):
+        paths = [fixture(*spec) for spec in case["inputs"]]
+        runs = [run_case(case, paths) for _ in range(args.repeat)]
+        errors = [r["error"] for r in runs if "error" in r]
+        entry = {k: v for k, v in case.items() if k not in ("inputs", "op")}
+        if errors:
+            entry["error"] = errors[0]
+            print(f"[{n}/{len(cases)}] {case['case']}: {errors[0]}")
+        else:
+            # medians damp noisy neighbours, the runs stay in the file
+            for key in ("wall", "cpu", "peakRssMB"):
+                entry[key] = statistics.median(r[key] for r in runs)
+            entry["rtf"] = entry["wall"] / case["audioSeconds"]
+            quality = ""
+            if "snrOut" in runs[0]:
+                entry["snrIn"], entry["snrOut"] = runs[0]["snrIn"], runs[0]["snrOut"]
+                quality = f", snr {entry['snrIn']:.1f} -> {entry['snrOut']:.1f}dB"
+            entry["runs"] = runs
+            print(f"[{n}/{len(cases)}] {case['case']}: {entry['wall']:.2f}s wall, "
+                  f"{entry['cpu']:.2f}s cpu, {entry['peakRssMB']:.0f}MB peak, rtf {entry['rtf']:.3f}{quality}")
+        results.append(entry)
+
+    report = {
+        "meta": {
+            "createdAt": int(time.time()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "model": model_size,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[*] wrote {args.out}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.base, encoding="utf-8") as f:
+        base = {r["case"]: r for r in json.load(f)["results"]}
+    with open(args.new, encoding="utf-8") as f:
+        new = {r["case"]: r for r in json.load(f)["results"]}
+
+    regressions: List[Tuple[str, str, float, float]] = []
+    print(f"{'case':60} {'metric':10} {'base':>10} {'new':>10} {'change':>8}")
+    for case in sorted(base.keys() & new.keys()):
+        old_r, new_r = base[case], new[case]
+        if "error" in old_r or "error" in new_r:
+            if "error" in new_r and "error" not in old_r:
+                regressions.append((case, "error", 0, 0))
+                print(f"{case:60} {'error':10} {'':>10} {'':>10} {'FAILED':>8}")
+            continue
+        for metric, floor in FLOORS.items():
+            a, b = old_r[metric], new_r[metric]
+            change = (b - a) / a if a else 0.0
+            flag = change > args.threshold and b - a > floor
+            if flag:
+                regressions.append((case, metric, a, b))
+            if flag or args.verbose:
+                print(f"{case:60} {metric:10} {a:10.2f} {b:10.2f} {change:+7.0%}{' !' if flag else ''}")
+        if "snrOut" in old_r and "snrOut" in new_r:
+            a, b = old_r["snrOut"], new_r["snrOut"]
+            flag = a - b > SNR_DROP_DB
+            if flag:
+                regressions.append((case, "snrOut", a, b))
+            if flag or args.verbose:
+                print(f"{case:60} {'snrOut':10} {a:10.2f} {b:10.2f} {b - a:+6.1f}dB{' !' if flag else ''}")
+
+    missing = base.keys() - new.keys()
+    if missing:
+        print(f"{len(missing)} case(s) of {args.base} were not run in {args.new}")
+
+    print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def _ints(value: str) -> Tuple[int, ...]:
+    return tuple(int(v) for v in value.split(","))
+
+
+def _strs(value: str) -> Tuple[str, ...]:
+    return tuple(v.strip() for v in value.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AudioToolkit on synthetic audio.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="run the benchmark matrix")
+    p.add_argument("--out", default="bench.json")
+    p.add_argument("--durations", type=_ints, default=DURATIONS, help="seconds, e.g. 60,600,3600")
+    p.add_argument("--channels", type=_ints, default=(1, 2))
+    p.add_argument("--formats", type=_strs, default=FORMATS)
+    p.add_argument("--kinds", type=_strs, default=KINDS)
+    p.add_argument("--merge-inputs", type=_ints, default=MERGE_INPUTS)
+    p.add_argument("--merge-seconds", type=int, default=60, help="length of every merge input")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--only", help="regex on case names, e.g. '^enhance/.*60s'")
+    p.add_argument("--quick", action="store_true", help="1 minute, mono, wav only")
+
+    c = sub.add_parser("compare", help="flag regressions between two runs")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=THRESHOLD)
+    c.add_argument("--verbose", action="store_true", help="print every metric, not only regressions")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(compare(args))
+
+    if args.quick:
+        args.durations, args.channels, args.formats = (60,), (1,), ("wav",)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
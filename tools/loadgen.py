@@ -0,0 +1,651 @@
+"""Synthetic load for a local VocalLink server.
+
+Simulates many phone sessions and one dashboard over localhost sockets:
+sessions are staged and activated like the app does, answer clock sync
+rounds on /ws/sync, send battery updates, follow START_ALL / STOP_ALL and
+upload a synthetic recording after every stop, or stream it on /ws/stream
+while recording with --stream.
+
+    python -m tools.loadgen --sessions 50 --rounds 3
+    python -m tools.loadgen --spawn --sessions 200 --json load.json
+    python -m tools.loadgen --stream --shuffle 0.05 --record-seconds 30
+    python -m tools.loadgen --spawn --http-workers 4 --downloads 32
+
+With --downloads a dashboard-like client keeps that many downloads of stored
+originals running through each round, from the HTTP workers when --http-port
+(or --spawn --http-workers) points there, so broadcast latency shows what
+downloads cost the control loop.
+"""
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+import uuid
+import wave
+
+import httpx
+import numpy as np
+import psutil
+import websockets
+
+import backend.core.primitives as P
+
+
+# mirrors the binary frames in backend/handlers/SyncHandler.py
+FRAME_TIK = 0x01
+FRAME_TOK = 0x02
+FRAME_REPORT = 0x03
+FRAME_REQUEST = 0x04
+TIK = struct.Struct("!Bq")
+TOK = struct.Struct("!Bqqq")
+REPORT = struct.Struct("!Bdd")
+REQUEST = struct.Struct("!BB")
+
+# mirrors the binary frames in backend/handlers/StreamHandler.py
+FRAME_OPENED = 0x01
+FRAME_CHUNK = 0x02
+FRAME_ACK = 0x03
+FRAME_END = 0x04
+FRAME_DONE = 0x05
+OPENED = struct.Struct("!B16sI")
+CHUNK = struct.Struct("!BI")
+ACK = struct.Struct("!BI")
+END = struct.Struct("!BII")
+DONE = struct.Struct("!BI")
+STREAM_WINDOW = 64
+CHUNK_BYTES = 16 * 1024
+
+SAMPLE_RATE = 16000
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summary(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def synthetic_wav(seconds: float, seed: int) -> bytes:
+    # a voice-ish tone with some noise, deterministic per session
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.3 * np.sin(2 * np.pi * (180 + seed % 60) * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    signal += 0.02 * rng.standard_normal(t.size)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+class Results:
+    def __init__(self):
+        self.broadcast: List[float] = [] # ms, dashboard send -> session receive
+        self.skew: List[Dict] = [] # per START_ALL round
+        self.uploads: List[Tuple[float, float]] = [] # perf_counter start, end (stop to DONE when streaming)
+        self.upload_bytes: int = 0
+        self.upload_wall: float = 0.0 # first start to last end, summed over rounds
+        self.stored: List[str] = [] # rids with an original to download
+        self.downloads: List[float] = [] # seconds per download
+        self.download_bytes: int = 0
+        self.download_wall: float = 0.0
+        self.failures: Dict[str, int] = {}
+        self.sync_rounds: int = 0
+
+    def fail(self, what: str):
+        self.failures[what] = self.failures.get(what, 0) + 1
+
+
+class FakeSession:
+    """One phone: its own clock (true time + offset), a control socket and a sync socket."""
+
+    def __init__(self, index: int, base: str, results: Results, args: argparse.Namespace, files: str):
+        self.index = index
+        self.base = base
+        self.files = files # where recordings are uploaded, the server or its HTTP workers
+        self.results = results
+        self.args = args
+        self.offset: int = random.randint(-args.max_offset, args.max_offset)
+        self.battery: int = random.randint(40, 100)
+        self.meta: Optional[Dict] = None
+        self.control = None
+        self.sync = None
+        self.staged: asyncio.Queue = asyncio.Queue()
+        self.fired: Dict[str, float] = {} # msgType, true ms the action took effect
+        self.sent_at: Optional[float] = None # set by the dashboard before each broadcast
+        self.tasks: List[asyncio.Task] = []
+        # rendered up front, encoding on the loop would delay the other sessions' triggers
+        self.audio: bytes = synthetic_wav(args.record_seconds, index)
+        self._tok: asyncio.Queue = asyncio.Queue()
+        self._syncing = asyncio.Lock()
+        self._stopped: Optional[asyncio.Event] = None # set while a stream runs
+
+    def clock(self) -> int:
+        return int(time.time() * 1000) + self.offset
+
+
+    async def connect(self, http: httpx.AsyncClient):
+        res = await http.post(f"http://{self.base}/sessions", json={
+            "id": "", "name": f"load-{self.index}", "ip": "127.0.0.1", "device": "loadgen",
+        })
+        res.raise_for_status()
+        self.meta = res.json()
+
+        self.control = await websockets.connect(f"ws://{self.base}/ws/control", max_size=None)
+        await self.control.send(json.dumps({
+            "kind": P.WSKind.EVENT.value,
+            "msgType": P.WSEvents.SESSION_ACTIVATE.value,
+            "body": {"id": self.meta["id"]},
+        }))
+        reply = json.loads(await self.control.recv())
+        if reply.get("msgType") != P.WSEvents.SESSION_ACTIVATED.value:
+            raise RuntimeError(f"activation failed: {reply}")
+
+        self.sync = await websockets.connect(f"ws://{self.base}/ws/sync?id={self.meta['id']}")
+        self.tasks = [
+            asyncio.create_task(self._control_loop()),
+            asyncio.create_task(self._sync_loop()),
+            asyncio.create_task(self._battery_loop()),
+        ]
+
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for ws in (self.control, self.sync):
+            if ws:
+                await ws.close()
+
+
+    async def _send_event(self, msgType: P.WSEvents, body: Dict):
+        await self.control.send(json.dumps({"kind": P.WSKind.EVENT.value, "msgType": msgType.value, "body": body}))
+
+
+    async def _control_loop(self):
+        async for raw in self.control:
+            received = time.perf_counter()
+            msg = json.loads(raw)
+            kind, msgType, body = msg.get("kind"), msg.get("msgType"), msg.get("body") or {}
+
+            if kind == P.WSKind.ACTION.value:
+                if self.sent_at is not None:
+                    self.results.broadcast.append((received - self.sent_at) * 1000)
+                asyncio.create_task(self._act(msgType, body))
+            elif kind == P.WSKind.EVENT.value and msgType == P.WSEvents.REC_STAGED.value:
+                self.staged.put_nowait(body)
+            elif kind == P.WSKind.SYNC.value and msgType == P.WSClockSync.SYNC_REQUEST.value:
+                await self._sync_rounds(body.get("rounds", 1))
+            elif kind == P.WSKind.ERROR.value:
+                self.results.fail(f"error:{msgType}")
+
+
+    async def _act(self, msgType: str, body: Dict):
+        local = body.get("localTriggerTime")
+        if local is not None:
+            await asyncio.sleep(max(0, local - self.clock()) / 1000)
+        at = self.clock()
+        self.fired[msgType] = at - self.offset
+
+        if msgType == P.WSActions.START.value:
+            await self._send_event(P.WSEvents.STARTED, {"id": self.meta["id"], "at": at})
+            if self.args.stream:
+                self._stopped = asyncio.Event()
+                asyncio.create_task(self._stream(self._stopped))
+        elif msgType == P.WSActions.STOP.value:
+            await self._send_event(P.WSEvents.STOPPED, {"id": self.meta["id"], "at": at})
+            if self._stopped:
+                self._stopped.set()
+                self._stopped = None
+            else:
+                await self._upload()
+
+
+    async def _stream(self, stopped: asyncio.Event):
+        # paced like a recorder while running, the rest goes out at once after stop
+        audio = self.audio
+        chunks = [audio[i:i + CHUNK_BYTES] for i in range(0, len(audio), CHUNK_BYTES)]
+        interval = self.args.record_seconds / len(chunks)
+        acked = 0
+        moved = asyncio.Event()
+        done = asyncio.Event()
+
+        async def read(ws):
+            nonlocal acked
+            async for frame in ws:
+                if frame[0] == FRAME_ACK and len(frame) == ACK.size:
+                    acked = max(acked, ACK.unpack(frame)[1])
+                    moved.set()
+                elif frame[0] == FRAME_DONE and len(frame) == DONE.size:
+                    done.set()
+
+        try:
+            async with websockets.connect(
+                f"ws://{self.base}/ws/stream?id={self.meta['id']}&recName=load-{self.index}.wav", max_size=None
+            ) as ws:
+                frame = await ws.recv()
+                if frame[0] != FRAME_OPENED or len(frame) != OPENED.size:
+                    raise RuntimeError("stream not opened")
+                rid = str(uuid.UUID(bytes=OPENED.unpack(frame)[1]))
+                reader = asyncio.create_task(read(ws))
+
+                seq = 0
+                while seq < len(chunks):
+                    while seq >= acked + STREAM_WINDOW:
+                        moved.clear()
+                        await moved.wait()
+                    order = [seq]
+                    # a later chunk first and this one twice, like a flaky network would
+                    if seq + 1 < len(chunks) and random.random() < self.args.shuffle:
+                        order = [seq + 1, seq, seq]
+                    for s in order:
+                        await ws.send(CHUNK.pack(FRAME_CHUNK, s) + chunks[s])
+                    sent = max(order) + 1 - seq
+                    seq += sent
+                    if not stopped.is_set():
+                        try:
+                            await asyncio.wait_for(stopped.wait(), interval * sent)
+                        except asyncio.TimeoutError:
+                            pass
+
+                await stopped.wait()
+                started = time.perf_counter()
+                await ws.send(END.pack(FRAME_END, len(chunks), int(self.args.record_seconds * 1000)))
+                await asyncio.wait_for(done.wait(), 30)
+                self.results.uploads.append((started, time.perf_counter()))
+                self.results.upload_bytes += len(audio)
+                self.results.stored.append(rid)
+                reader.cancel()
+        except Exception as e:
+            self.results.fail(f"stream {type(e).__name__}")
+
+
+    async def _upload(self):
+        audio = self.audio
+        await self._send_event(P.WSEvents.REC_STAGE, {
+            "sessionId": self.meta["id"],
+            "recName": f"load-{self.index}.wav",
+            "duration": int(self.args.record_seconds),
+            "sizeBytes": len(audio),
+        })
+        try:
+            staged = await asyncio.wait_for(self.staged.get(), 30)
+        except asyncio.TimeoutError:
+            self.results.fail("rec_staged timeout")
+            return
+
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=120) as http:
+            res = await http.post(
+                f"http://{self.files}/recordings/{staged['rid']}",
+                files={"file": (f"load-{self.index}.wav", audio, "audio/wav")},
+            )
+        if res.status_code != 200:
+            self.results.fail(f"upload {res.status_code}")
+            return
+        self.results.uploads.append((started, time.perf_counter()))
+        self.results.upload_bytes += len(audio)
+        self.results.stored.append(staged['rid'])
+
+
+    async def _sync_rounds(self, rounds: int):
+        async with self._syncing:
+            for _ in range(rounds):
+                await self.sync.send(TIK.pack(FRAME_TIK, self.clock()))
+                frame = await self._tok.get() # filled by _sync_loop
+                t4 = self.clock()
+                _, t1, t2, t3 = TOK.unpack(frame)
+                theta = ((t2 - t1) + (t3 - t4)) / 2
+                await self.sync.send(REPORT.pack(FRAME_REPORT, theta, (t4 - t1) - (t3 - t2)))
+                self.results.sync_rounds += 1
+
+
+    async def _sync_loop(self):
+        async for frame in self.sync:
+            if not isinstance(frame, bytes):
+                continue
+            if frame[0] == FRAME_TOK and len(frame) == TOK.size:
+                self._tok.put_nowait(frame)
+            elif frame[0] == FRAME_REQUEST and len(frame) == REQUEST.size:
+                asyncio.create_task(self._sync_rounds(REQUEST.unpack(frame)[1]))
+
+
+    async def _battery_loop(self):
+        await asyncio.sleep(random.uniform(0, self.args.battery_interval))
+        while True:
+            self.battery = max(1, self.battery - 1)
+            await self._send_event(P.WSEvents.SESSION_UPDATE, {**self.meta, "battery": self.battery})
+            await asyncio.sleep(self.args.battery_interval)
+
+
+class FakeDashboard:
+    def __init__(self, base: str):
+        self.base = base
+        self.ws = None
+        self.key: Optional[str] = None
+        self.received: int = 0
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.ws = await websockets.connect(f"ws://{self.base}/ws/control", max_size=None)
+        await self.ws.send(json.dumps({"kind": P.WSKind.EVENT.value, "msgType": P.WSEvents.DASHBOARD_INIT.value}))
+        reply = json.loads(await self.ws.recv())
+        self.key = reply["body"]["key"]
+        self._reader = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        async for _ in self.ws:
+            self.received += 1
+
+    async def action(self, action: P.WSActions, sessions: List[FakeSession]):
+        now = time.perf_counter()
+        for s in sessions:
+            s.sent_at = now
+        await self.ws.send(json.dumps({
+            "kind": P.WSKind.ACTION.value,
+            "msgType": action.value,
+            "body": {"id": P.BROADCAST, "triggerTime": None},
+        }))
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        if self.ws:
+            await self.ws.close()
+
+
+class ServerMonitor:
+    """Samples CPU and RSS of the server process (and its children)."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.proc = psutil.Process(pid)
+        self.interval = interval
+        self.cpu: List[float] = []
+        self.rss: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _procs(self) -> List[psutil.Process]:
+        return [self.proc] + self.proc.children(recursive=True)
+
+    async def _run(self):
+        for p in self._procs():
+            p.cpu_percent(None)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                procs = self._procs()
+                self.cpu.append(sum(p.cpu_percent(None) for p in procs))
+                self.rss.append(sum(p.memory_info().rss for p in procs))
+            except psutil.NoSuchProcess:
+                return
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> Dict:
+        if self._task:
+            self._task.cancel()
+        return {
+            "cpuPercent": summary(self.cpu),
+            "rssMB": summary([r / 2**20 for r in self.rss]),
+        }
+
+
+def find_server_pid(port: int) -> Optional[int]:
+    try:
+        for conn in psutil.net_connections(kind="inet"):
+            if conn.laddr and conn.laddr.port == port and conn.status == psutil.CONN_LISTEN:
+                return conn.pid
+    except (psutil.AccessDenied, RuntimeError):
+        pass
+    return None
+
+
+async def wait_for_server(base: str, timeout: float = 30) -> bool:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                await http.get(f"http://{base}/sessions")
+                return True
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    return False
+
+
+def start_skew(sessions: List[FakeSession], action: str) -> Optional[Dict]:
+    fired = [s.fired[action] for s in sessions if action in s.fired]
+    if not fired:
+        return None
+    return {"sessions": len(fired), "missing": len(sessions) - len(fired), "skewMs": max(fired) - min(fired)}
+
+
+async def download_load(base: str, clients: int, results: Results, stop: asyncio.Event):
+    """Keeps clients downloads of stored originals running until stop is set."""
+    async def client(http: httpx.AsyncClient):
+        while not stop.is_set():
+            if not results.stored:
+                await asyncio.sleep(0.1)
+                continue
+            started = time.perf_counter()
+            try:
+                res = await http.get(f"http://{base}/recordings/{random.choice(results.stored)}/original")
+            except httpx.HTTPError as e:
+                results.fail(f"download {type(e).__name__}")
+                continue
+            if res.status_code != 200:
+                results.fail(f"download {res.status_code}")
+                continue
+            results.downloads.append(time.perf_counter() - started)
+            results.download_bytes += len(res.content)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=clients)) as http:
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+    results.download_wall += time.perf_counter() - started
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    base = f"{args.host}:{args.port}"
+    files = f"{args.host}:{args.http_port}" if args.http_port or args.http_workers else base
+    server: Optional[subprocess.Popen] = None
+    worker: Optional[subprocess.Popen] = None
+    http_workers: Optional[subprocess.Popen] = None
+    if args.spawn:
+        env = dict(os.environ, VOCALINK_HTTP_WORKERS=str(args.http_workers)) if args.http_workers else None
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.server:api", "--host", args.host, "--port", str(args.port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env,
+        )
+        # the server's CPU/RSS below leave out the media worker, as with app.py
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "backend.worker"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    if not await wait_for_server(base):
+        raise SystemExit(f"no server on {base}")
+    if args.spawn and args.http_workers:
+        http_workers = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.rest:api", "--host", args.host,
+             "--port", str(args.http_port or P.HTTP_PORT), "--workers", str(args.http_workers)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=dict(os.environ, VOCALINK_LOG_FILE="http.log"),
+        )
+        if not await wait_for_server(files):
+            raise SystemExit(f"no HTTP workers on {files}")
+
+    pid = server.pid if server else find_server_pid(args.port)
+    monitor = ServerMonitor(pid) if pid else None
+    if monitor:
+        monitor.start()
+
+    results = Results()
+    dashboard = FakeDashboard(base)
+    sessions = [FakeSession(i, base, results, args, files) for i in range(args.sessions)]
+
+    try:
+        await dashboard.connect()
+        gate = asyncio.Semaphore(args.ramp)
+        async with httpx.AsyncClient(timeout=30) as http:
+            async def connect(s: FakeSession):
+                async with gate:
+                    try:
+                        await s.connect(http)
+                    except Exception as e:
+                        results.fail(f"connect {type(e).__name__}")
+            await asyncio.gather(*(connect(s) for s in sessions))
+        sessions = [s for s in sessions if s.tasks]
+        print(f"[*] {len(sessions)} sessions active, warming up clock sync for {args.warmup}s")
+        await asyncio.sleep(args.warmup)
+
+        for round in range(args.rounds):
+            for s in sessions:
+                s.fired.clear()
+            downloading = asyncio.Event()
+            downloads = asyncio.create_task(download_load(files, args.downloads, results, downloading)) \
+                if args.downloads else None
+            await dashboard.action(P.WSActions.START_ALL, sessions)
+            await asyncio.sleep(args.record_seconds)
+            skew = start_skew(sessions, P.WSActions.START.value)
+            if skew:
+                results.skew.append(skew)
+
+            first = len(results.uploads)
+            await dashboard.action(P.WSActions.STOP_ALL, sessions)
+            deadline = time.monotonic() + 60
+            while len(results.uploads) - first < len(sessions) and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            downloading.set()
+            if downloads:
+                await downloads
+            done = results.uploads[first:]
+            if done:
+                results.upload_wall += max(end for _, end in done) - min(start for start, _ in done)
+            print(f"[*] round {round + 1}/{args.rounds}: start skew {skew['skewMs'] if skew else '-'}ms, "
+                  f"{len(done)}/{len(sessions)} uploads")
+            await asyncio.sleep(args.pause)
+
+        async with httpx.AsyncClient() as http:
+            server_skew = (await http.get(f"http://{base}/sync/skew")).json()
+
+    finally:
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+        await dashboard.close()
+        usage = monitor.stop() if monitor else None
+        if server:
+            server.terminate()
+            server.wait()
+        if worker:
+            worker.terminate()
+            worker.wait()
+        if http_workers:
+            http_workers.terminate()
+            http_workers.wait()
+
+    return {
+        "sessions": len(sessions),
+        "rounds": args.rounds,
+        "broadcastLatencyMs": summary(results.broadcast),
+        "startSkewMs": summary([s["skewMs"] for s in results.skew]),
+        "serverSkew": server_skew,
+        "uploads": {
+            "seconds": summary([end - start for start, end in results.uploads]),
+            "bytes": results.upload_bytes,
+            "throughputMBps": results.upload_bytes / 2**20 / results.upload_wall if results.upload_wall else None,
+        },
+        "downloads": {
+            "seconds": summary(results.downloads),
+            "bytes": results.download_bytes,
+            "throughputMBps": results.download_bytes / 2**20 / results.download_wall if results.download_wall else None,
+        },
+        "syncRounds": results.sync_rounds,
+        "server": usage,
+        "failures": results.failures,
+    }
+
+
+def print_report(report: Dict):
+    def fmt(s: Dict, unit: str) -> str:
+        if not s or not s["count"]:
+            return "-"
+        return " ".join(f"{k}={s[k]:.1f}{unit}" for k in ("p50", "p90", "p99", "max"))
+
+    print()
+    print(f"sessions          {report['sessions']} x {report['rounds']} rounds")
+    print(f"broadcast latency {fmt(report['broadcastLatencyMs'], 'ms')}")
+    print(f"start skew        {fmt(report['startSkewMs'], 'ms')} (true time, measured by the load generator)")
+    starts = [r for r in report["serverSkew"]["recent"] if r["event"] == P.WSEvents.STARTED.value]
+    if starts:
+        print(f"server skew       max={max(r['skew'] for r in starts)}ms, "
+              f"max error {max(r['maxError'] for r in starts)}ms over {len(starts)} starts (as seen by /sync/skew)")
+    uploads = report["uploads"]
+    print(f"uploads           {fmt(uploads['seconds'], 's')}, {uploads['bytes'] / 2**20:.1f}MB"
+          + (f" at {uploads['throughputMBps']:.1f}MB/s" if uploads["throughputMBps"] else ""))
+    downloads = report["downloads"]
+    if downloads["seconds"]["count"]:
+        print(f"downloads         {fmt(downloads['seconds'], 's')}, {downloads['bytes'] / 2**20:.1f}MB"
+              + (f" at {downloads['throughputMBps']:.1f}MB/s" if downloads["throughputMBps"] else ""))
+    print(f"sync rounds       {report['syncRounds']}")
+    if report["server"]:
+        print(f"server cpu        {fmt(report['server']['cpuPercent'], '%')}")
+        print(f"server rss        {fmt(report['server']['rssMB'], 'MB')}")
+    if report["failures"]:
+        print(f"failures          {report['failures']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate phone sessions and a dashboard against a local server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=P.PORT)
+    parser.add_argument("--spawn", action="store_true", help="start a server for the run (run from the repo root)")
+    parser.add_argument("--http-workers", type=int, default=0, help="with --spawn, also start this many HTTP workers")
+    parser.add_argument("--http-port", type=int, default=0, help=f"upload to and download from HTTP workers here ({P.HTTP_PORT})")
+    parser.add_argument("--downloads", type=int, default=0, help="downloads kept running through each round")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3, help="START_ALL/STOP_ALL cycles")
+    parser.add_argument("--record-seconds", type=float, default=5)
+    parser.add_argument("--pause", type=float, default=2, help="seconds between rounds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of clock sync before the first round")
+    parser.add_argument("--ramp", type=int, default=20, help="sessions connecting at once")
+    parser.add_argument("--max-offset", type=int, default=2000, help="max simulated phone clock offset in ms")
+    parser.add_argument("--battery-interval", type=float, default=30)
+    parser.add_argument("--stream", action="store_true", help="stream recordings while running instead of uploading after stop")
+    parser.add_argument("--shuffle", type=float, default=0.0, help="share of stream chunks sent out of order and twice")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""Replays a control-plane capture against a fresh server.
+
+Record with VOCALINK_CAPTURE=logs/capture.bin.gz, then:
+
+    python -m tools.replay logs/capture.bin.gz                # 1x
+    python -m tools.replay logs/capture.bin.gz --speed 10     # 10x faster
+    python -m tools.replay logs/capture.bin.gz --speed max
+
+Sessions are staged again through POST /sessions and every id the new
+server hands out (session ids, rids) replaces the captured one in later
+frames. The report has the server's handler latency (from /metrics), the
+time to the first reply per message type as seen by the replayer, and how
+far the replies diverged from the captured ones.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+import argparse
+import asyncio
+import json
+import re
+import time
+
+import httpx
+import websockets
+
+import backend.utils.capture as C
+
+
+REMAPPED_KEYS = ("id", "rid", "sessionId")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Conn:
+    """One captured websocket and what happened on it."""
+
+    def __init__(self, conn: int, channel: int, opened: Dict):
+        self.conn = conn
+        self.channel = channel
+        self.path: str = opened["path"]
+        self.query: str = opened["query"]
+        self.expected: List[bytes] = [] # captured OUT frames
+        self.replies: Dict[int, int] = {} # index of an IN, index of the OUT right after it
+        self.received: List[bytes] = []
+        self.pending: Dict[int, Tuple[float, str]] = {} # expected OUT index, (sent at, msgType)
+        self.ws = None
+        self.reader: Optional[asyncio.Task] = None
+
+
+def label(channel: int, payload: bytes) -> str:
+    if channel == C.SYNC:
+        return f"frame:{payload[0]}" if payload else "frame:?"
+    try:
+        msg = json.loads(payload)
+        return f"{msg.get('kind')}:{msg.get('msgType')}"
+    except ValueError:
+        return "invalid"
+
+
+class Replayer:
+    def __init__(self, path: str, target: str, speed: Optional[float]):
+        self.target = target
+        self.speed = speed # None replays as fast as possible
+        self.ids: Dict[str, str] = {} # captured id, replayed id
+        self.conns: Dict[int, Conn] = {}
+        self.timeline: List[Tuple[int, int, int, bytes]] = [] # us, event, conn, payload
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.lag: List[float] = [] # how late frames went out compared to the schedule
+        self._load(path)
+
+
+    def _load(self, path: str):
+        last_in: Dict[int, int] = {}
+        ins: Dict[int, int] = defaultdict(int)
+        for event, channel, us, conn, payload in C.read(path):
+            if event == C.STAGE:
+                self.timeline.append((us, event, 0, payload))
+            elif event == C.OPEN:
+                self.conns[conn] = Conn(conn, channel, json.loads(payload))
+                self.timeline.append((us, event, conn, payload))
+            elif conn not in self.conns:
+                continue # opened before the capture started
+            elif event == C.IN:
+                last_in[conn] = ins[conn]
+                ins[conn] += 1
+                self.timeline.append((us, event, conn, payload))
+            elif event == C.OUT:
+                c = self.conns[conn]
+                if conn in last_in:
+                    c.replies.setdefault(last_in.pop(conn), len(c.expected))
+                c.expected.append(payload)
+            elif event == C.CLOSE:
+                self.timeline.append((us, event, conn, payload))
+        self.timeline.sort(key=lambda item: item[0])
+
+
+    def _remap(self, text: str) -> str:
+        for old, new in self.ids.items():
+            text = text.replace(old, new)
+        return text
+
+
+    def _learn(self, captured: Any, replayed: Any):
+        # ids the server generates show up at the same place in both replies
+        if isinstance(captured, dict) and isinstance(replayed, dict):
+            for key, value in captured.items():
+                other = replayed.get(key)
+                if key in REMAPPED_KEYS and isinstance(value, str) and isinstance(other, str) and value != other:
+                    self.ids.setdefault(value, other)
+                else:
+                    self._learn(value, other)
+        elif isinstance(captured, list) and isinstance(replayed, list):
+            for a, b in zip(captured, replayed):
+                self._learn(a, b)
+
+
+    async def _read(self, c: Conn):
+        try:
+            async for frame in c.ws:
+                now = time.perf_counter()
+                data = frame.encode() if isinstance(frame, str) else frame
+                index = len(c.received)
+                c.received.append(data)
+
+                if index in c.pending:
+                    sent, kind = c.pending.pop(index)
+                    self.latency[kind].append((now - sent) * 1000)
+
+                if c.channel == C.CONTROL and index < len(c.expected):
+                    try:
+                        captured, replayed = json.loads(c.expected[index]), json.loads(data)
+                    except ValueError:
+                        continue
+                    if captured.get("msgType") == replayed.get("msgType"):
+                        self._learn(captured.get("body"), replayed.get("body"))
+        except websockets.ConnectionClosed:
+            pass
+
+
+    async def _stage(self, http: httpx.AsyncClient, payload: bytes):
+        meta = json.loads(payload)
+        res = await http.post(f"http://{self.target}/sessions", json=meta)
+        res.raise_for_status()
+        self.ids[meta["id"]] = res.json()["id"]
+
+
+    async def _open(self, c: Conn):
+        query = self._remap(c.query)
+        url = f"ws://{self.target}{c.path}" + (f"?{query}" if query else "")
+        c.ws = await websockets.connect(url, max_size=None)
+        c.reader = asyncio.create_task(self._read(c))
+
+
+    async def _send(self, c: Conn, index: int, payload: bytes):
+        if c.ws is None:
+            return
+        label_ = label(c.channel, payload)
+        expected = c.replies.get(index)
+        if expected is not None:
+            c.pending[expected] = (time.perf_counter(), label_)
+        try:
+            if c.channel == C.CONTROL:
+                await c.ws.send(self._remap(payload.decode()))
+            else:
+                await c.ws.send(payload)
+        except websockets.ConnectionClosed:
+            pass
+
+
+    async def run(self, drain: float):
+        sent: Dict[int, int] = defaultdict(int)
+        started = time.perf_counter()
+        origin = self.timeline[0][0] if self.timeline else 0 # the capture starts with the server
+        async with httpx.AsyncClient(timeout=30) as http:
+            for us, event, conn, payload in self.timeline:
+                if self.speed:
+                    due = started + (us - origin) / 1e6 / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.lag.append(-delay * 1000)
+
+                if event == C.STAGE:
+                    await self._stage(http, payload)
+                    continue
+
+                c = self.conns[conn]
+                if event == C.OPEN:
+                    try:
+                        await self._open(c)
+                    except Exception as e:
+                        print(f"[!] could not open {c.path}: {e}")
+                elif event == C.IN:
+                    await self._send(c, sent[conn], payload)
+                    sent[conn] += 1
+                elif event == C.CLOSE and c.ws:
+                    await c.ws.close()
+
+        await asyncio.sleep(drain)
+        for c in self.conns.values():
+            if c.ws:
+                await c.ws.close()
+            if c.reader:
+                await asyncio.gather(c.reader, return_exceptions=True)
+        return time.perf_counter() - started
+
+
+    def divergence(self) -> Dict:
+        matched = missing = extra = 0
+        missing_types: Counter = Counter()
+        extra_types: Counter = Counter()
+        for c in self.conns.values():
+            expected = [label(c.channel, p) for p in c.expected]
+            received = [label(c.channel, p) for p in c.received]
+            for op, i1, i2, j1, j2 in SequenceMatcher(None, expected, received, autojunk=False).get_opcodes():
+                if op == "equal":
+                    matched += i2 - i1
+                    continue
+                missing += i2 - i1
+                extra += j2 - j1
+                missing_types.update(expected[i1:i2])
+                extra_types.update(received[j1:j2])
+        total = matched + missing
+        return {
+            "matched": matched,
+            "missing": missing,
+            "extra": extra,
+            "score": round(1 - matched / total, 4) if total else 0.0, # 0 = identical replies
+            "missingTypes": dict(missing_types.most_common(10)),
+            "extraTypes": dict(extra_types.most_common(10)),
+        }
+
+
+METRIC_LINE = re.compile(r'^vocalink_ws_handler_seconds_(bucket|count|sum)\{(.*)\} (\S+)$')
+
+
+def handler_metrics(target: str) -> Dict[Tuple[str, str], Dict]:
+    series: Dict[Tuple[str, str], Dict] = defaultdict(lambda: {"buckets": {}, "count": 0.0, "sum": 0.0})
+    text = httpx.get(f"http://{target}/metrics").text
+    for line in text.splitlines():
+        m = METRIC_LINE.match(line)
+        if not m:
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group(2)))
+        key = (labels["kind"], labels["msgType"])
+        if m.group(1) == "bucket":
+            series[key]["buckets"][labels["le"]] = float(m.group(3))
+        else:
+            series[key][m.group(1)] = float(m.group(3))
+    return series
+
+
+def handler_latency(before: Dict, after: Dict) -> Dict[str, Dict]:
+    report = {}
+    for key, now in after.items():
+        prev = before.get(key, {"buckets": {}, "count": 0.0, "sum": 0.0})
+        count = now["count"] - prev["count"]
+        if count <= 0:
+            continue
+        p99 = None
+        for le, cumulative in now["buckets"].items():
+            if cumulative - prev["buckets"].get(le, 0.0) >= 0.99 * count:
+                p99 = le
+                break
+        report[f"{key[0]}:{key[1]}"] = {
+            "count": int(count),
+            "meanMs": round((now["sum"] - prev["sum"]) / count * 1000, 3),
+            "p99UpperBoundMs": None if p99 in (None, "+Inf") else float(p99) * 1000,
+        }
+    return report
+
+
+async def main_async(args: argparse.Namespace) -> Dict:
+    speed = None if args.speed == "max" else float(args.speed)
+    replayer = Replayer(args.capture, args.target, speed)
+    print(f"[*] {len(replayer.timeline)} frames over {len(replayer.conns)} connections, "
+          f"speed {args.speed}{'x' if speed else ''}")
+
+    before = handler_metrics(args.target)
+    wall = await replayer.run(args.drain)
+    after = handler_metrics(args.target)
+
+    return {
+        "wallSeconds": round(wall, 3),
+        "scheduleLagMs": { # frames sent later than their scaled capture time
+            "late": len(replayer.lag),
+            "p50": round(percentile(replayer.lag, 0.5) or 0, 3),
+            "p99": round(percentile(replayer.lag, 0.99) or 0, 3),
+        },
+        "handlerLatency": handler_latency(before, after),
+        "replyLatencyMs": {
+            kind: {
+                "count": len(v),
+                "p50": round(percentile(v, 0.5), 3),
+                "p99": round(percentile(v, 0.99), 3),
+                "max": round(max(v), 3),
+            }
+            for kind, v in sorted(replayer.latency.items())
+        },
+        "divergence": replayer.divergence(),
+        "remappedIds": len(replayer.ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a VOCALINK_CAPTURE file against a running server.")
+    parser.add_argument("capture")
+    parser.add_argument("--target", default="127.0.0.1:6210")
+    parser.add_argument("--speed", default="1", help="1 for real time, N for N times faster, or max")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for late replies")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()